@@ -1,24 +1,40 @@
-import queue
+import logging
 import sys
+import time
 
 from simplequant.environment import Env
-from simplequant.backtest.datahandler import RQBundleDataHandler
+from simplequant.backtest.datahandler import RQBundleDataHandler, RQMinuteDataHandler
 from simplequant.backtest.portfolio import Portfolio
 from simplequant.backtest.execution import SimulatedExecutionHandler
+from simplequant.backtest.eventbus import EventBus
+from simplequant.backtest.journal import EventJournal
 from simplequant.backtest.performance import Performance
-from simplequant.constant import EventType
+from simplequant.constant import EventType, OrderType
+
+
+logger = logging.getLogger(__name__)
 
 
 class Backtest(Env):
     """
     Enscapsulates the settings and components for carrying out
     an event-driven backtest.
+    interval为'1d'时进行日线回测，为'1m'时进行分钟线回测，分钟线需要先通过Database.importMinuteBars()导入。
+    sparse为True时Portfolio只记录不为0的持仓和市值，股票池很大而持仓很少时可以节省大量内存。
+    Signal、Order和Fill事件以DEBUG级别写入logger（simplequant.backtest.backtest），只有开启DEBUG时才会格式化；
+    最近journal_size条事件保存在self.journal中，出错时可以用self.journal.format()查看。
+    progress为True时在终端原地刷新回测进度，也可以传入函数progress(finished, total)，
+    每progress_interval秒最多调用一次，最后一个交易日一定会调用。
+    silent为True时不显示进度、不记录事件，适合批量回测。
     """
 
+    data_handlers = {'1d': RQBundleDataHandler, '1m': RQMinuteDataHandler}
+
     def __init__(self, Strategy, interval='1d', start=None, end=None, rate=3/10000,
-                 slippage=0.2/100, initial_capital=100000, heartbeat=0, benchmark='000300.XSHG'):
-        if interval != '1d':
-            raise NotImplementedError('暂不支持分钟级别外的回测')
+                 slippage=0.2/100, initial_capital=100000, heartbeat=0, benchmark='000300.XSHG', sparse=False,
+                 progress=True, progress_interval=0.5, journal_size=1000, silent=False):
+        if interval not in self.data_handlers:
+            raise NotImplementedError('暂不支持日线和分钟线以外的回测')
         else:
             self.interval = interval
 
@@ -29,35 +45,56 @@ class Backtest(Env):
         self.initial_capital = initial_capital
         self.heartbeat = heartbeat
         self.benchmark = benchmark
+        self.sparse = sparse
+        self.progress_setting = progress  # 传入的原始参数，changeParameters()重新初始化时使用
+        self.progress = None if silent or not progress else (self.printProgress if progress is True else progress)
+        self.progress_interval = progress_interval
+        self.journal_size = journal_size
+        self.silent = silent
+        self.journal = None if silent or not journal_size else EventJournal(journal_size)
 
         # 初始化需要哪些参数要重新确定
-        self.data_handler = RQBundleDataHandler(self.start, self.end)
-        self.portfolio = Portfolio(self.data_handler, self.initial_capital)
+        self.data_handler = self.data_handlers[interval](self.start, self.end, Strategy.universe)
+        self.portfolio = Portfolio(self.data_handler, self.initial_capital, self.sparse)
         self.execution_handler = SimulatedExecutionHandler(self.data_handler, self.portfolio, self.rate, self.slippage)
         self.strategy = Strategy(self.portfolio)
         self.performance = None
 
-        # 优先级队列，一共使用到两个级别，OrderEvent和FillEvent优先，MarketEvent和SignalEvent次优
-        self.events_queue = queue.PriorityQueue()
+        # 事件总线，一共使用到两个级别，OrderEvent、FillEvent和CancelEvent优先，MarketEvent和SignalEvent次优
+        self.events_queue = EventBus()
+        self.events_queue.register(EventType.MARKET, self._handleMarket)
+        self.events_queue.register(EventType.SIGNAL, self._handleSignal)
+        self.events_queue.register(EventType.ORDER, self._handleOrder)
+        self.events_queue.register(EventType.FILL, self._handleFill)
+        self.events_queue.register(EventType.CANCEL, self._handleCancel)
+        self._order_events = []
+        self._day_end = False
+        self._debug = False
 
     def changeParameters(self, **args):
         for key, value in args.items():
-            if key not in ['strategy', 'interval', 'start', 'end', 'rate', 'slippage', 'initial_capital', 'heartbeat']:
+            if key not in ['strategy', 'interval', 'start', 'end', 'rate', 'slippage', 'initial_capital', 'heartbeat',
+                           'sparse', 'progress', 'progress_interval', 'journal_size', 'silent']:
                 raise ValueError('输入了无效的参数')
 
         for key, value in args.items():
-            self.__dict__[key] = value
+            self.__dict__['progress_setting' if key == 'progress' else key] = value
         self.__init__(Strategy=self.strategy, interval=self.interval, start=self.start, end=self.end, rate=self.rate,
-                      slippage=self.slippage, initial_capital=self.initial_capital, heartbeat=self.heartbeat)
+                      slippage=self.slippage, initial_capital=self.initial_capital, heartbeat=self.heartbeat,
+                      sparse=self.sparse, progress=self.progress_setting, progress_interval=self.progress_interval,
+                      journal_size=self.journal_size, silent=self.silent)
 
     def run(self):
         """
         Executes the backtest.
-        当已经是最后一条数据的时候，self.data_handler.continue_backtest仍然是True，updateBars之后变为False，
-        并且没有新的MarketEvent被插入队列，所以进入内层循环时队列是空的，直接break，不会出错
+        每次updateBars()放入一根bar的MarketEvent，然后由事件总线处理完这根bar产生的全部事件，
+        updateBars()抛出StopIteration时回测结束。
+        同一根bar产生的OrderEvent先收集起来，队列清空后一次性交给execution_handler批量撮合，再依次更新Portfolio
         """
         total = len(self.data_handler.getTradingDates())
         fininshed = 0
+        last_report = 0
+        self._debug = not self.silent and logger.isEnabledFor(logging.DEBUG)
         while True:
             # Update the market bars
             try:
@@ -66,34 +103,72 @@ class Backtest(Env):
                 break
 
             # Handle the events
-            while True:
-                try:
-                    event = self.events_queue.get(block=False)[1]  # 返回一个元组，第一个元素是优先级，第二个是事件
-                except queue.Empty:
-                    fininshed += 1
-                    sys.stdout.write('\r回测进度：{p}% ({f}/{t})\n'.format(p=round(fininshed/total*100, 2),
-                                                                      f=fininshed, t=total))
-                    sys.stdout.flush()
-                    break
-                else:
-                    if event is not None:
-                        if event.type == EventType.MARKET:
-                            self.portfolio.updateFromMarket(event)
-                            self.strategy.handleBar(self.events_queue, event)  # 需要调整
-                        elif event.type == EventType.SIGNAL:
-                            print(event)
-                            self.portfolio.updateSignal(self.events_queue, event)
-                        elif event.type == EventType.ORDER:
-                            print(event)
-                            self.execution_handler.executeOrder(self.events_queue, event)
-                        elif event.type == EventType.FILL:
-                            print(event)
-                            self.portfolio.updateFromFill(event)
-
-        self.performance = Performance(self.initial_capital, self.portfolio.all_positions,
-                                       self.portfolio.all_holdings, self.benchmark)
+            self.events_queue.drain()
+            if self._order_events:
+                self._applyFills(self.execution_handler.executeOrders(self._order_events))
+                for order_event in self._order_events:  # 市价单已经处理完，归还给Portfolio复用，限价单仍在限价单簿中
+                    if order_event.order_type == OrderType.MARKET:
+                        self.portfolio.order_pool.release(order_event)
+                self._order_events = []
+            if self._day_end:
+                fininshed += 1
+                if self.progress is not None:
+                    now = time.monotonic()
+                    if now - last_report >= self.progress_interval or fininshed == total:
+                        last_report = now
+                        self.progress(fininshed, total)
+
+        # Performance只用到日期和总资产，传入汇总账本，稀疏账本不必展开成日期×股票的稠密表
+        summary = self.portfolio.summary
+        self.performance = Performance(self.initial_capital, summary, summary, self.benchmark)
         return self.performance
 
+    def _handleMarket(self, event):
+        self._day_end = event.record
+        self._applyFills(self.execution_handler.matchOrders(event))  # 挂单的限价单先在这根bar内成交
+        self.portfolio.updateFromMarket(event)
+        self.strategy.handleBar(self.events_queue, event)  # 需要调整
+
+    def _handleSignal(self, event):
+        self._log(event)
+        self.portfolio.updateSignal(self.events_queue, event)
+
+    def _handleOrder(self, event):
+        self._log(event)
+        self._order_events.append(event)
+
+    def _handleFill(self, event):
+        self._log(event)
+        self.portfolio.updateFromFill(event)
+
+    def _handleCancel(self, event):
+        self._log(event)
+        self.execution_handler.cancelOrders(event.symbol)
+
+    def _applyFills(self, fill_batch):
+        if self._debug:
+            for fill_event in fill_batch:
+                logger.debug('%s', fill_event)
+        if self.journal is not None:
+            self.journal.record(fill_batch)
+        self.portfolio.updateFromFills(fill_batch)
+
+    def _log(self, event):
+        if self._debug:
+            logger.debug('%s', event)
+        if self.journal is not None:
+            self.journal.record(event)
+
+    @staticmethod
+    def printProgress(finished, total):
+        """
+        默认的进度显示，在同一行原地刷新，结束时换行
+        """
+        sys.stdout.write('\r回测进度：{p}% ({f}/{t})'.format(p=round(finished/total*100, 2), f=finished, t=total))
+        if finished == total:
+            sys.stdout.write('\n')
+        sys.stdout.flush()
+
     def report(self):
         return self.performance.report()
 
@@ -107,21 +182,21 @@ class Backtest(Env):
         :param end:
         :return:
         '''
+        calendar = Env._database.calendar()
+        first_date = calendar.getStartDate()
+        last_date = Env._database.getEndDate()
+
         if isinstance(start, str):
             start_list = start.split('-')
             start = ''.join(start_list)
             start = int(start)
-            if start < Env._database.getStartDate():
-                start = Env._database.getStartDate()
-            elif start >= Env._database.getEndDate():
-                raise ValueError('回测开始时间必须在{date}之前，{date}之后的行情尚未更新'.format(date=Env._database.getEndDate()))
-        elif isinstance(start, int):
-            if start < Env._database.getStartDate():
-                start = Env._database.getStartDate()
-            elif start >= Env._database.getEndDate():
-                raise ValueError('回测开始时间必须在{date}之前，{date}之后的行情尚未更新'.format(date=Env._database.getEndDate()))
+        if isinstance(start, int):
+            if start < first_date:
+                start = first_date
+            elif start >= last_date:
+                raise ValueError('回测开始时间必须在{date}之前，{date}之后的行情尚未更新'.format(date=last_date))
         elif start is None:
-            start = Env._database.getStartDate()
+            start = first_date
         else:
             raise ValueError('start参数应为形如2005-01-04形式的字符串或者形如20050104的整型数值')
 
@@ -129,17 +204,13 @@ class Backtest(Env):
             end_list = end.split('-')
             end = ''.join(end_list)
             end = int(end)
-            if end > Env._database.getEndDate():
-                end = Env._database.getEndDate()
-            elif end <= Env._database.getStartDate():
-                raise ValueError('回测结束时间必须在{date}之后，数据库未存储{date}之前的行情'.format(date=Env._database.getStartDate()))
-        elif isinstance(end, int):
-            if end > Env._database.getEndDate():
-                end = Env._database.getEndDate()
-            elif end <= Env._database.getStartDate():
-                raise ValueError('回测结束时间必须在{date}之后，数据库未存储{date}之前的行情'.format(date=Env._database.getStartDate()))
+        if isinstance(end, int):
+            if end > last_date:
+                end = last_date
+            elif end <= first_date:
+                raise ValueError('回测结束时间必须在{date}之后，数据库未存储{date}之前的行情'.format(date=first_date))
         elif end is None:
-            end = Env._database.getEndDate()
+            end = last_date
         else:
             raise ValueError('end参数应为形如2020-05-29形式的字符串或者形如20200529的整型数值')
 
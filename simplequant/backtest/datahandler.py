@@ -1,10 +1,11 @@
 from abc import ABCMeta, abstractmethod
-from queue import PriorityQueue
+import numpy as np
 
 from simplequant.environment import Env
 from simplequant.backtest.event import MarketEvent
+from simplequant.backtest.eventbus import EventBus
 from simplequant.backtest.exception import NotTradable
-from simplequant.constant import OrderTime
+from simplequant.constant import Direction, OrderTime, PRICE_FIELDS
 
 
 class BaseDataHandler(Env):
@@ -19,8 +20,6 @@ class BaseDataHandler(Env):
     """
     __metaclass__ = ABCMeta
 
-    _database = Env._database
-
     @abstractmethod
     def updateBars(self, events):
         """
@@ -30,25 +29,112 @@ class BaseDataHandler(Env):
         """
         raise NotImplementedError("Should implement update_bars()")
 
+    @abstractmethod
+    def getLatestBars(self, symbol, n=1, fields=None):
+        """
+        Returns the last n bars of symbol up to the current bar.
+        """
+        raise NotImplementedError("Should implement getLatestBars()")
+
+    @abstractmethod
+    def history(self, n, field):
+        """
+        Returns the last n values of field for every symbol.
+        """
+        raise NotImplementedError("Should implement history()")
+
+    @staticmethod
+    def _selectFields(bars, field_index, fields):
+        """
+        在bars的最后一维上选出fields，单个字段和连续的字段返回视图，不连续的字段返回副本
+        """
+        if fields is None:
+            return bars
+        if isinstance(fields, str):
+            return bars[..., field_index[fields]]
+        field_ids = [field_index[field] for field in fields]
+        if field_ids == list(range(field_ids[0], field_ids[0] + len(field_ids))):
+            return bars[..., field_ids[0]:field_ids[0] + len(field_ids)]
+        return bars[..., field_ids]
+
 
 class RQBundleDataHandler(BaseDataHandler):
-    def __init__(self, start, end):
+    """
+    从BarStore按整数索引读取行情。symbol_data是 dates × symbols × fields 的三维数组，只覆盖回测区间，
+    每个交易日的行情是其中的一个 symbols × fields 的切片，直接作为MarketEvent的内容，不发生复制。
+    universe为None时包含全市场的股票，symbol_data是磁盘上的存储转置后的视图，不会把全市场的行情读入内存；
+    否则按块把股票池内的股票读入预先分配好的数组，每个交易日的行情在内存中连续存放。
+    策略用到股票池以外的股票时再通过subscribe()按需加载，数组预留了panel_spare_columns个空余的列，
+    空余的列用完时列数翻倍，加入股票时一般不需要重新分配。
+
+    trade_status是 dates × symbols 的uint8数组，按位记录每只股票每个交易日的交易状态：是否有成交，
+    以及开盘价、收盘价是否处于涨停或跌停，下单时只需查一次数组。指定股票池时在加载行情时一次性算出；
+    全市场回测时每只股票在第一次下单时才计算，不在启动时读取全市场的行情，没有计算过的列为0。
+    """
+
+    panel_chunk_size = 256  # 读入股票池、计算交易状态时每次处理的股票数量
+    panel_spare_columns = 16  # 股票池以外的股票预留的列数
+    TRADED = 1
+    OPEN_LIMIT_UP = 2
+    OPEN_LIMIT_DOWN = 4
+    CLOSE_LIMIT_UP = 8
+    CLOSE_LIMIT_DOWN = 16
+
+    def __init__(self, start, end, universe=None):
         if Env._database.isLoaded() is False:
             Env._database.load()
 
-        self.symbol_list = Env._database.getStockList()
-        self.trading_dates = self._adjustTradingDates(start, end)
+        self.bar_store = Env._database.barStore()
+        self.calendar = Env._database.calendar()
+        self.field_index = self.bar_store.field_index
+        self.trading_dates = self._adjustTradingDates(self.bar_store.dates, start, end)
         self.trading_dates_generator = self._datesGenerator(self.trading_dates)
-        self.symbol_data = self._adjustSymbolData(self.trading_dates)
-        self.tradable = self._isTradable(self.trading_dates)
+        self.date_slice = self._getDateSlice(self.bar_store, self.trading_dates)
+
+        self.symbol_list = self._resolveUniverse(self.bar_store, universe)
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbol_list)}
+        self._panel, traded = self._adjustSymbolData(self.bar_store, self.symbol_list, self.date_slice,
+                                                     universe is None, self.panel_chunk_size,
+                                                     self.panel_spare_columns)
+        if universe is None:
+            self._status_panel = np.zeros(traded.shape, dtype=np.uint8)
+            self._status_ready = np.zeros(len(self.symbol_list), dtype=bool)  # 全市场时每只股票的交易状态是否已经计算
+        else:
+            self._status_panel = self._tradeStatus(self._panel, traded, self.field_index, self.panel_chunk_size)
+            self._status_ready = None
+        self.symbol_data = self._panel[:, :len(self.symbol_list), :]
+        self.trade_status = self._status_panel[:, :len(self.symbol_list)]
+        self.whole_market = universe is None
+        self._listed_index = {}  # {股票在存储中的序号: 第一个有成交的交易日在存储中的位置}，getLatestBars()用到时逐只计算
+        self.subscribe_listeners = []
         self.date = None
+        self.date_index = -1
+
+    @staticmethod
+    def _adjustTradingDates(store_dates, start, end):
+        return Env._database.calendar().getTradingDates(max(start, store_dates[0]), min(end, store_dates[-1]))
 
     @staticmethod
-    def _adjustTradingDates(start, end):
-        trading_dates = Env._database.getTradingDates()
-        left = trading_dates.searchsorted(start)
-        right = trading_dates.searchsorted(end, side='right')
-        return trading_dates[left:right]
+    def _getDateSlice(bar_store, trading_dates):
+        left = bar_store.getDateIndex(trading_dates[0])
+        return slice(left, left + len(trading_dates))
+
+    @staticmethod
+    def _resolveUniverse(bar_store, universe):
+        """
+        :param universe: None表示全市场；也可以是股票代码的列表，或者接收全市场股票列表、返回股票池的函数
+        """
+        if universe is None:
+            return list(bar_store.symbols)
+        if callable(universe):
+            universe = universe(list(bar_store.symbols))
+        symbol_list = []
+        for symbol in universe:
+            if symbol not in bar_store.symbol_index:
+                raise ValueError('股票池中的{}在数据库中没有行情'.format(symbol))
+            if symbol not in symbol_list:
+                symbol_list.append(symbol)
+        return symbol_list
 
     @staticmethod
     def _datesGenerator(dates):
@@ -56,21 +142,102 @@ class RQBundleDataHandler(BaseDataHandler):
             yield date
 
     @staticmethod
-    def _adjustSymbolData(trading_dates):
-        symbol_data = Env._database.allHistoryBars()
-        for symbol, bars in symbol_data.items():
-            symbol_data[symbol] = bars.reindex(index=trading_dates, method='ffill').fillna(0)
-            # 直接把没有数据的价格和交易量置零吧
-        return symbol_data
+    def _adjustSymbolData(bar_store, symbol_list, date_slice, whole_market, chunk_size, spare_columns=0):
+        """
+        全市场时返回存储转置后的视图，不发生复制；否则把股票池内的股票分块读入预先分配的 dates × symbols × fields 数组，
+        同一时间只有一块股票的行情需要额外的内存
+        :param spare_columns: 数组在股票池之外多预留的列数，供subscribe()使用
+        """
+        if whole_market:
+            return bar_store.bars[:, date_slice, :].transpose(1, 0, 2), bar_store.traded[:, date_slice].T
+        store_index = [bar_store.symbol_index[symbol] for symbol in symbol_list]
+        n_dates = date_slice.stop - date_slice.start
+        capacity = max(len(store_index) + spare_columns, 1)
+        panel = np.zeros((n_dates, capacity, len(bar_store.fields)))
+        traded = np.zeros((n_dates, capacity), dtype=np.bool_)
+        for i in range(0, len(store_index), chunk_size):
+            chunk = store_index[i:i + chunk_size]
+            panel[:, i:i + len(chunk), :] = bar_store.bars[chunk, date_slice, :].transpose(1, 0, 2)
+            traded[:, i:i + len(chunk)] = bar_store.traded[chunk, date_slice].T
+        return panel, traded
 
-    @staticmethod
-    def _isTradable(trading_dates):
-        symbol_data = Env._database.allHistoryBars()
-        tradable = {}
-        for symbol, bars in symbol_data.items():
-            bars = bars.reindex(index=trading_dates)
-            tradable[symbol] = bars.isna().apply(lambda row: not any(row), axis=1)
-        return tradable
+    @classmethod
+    def _tradeStatus(cls, symbol_data, traded, field_index, chunk_size):
+        """
+        按块对所有股票同时计算交易状态。价格和涨跌停价都经过同样的前复权，相差不超过百万分之一即视为处于涨跌停
+        :param symbol_data: dates × symbols × fields
+        :param traded: dates × symbols 的布尔数组，是否有成交
+        :return: dates × symbols 的uint8数组
+        """
+        status = np.asarray(traded).astype(np.uint8) * cls.TRADED
+        if 'limit_up' not in field_index or 'limit_down' not in field_index:
+            return status
+        flags = (('open', cls.OPEN_LIMIT_UP, cls.OPEN_LIMIT_DOWN), ('close', cls.CLOSE_LIMIT_UP, cls.CLOSE_LIMIT_DOWN))
+        for i in range(0, symbol_data.shape[1], chunk_size):
+            chunk = np.asarray(symbol_data[:, i:i + chunk_size, :])
+            chunk_status = status[:, i:i + chunk.shape[1]]
+            limit_up = chunk[:, :, field_index['limit_up']]
+            limit_down = chunk[:, :, field_index['limit_down']]
+            for field, up_flag, down_flag in flags:
+                price = chunk[:, :, field_index[field]]
+                chunk_status[(chunk_status > 0) & (limit_up > 0) & (price >= limit_up * (1 - 1e-6))] |= up_flag
+                chunk_status[(chunk_status > 0) & (limit_down > 0) & (price <= limit_down * (1 + 1e-6))] |= down_flag
+        return status
+
+    def _ensureTradeStatus(self, symbol_indices):
+        """
+        全市场回测时计算symbol_indices中还没有计算过的股票的交易状态，只读取这些股票的行情
+        """
+        if self._status_ready is None:
+            return
+        pending = np.unique(symbol_indices[~self._status_ready[symbol_indices]])
+        if not len(pending):
+            return
+        bars = self.bar_store.bars[pending, self.date_slice, :].transpose(1, 0, 2)
+        traded = self.bar_store.traded[pending, self.date_slice].T
+        self._status_panel[:, pending] = self._tradeStatus(bars, traded, self.field_index, self.panel_chunk_size)
+        self._status_ready[pending] = True
+
+    def _growPanel(self):
+        """
+        预留的列用完时把数组的列数翻倍
+        """
+        n_dates, capacity, n_fields = self._panel.shape
+        panel = np.zeros((n_dates, capacity * 2, n_fields))
+        status = np.zeros((n_dates, capacity * 2), dtype=np.uint8)
+        panel[:, :capacity, :] = self._panel
+        status[:, :capacity] = self._status_panel
+        self._panel, self._status_panel = panel, status
+
+    def subscribe(self, symbol):
+        """
+        把股票池以外的股票加入回测，返回它在symbol_data中的序号。已在股票池中的股票直接返回序号。
+        加入后通知通过addSubscribeListener()注册的对象（如Portfolio）同步增加这只股票。
+        """
+        if symbol in self.symbol_index:
+            return self.symbol_index[symbol]
+        if symbol not in self.bar_store.symbol_index:
+            raise NotTradable('数据库中没有{s}的行情，不可交易'.format(s=symbol))
+
+        n = len(self.symbol_list)
+        if n == self._panel.shape[1]:
+            self._growPanel()
+        store_index = self.bar_store.symbol_index[symbol]
+        self._panel[:, n, :] = self.bar_store.bars[store_index, self.date_slice, :]
+        traded = self.bar_store.traded[store_index, self.date_slice][:, None]
+        self._status_panel[:, n:n + 1] = self._tradeStatus(self._panel[:, n:n + 1, :], traded, self.field_index,
+                                                           self.panel_chunk_size)
+        self.symbol_data = self._panel[:, :n + 1, :]
+        self.trade_status = self._status_panel[:, :n + 1]
+        self.symbol_list.append(symbol)
+        self.symbol_index[symbol] = n
+
+        for listener in self.subscribe_listeners:
+            listener(symbol)
+        return self.symbol_index[symbol]
+
+    def addSubscribeListener(self, listener):
+        self.subscribe_listeners.append(listener)
 
     def updateBars(self, events_queue):
         try:
@@ -78,28 +245,112 @@ class RQBundleDataHandler(BaseDataHandler):
         except StopIteration:
             raise StopIteration('回测结束')
         else:
-            curr_symbol_data = {}
-            for symbol in self.symbol_list:
-                curr_symbol_data[symbol] = self.symbol_data[symbol].loc[date, :]  # 每个curr_symbol_data[symbol]都是Series
-
-            market_event = MarketEvent(date, curr_symbol_data)
+            self.date_index += 1
+            # 每只股票当日的行情是symbol_data[self.date_index]中的一行，行号即symbol_index中的序号
+            row = self.symbol_data[self.date_index]
+            row.setflags(write=False)
+            market_event = MarketEvent(date, row, symbol_index=self.symbol_index, field_index=self.field_index)
             events_queue.put((market_event.priority, market_event))
 
             self.date = date
 
-    def getSimulatedRealTimePrice(self, symbol, datetime, order_time):
-        try:
-            tradable = self.tradable[symbol][datetime]
-        except IndexError:
+    def getSimulatedRealTimePrice(self, symbol, datetime, order_time, direction=None):
+        """
+        :param direction: 给出时检查涨跌停：以涨停价买入或以跌停价卖出时视为不可交易
+        """
+        date_index = self.trading_dates.searchsorted(datetime)
+        if date_index >= len(self.trading_dates) or self.trading_dates[date_index] != datetime:
             raise NotTradable('回测已进入最后一天，不能继续在第二天下单')
+        symbol_index = self.subscribe(symbol)
+        self._ensureTradeStatus(np.array([symbol_index]))
+        status = self.trade_status[date_index, symbol_index]
+        if not status & self.TRADED:
+            raise NotTradable('{d}日{s}停牌不可交易'.format(d=datetime, s=symbol))
+        if order_time == OrderTime.OPEN:
+            field, limit_up, limit_down = 'open', self.OPEN_LIMIT_UP, self.OPEN_LIMIT_DOWN
         else:
-            if tradable:
-                if order_time == OrderTime.OPEN:
-                    return self.symbol_data[symbol].loc[datetime, 'open']
-                elif order_time == OrderTime.CLOSE:
-                    return self.symbol_data[symbol].loc[datetime, 'close']
-            else:
-                raise NotTradable('{d}日{s}停牌不可交易'.format(d=datetime, s=symbol))
+            field, limit_up, limit_down = 'close', self.CLOSE_LIMIT_UP, self.CLOSE_LIMIT_DOWN
+        if direction == Direction.LONG and status & limit_up:
+            raise NotTradable('{d}日{s}涨停不可买入'.format(d=datetime, s=symbol))
+        if direction in (Direction.SHORT, Direction.NET) and status & limit_down:
+            raise NotTradable('{d}日{s}跌停不可卖出'.format(d=datetime, s=symbol))
+        return self.symbol_data[date_index, symbol_index, self.field_index[field]]
+
+    def getSimulatedRealTimePrices(self, symbol_indices, datetime, order_time, buy):
+        """
+        getSimulatedRealTimePrice()的批量版本，一次取出同一时间多笔订单的成交价，股票必须已经subscribe()
+        :param symbol_indices: 股票序号数组
+        :param buy: 与symbol_indices对应的布尔数组，True表示买入，False表示卖出，用于检查涨跌停
+        :return: (prices, tradable)，不可交易的订单价格为0
+        """
+        symbol_indices = np.asarray(symbol_indices, dtype=np.int64)
+        date_index = self.trading_dates.searchsorted(datetime)
+        if date_index >= len(self.trading_dates) or self.trading_dates[date_index] != datetime:
+            return np.zeros(len(symbol_indices)), np.zeros(len(symbol_indices), dtype=bool)
+        self._ensureTradeStatus(symbol_indices)
+        status = self.trade_status[date_index, symbol_indices]
+        if order_time == OrderTime.OPEN:
+            field, limit_up, limit_down = 'open', self.OPEN_LIMIT_UP, self.OPEN_LIMIT_DOWN
+        else:
+            field, limit_up, limit_down = 'close', self.CLOSE_LIMIT_UP, self.CLOSE_LIMIT_DOWN
+        limit = np.where(buy, status & limit_up, status & limit_down)
+        tradable = ((status & self.TRADED) != 0) & (limit == 0)
+        prices = np.where(tradable, self.symbol_data[date_index, symbol_indices, self.field_index[field]], 0.)
+        return prices, tradable
+
+    def getPriceRanges(self, symbol_indices, datetime):
+        """
+        撮合限价单用，股票必须已经subscribe()。涨跌停的检查与getSimulatedRealTimePrices()相同，
+        开盘或收盘涨停时买单不能成交，开盘或收盘跌停时卖单不能成交
+        :return: (opens, highs, lows, can_buy, can_sell)，datetime不是回测区间内的交易日时全部不可交易
+        """
+        symbol_indices = np.asarray(symbol_indices, dtype=np.int64)
+        date_index = self.trading_dates.searchsorted(datetime)
+        if date_index >= len(self.trading_dates) or self.trading_dates[date_index] != datetime:
+            zeros = np.zeros(len(symbol_indices))
+            closed = np.zeros(len(symbol_indices), dtype=bool)
+            return zeros, zeros, zeros, closed, closed
+        bars = self.symbol_data[date_index, symbol_indices]
+        self._ensureTradeStatus(symbol_indices)
+        status = self.trade_status[date_index, symbol_indices]
+        traded = (status & self.TRADED) != 0
+        can_buy = traded & ((status & (self.OPEN_LIMIT_UP | self.CLOSE_LIMIT_UP)) == 0)
+        can_sell = traded & ((status & (self.OPEN_LIMIT_DOWN | self.CLOSE_LIMIT_DOWN)) == 0)
+        return (bars[:, self.field_index['open']], bars[:, self.field_index['high']],
+                bars[:, self.field_index['low']], can_buy, can_sell)
+
+    def getLatestBars(self, symbol, n=1, fields=None):
+        """
+        返回symbol截至当前交易日的最近n根日线，直接取自BarStore的视图，不发生复制，也不需要先subscribe()。
+        回测开始之前的历史同样可以取到，上市以来不足n根时返回的bar少于n根；停牌日沿用前一交易日的行情。
+        :param fields: None表示全部字段，返回 n × fields 的数组；字符串表示单个字段，返回长度为n的一维数组；
+                       也可以是字段列表，字段在存储中不连续时返回的是副本
+        """
+        if symbol not in self.bar_store.symbol_index:
+            raise KeyError('数据库中没有{}的行情'.format(symbol))
+        store_index = self.bar_store.symbol_index[symbol]
+        if store_index not in self._listed_index:  # 上市之前的行情为0，不返回；只读取这一只股票的traded
+            self._listed_index[store_index] = int(np.argmax(self.bar_store.traded[store_index]))
+        right = self.date_slice.start + self.date_index + 1
+        left = min(max(right - n, self._listed_index[store_index]), right)
+        bars = self.bar_store.bars[store_index, left:right]
+        return self._selectFields(bars, self.field_index, fields)
+
+    def history(self, n, field):
+        """
+        返回所有股票截至当前交易日的最近n个field值，n × symbols 的数组，列的顺序与getSymbolList()一致，上市之前的值为0。
+        在回测区间内时是symbol_data的视图；需要回测开始之前的历史时从BarStore读取，只有全市场回测时是视图
+        """
+        field_id = self.field_index[field]
+        right = self.date_index + 1
+        if n <= right:
+            return self.symbol_data[right - n:right, :, field_id]
+        store_right = self.date_slice.start + right
+        store_left = max(store_right - n, 0)
+        if self.whole_market:
+            return self.bar_store.bars[:, store_left:store_right, field_id].T
+        store_index = [self.bar_store.symbol_index[symbol] for symbol in self.symbol_list]
+        return self.bar_store.bars[store_index, store_left:store_right, field_id].T
 
     def getSymbolList(self):
         return self.symbol_list
@@ -107,21 +358,269 @@ class RQBundleDataHandler(BaseDataHandler):
     def getTradingDates(self):
         return self.trading_dates
 
+    def getSymbolIndex(self):
+        return self.symbol_index
+
+    def getFieldIndex(self):
+        return self.field_index
+
     def nextTradingDate(self, datetime):
         try:
-            ind = self.trading_dates.searchsorted(datetime, side='right')
-            return self.trading_dates[ind]
+            post = self.calendar.nextTradingDate(datetime)
         except IndexError:
             raise NotTradable('回测已进入最后一天，不能继续在第二天下单')
+        if post > self.trading_dates[-1]:
+            raise NotTradable('回测已进入最后一天，不能继续在第二天下单')
+        return post
+
+
+
+class RQMinuteDataHandler(BaseDataHandler):
+    """
+    分钟线回测的行情。逐个交易日从MinuteBarStore读取股票池内的分钟线，每分钟发出一个MarketEvent，
+    内存中只保留当前交易日（以及下单时按需预读的下一个交易日），不会读入全部历史。
+    价格用日线的累计除权因子前复权，复权基准与日线的BarStore相同，两者的价格可以直接比较；
+    没有成交的分钟沿用之前最近一分钟的行情。
+    MarketEvent.datetime为形如201701030931的整数，只有每日最后一分钟的record为True。
+    """
+    def __init__(self, start, end, universe=None):
+        self.minute_store = Env._database.minuteBarStore()
+        self.ex_cum_factor_table = Env._database.exCumFactorTable()
+        self.adjust_orig = self._storeAdjustOrig(Env._database.barStore(), self.ex_cum_factor_table)
+        self.field_index = self.minute_store.field_index
+
+        store_dates = self.minute_store.getDates()
+        self.trading_dates = store_dates[(store_dates >= start) & (store_dates <= end)]
+        if len(self.trading_dates) == 0:
+            raise ValueError('分钟线存储中没有{s}至{e}的数据，请先通过Database.importMinuteBars()导入'.format(s=start, e=end))
+
+        self.symbol_list = RQBundleDataHandler._resolveUniverse(self.minute_store, universe)
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbol_list)}
+        self.subscribe_listeners = []
+
+        self.day_index = -1
+        self.date = None
+        self.times = None
+        self.symbol_data = None  # 当前交易日 minutes × symbols × fields
+        self.tradable = None  # 当前交易日 minutes × symbols
+        self.minute_index = -1
+        self._next_day = None  # 预读的下一个交易日(day_index, times, symbol_data, tradable)
+        self._bars_generator = self._barsGenerator()
+
+    @staticmethod
+    def _storeAdjustOrig(bar_store, ex_cum_factor_table):
+        """
+        日线BarStore的前复权基准，YYYYMMDDHHMMSS格式的整数。早先生成的存储没有记录基准，
+        当时以生成存储的时间为基准，与以最后一个除权日为基准的结果相同
+        """
+        if bar_store.adjust_orig is not None:
+            return int(bar_store.adjust_orig)
+        ex_dates = ex_cum_factor_table.ex_dates
+        return int(ex_dates[-1]) if len(ex_dates) > 0 else 0
+
+    def _loadDay(self, date, symbol_list, carry):
+        """
+        读取、复权并向前填充一个交易日的分钟线
+        :param carry: symbols × fields，前一交易日最后一分钟的行情，用于填充当日开盘前没有成交的股票
+        """
+        symbol_ids = [self.minute_store.symbol_index[symbol] for symbol in symbol_list]
+        times, bars = self.minute_store.loadDay(date, symbol_ids)
+
+        code_ids = [self.ex_cum_factor_table.code_index.get(symbol, -1) for symbol in symbol_list]
+        day_int = np.full(len(code_ids), int(date) * 1000000, dtype=np.uint64)
+        orig_int = np.full(len(code_ids), self.adjust_orig, dtype=np.uint64)
+        factors = self.ex_cum_factor_table.lookup(code_ids, day_int) / self.ex_cum_factor_table.lookup(code_ids, orig_int)
+        for field, i in self.field_index.items():
+            if field in PRICE_FIELDS:
+                bars[:, :, i] *= factors
+            elif field == 'volume':
+                bars[:, :, i] /= factors
+
+        close = bars[:, :, self.field_index['close']]
+        tradable = ~np.isnan(close) & (bars[:, :, self.field_index['volume']] > 0)
+        latest = np.where(~np.isnan(close), np.arange(len(times))[:, None], -1)
+        latest = np.maximum.accumulate(latest, axis=0)
+        filled = bars[np.maximum(latest, 0), np.arange(len(symbol_list))[None, :], :]
+        filled[latest < 0] = carry[np.nonzero(latest < 0)[1]]
+        return times, filled, tradable
+
+    def _carry(self):
+        if self.symbol_data is None:
+            return np.zeros((len(self.symbol_list), len(self.field_index)))
+        return self.symbol_data[-1]
+
+    def _peekNextDay(self):
+        """
+        预读下一个交易日，已在回测最后一天时返回None
+        """
+        if self.day_index + 1 >= len(self.trading_dates):
+            return None
+        if self._next_day is None or self._next_day[0] != self.day_index + 1:
+            date = self.trading_dates[self.day_index + 1]
+            self._next_day = (self.day_index + 1,) + self._loadDay(date, self.symbol_list, self._carry())
+        return self._next_day
+
+    def _barsGenerator(self):
+        for day_index in range(len(self.trading_dates)):
+            _, self.times, self.symbol_data, self.tradable = self._peekNextDay()
+            self.day_index = day_index
+            self.date = self.trading_dates[day_index]
+            self._next_day = None
+            for minute_index in range(len(self.times)):
+                yield minute_index
+
+    def updateBars(self, events_queue):
+        try:
+            minute_index = next(self._bars_generator)
+        except StopIteration:
+            raise StopIteration('回测结束')
+        else:
+            self.minute_index = minute_index
+            datetime_int = int(self.date) * 10000 + int(self.times[minute_index])
+            row = self.symbol_data[minute_index]
+            row.setflags(write=False)
+            market_event = MarketEvent(datetime_int, row, date=self.date, record=minute_index == len(self.times) - 1,
+                                       symbol_index=self.symbol_index, field_index=self.field_index)
+            events_queue.put((market_event.priority, market_event))
+
+    def _locate(self, datetime_int):
+        """
+        返回datetime_int所在交易日的(times, symbol_data, tradable)和分钟序号，只能是当前或下一个交易日
+        """
+        date, time = divmod(int(datetime_int), 10000)
+        if date == self.date:
+            day = (self.times, self.symbol_data, self.tradable)
+        else:
+            next_day = self._peekNextDay()
+            if next_day is None or self.trading_dates[next_day[0]] != date:
+                raise NotTradable('{}不在当前或下一个交易日内'.format(datetime_int))
+            day = next_day[1:]
+        minute_index = day[0].searchsorted(time)
+        if minute_index >= len(day[0]) or day[0][minute_index] != time:
+            raise NotTradable('{}不是交易时间'.format(datetime_int))
+        return day, minute_index
+
+    def getSimulatedRealTimePrice(self, symbol, datetime, order_time, direction=None):
+        """
+        分钟线存储中没有涨跌停价，direction只是为了与RQBundleDataHandler的接口一致
+        """
+        symbol_index = self.subscribe(symbol)
+        (_, symbol_data, tradable), minute_index = self._locate(datetime)
+        if tradable[minute_index, symbol_index]:
+            if order_time == OrderTime.OPEN:
+                return symbol_data[minute_index, symbol_index, self.field_index['open']]
+            elif order_time == OrderTime.CLOSE:
+                return symbol_data[minute_index, symbol_index, self.field_index['close']]
+        else:
+            raise NotTradable('{d}时{s}没有成交，不可交易'.format(d=datetime, s=symbol))
+
+    def getSimulatedRealTimePrices(self, symbol_indices, datetime, order_time, buy):
+        """
+        getSimulatedRealTimePrice()的批量版本，用法与RQBundleDataHandler.getSimulatedRealTimePrices()相同，
+        分钟线存储中没有涨跌停价，buy只是为了保持接口一致
+        """
+        symbol_indices = np.asarray(symbol_indices, dtype=np.int64)
+        try:
+            (_, symbol_data, tradable), minute_index = self._locate(datetime)
+        except NotTradable:
+            return np.zeros(len(symbol_indices)), np.zeros(len(symbol_indices), dtype=bool)
+        field = 'open' if order_time == OrderTime.OPEN else 'close'
+        tradable = tradable[minute_index, symbol_indices]
+        prices = np.where(tradable, symbol_data[minute_index, symbol_indices, self.field_index[field]], 0.)
+        return prices, tradable
+
+    def getPriceRanges(self, symbol_indices, datetime):
+        """
+        用法与RQBundleDataHandler.getPriceRanges()相同，返回datetime这一分钟的开盘价、最高价和最低价，
+        分钟线存储中没有涨跌停价，买单和卖单的可交易状态相同
+        """
+        symbol_indices = np.asarray(symbol_indices, dtype=np.int64)
+        try:
+            (_, symbol_data, tradable), minute_index = self._locate(datetime)
+        except NotTradable:
+            zeros = np.zeros(len(symbol_indices))
+            closed = np.zeros(len(symbol_indices), dtype=bool)
+            return zeros, zeros, zeros, closed, closed
+        bars = symbol_data[minute_index, symbol_indices]
+        tradable = tradable[minute_index, symbol_indices]
+        return (bars[:, self.field_index['open']], bars[:, self.field_index['high']],
+                bars[:, self.field_index['low']], tradable, tradable)
+
+    def nextTradingDate(self, datetime):
+        """
+        返回datetime之后的下一根分钟bar的时间，跨日时为下一个交易日的第一分钟
+        """
+        date, time = divmod(int(datetime), 10000)
+        if date == self.date:
+            minute_index = self.times.searchsorted(time, side='right')
+            if minute_index < len(self.times):
+                return date * 10000 + int(self.times[minute_index])
+        next_day = self._peekNextDay()
+        if next_day is None:
+            raise NotTradable('回测已进入最后一天，不能继续在下一个交易日下单')
+        return int(self.trading_dates[next_day[0]]) * 10000 + int(next_day[1][0])
+
+    def getLatestBars(self, symbol, n=1, fields=None):
+        """
+        返回symbol在当前交易日截至当前分钟的最近n根分钟线，是symbol_data的视图，用法与RQBundleDataHandler.getLatestBars()相同。
+        只保留当前交易日的分钟线，开盘后不足n分钟时返回的bar少于n根
+        """
+        symbol_index = self.subscribe(symbol)
+        right = self.minute_index + 1
+        bars = self.symbol_data[max(right - n, 0):right, symbol_index]
+        return self._selectFields(bars, self.field_index, fields)
+
+    def history(self, n, field):
+        """
+        返回所有股票在当前交易日截至当前分钟的最近n个field值，n × symbols 的视图
+        """
+        right = self.minute_index + 1
+        return self.symbol_data[max(right - n, 0):right, :, self.field_index[field]]
+
+    def subscribe(self, symbol):
+        """
+        把股票池以外的股票加入回测，返回它在symbol_data中的序号，用法与RQBundleDataHandler.subscribe()相同
+        """
+        if symbol in self.symbol_index:
+            return self.symbol_index[symbol]
+        if symbol not in self.minute_store.symbol_index:
+            raise NotTradable('分钟线存储中没有{s}的行情，不可交易'.format(s=symbol))
+
+        if self.date is not None:
+            carry = np.zeros((1, len(self.field_index)))
+            _, symbol_data, tradable = self._loadDay(self.date, [symbol], carry)
+            self.symbol_data = np.concatenate([self.symbol_data, symbol_data], axis=1)
+            self.tradable = np.concatenate([self.tradable, tradable], axis=1)
+        self._next_day = None
+        self.symbol_list.append(symbol)
+        self.symbol_index[symbol] = len(self.symbol_list) - 1
+
+        for listener in self.subscribe_listeners:
+            listener(symbol)
+        return self.symbol_index[symbol]
+
+    def addSubscribeListener(self, listener):
+        self.subscribe_listeners.append(listener)
+
+    def getSymbolList(self):
+        return self.symbol_list
+
+    def getTradingDates(self):
+        return self.trading_dates
+
+    def getSymbolIndex(self):
+        return self.symbol_index
+
+    def getFieldIndex(self):
+        return self.field_index
 
 
 if __name__ == '__main__':
-    events_queue = PriorityQueue()
+    events_queue = EventBus()
     handler = RQBundleDataHandler(20180101, 20200726)
     # handler.trading_dates
-    # handler.symbol_data['000156.XSHE']
-    # handler.latest_symbol_data
-    # handler.tradable['000001.XSHE']
+    # handler.symbol_data[:, handler.symbol_index['000156.XSHE']]
+    # handler.trade_status[:, handler.symbol_index['000001.XSHE']]
     handler.updateBars(events_queue)
     handler.updateBars(events_queue)
     handler.updateBars(events_queue)
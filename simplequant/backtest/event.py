@@ -1,112 +1,149 @@
 from abc import ABCMeta, abstractmethod
-from simplequant.constant import EventType, OrderTime
+import numpy as np
+
+from simplequant.constant import Direction, EventType, OrderTime, OrderType
 
 
 class Event:
     """
     Event作为基类，为其他Event类（子类）提供模板。
+    所有事件都使用__slots__，不再为每个实例创建__dict__；type和priority是类属性，不在实例上保存。
     """
 
     __metaclass__ = ABCMeta
+    __slots__ = ()
+    type = None
+    priority = None
 
     @abstractmethod
     def __repr__(self):
         pass
 
-    @abstractmethod
-    def __eq__(self, other):
-        pass
-
 
 class MarketEvent(Event):
     """
     接收市场价格信息的更新。
     """
-    def __init__(self, datetime, symbol_data):
+    __slots__ = ('datetime', 'symbol_data', 'date', 'record', 'symbol_index', 'field_index')
+    type = EventType.MARKET
+    priority = 2
+
+    def __init__(self, datetime, symbol_data, date=None, record=True, symbol_index=None, field_index=None):
         """
         初始化MarketEvent.
+        :param datetime: 日线回测时为形如20200529的交易日，分钟线回测时为形如202005291500的整数
+        :param symbol_data: symbols × fields的只读数组，每只股票当前bar的行情，是DataHandler中数据的视图
+        :param date: 所在的交易日，默认与datetime相同
+        :param record: 是否是当日最后一根bar，Portfolio只在这时记录当日的持仓和市值
+        :param symbol_index: {股票代码: symbol_data中的行号}
+        :param field_index: {字段名: symbol_data中的列号}
         """
-        self.type = EventType.MARKET
-        self.priority = 2
         self.datetime = datetime
         self.symbol_data = symbol_data
+        self.date = datetime if date is None else date
+        self.record = record
+        self.symbol_index = symbol_index
+        self.field_index = field_index
 
     def __repr__(self):
         return '<MarketEvent> Datetime={}'.format(self.datetime)
 
-    def __eq__(self, other):
-        return True
-
 
 class SignalEvent(Event):
     """
     通过Strategy对象发出信号事件。Portfolio对象接收该事件，并基于此做出决策。
     """
-    def __init__(self, datetime, symbol, direction, quantity, order_time=OrderTime.OPEN):
+    __slots__ = ('datetime', 'symbol', 'direction', 'quantity', 'order_time', 'order_type', 'limit_price')
+    type = EventType.SIGNAL
+    priority = 2
+
+    def __init__(self, datetime, symbol, direction, quantity, order_time=OrderTime.OPEN, order_type=OrderType.MARKET,
+                 limit_price=None):
         """
         :param strategy_id: 唯一标示发出信号的Strategy对象
         :param symbol: 股票代码标识，如'AAPL'
         :param datetime: 信号产生的时间戳
         :param signal_type: Direction.LONG或Direction.SHORT
         :param strength: 调仓的权重系数，在投资组合中建议买入或卖出的数量.
+        :param order_type: OrderType.LIMIT表示限价单，此时order_time不起作用
+        :param limit_price: 限价单的价格
         """
 
-        self.type = EventType.SIGNAL
-        self.priority = 2
         self.datetime = datetime
         self.symbol = symbol
         self.direction = direction
         self.quantity = quantity
         self.order_time = order_time
+        self.order_type = order_type
+        self.limit_price = limit_price
 
     def __repr__(self):
+        if self.order_type == OrderType.LIMIT:
+            return '<SignalEvent> Datetime={}, Symbol={}, Direction={}, Quantity={}, LimitPrice={}'.format(
+                self.datetime, self.symbol, self.direction, self.quantity, self.limit_price)
         return '<SignalEvent> Datetime={}, Symbol={}, Direction={}, Quantity={}, OrderTime={}'.format(
             self.datetime, self.symbol, self.direction, self.quantity, self.order_time)
 
-    def __eq__(self, other):
-        '''
-        主要是为了应对优先级队列的使用。queue.PriorityQueue首先比较元组第一个元素的大小，然后比较第二个，
-        然后一直比较到最后一个，只有元组内所有元素都相等，才会按照先进先出的规则弹出，否则优先弹出小的，
-        所以所有的Event都应该重载比较有运算符，重载==在这里最为直接和简便，这样一来，当事件的优先级相同时，
-        会按照先进先出的规则弹出队列元素。
-        :param other:
-        :return:
-        '''
-        return True
-
 
 class OrderEvent(Event):
     """
     向交易系统发送OrderEvent。Order包含标识(e.g. 'AAPL')，类型(market or limit)，
     数量和方向。
     """
-    def __init__(self, datetime, symbol, direction, quantity, order_time=OrderTime.OPEN):
+    __slots__ = ('datetime', 'symbol', 'direction', 'quantity', 'order_time', 'order_type', 'limit_price')
+    type = EventType.ORDER
+    priority = 1
+
+    def __init__(self, datetime, symbol, direction, quantity, order_time=OrderTime.OPEN, order_type=OrderType.MARKET,
+                 limit_price=None):
         """
         初始化order类型，确定是Market order('MKT')还是Limit order('LMT')，还包含数量和
         买卖的方向('BUY' or 'SELL')。
         :param symbol: 交易的对象
         :param order_type: OrderType.MARKET or OrderType.LIMIT for Market or Limit.
-        :param quantity: 非负整数表示的数量
+        :param quantity: 非负整数表示的数量，限价单部分成交后为剩余数量
         :param direction: Direction.LONG or Direction.SHORT for long or short.
+        :param limit_price: 限价单的价格，买单在bar的最低价不高于该价格时成交，卖单在最高价不低于该价格时成交
         """
-        self.type = EventType.ORDER
-        self.priority = 1
         self.datetime = datetime
         self.symbol = symbol
         self.direction = direction
         self.quantity = quantity
         self.order_time = order_time
+        self.order_type = order_type
+        self.limit_price = limit_price
 
     def __repr__(self):
         """
         Outputs the values within the order.
         :return: a string that print on screen.
         """
+        if self.order_type == OrderType.LIMIT:
+            return '<OrderEvent> Datetime={}, Symbol={}, Direction={}, Quantity={}, LimitPrice={}'.format(
+                self.datetime, self.symbol, self.direction, self.quantity, self.limit_price)
         return '<OrderEvent> Datetime={}, Symbol={}, Direction={}, Quantity={}, OrderTime={}'.format(
             self.datetime, self.symbol, self.direction, self.quantity, self.order_time)
 
-    def __eq__(self, other):
-        return True
+
+class CancelEvent(Event):
+    """
+    由Strategy对象放入事件队列，撤销已经挂在限价单簿中的限价单。
+    同一根bar内先于撤单发出的限价单要在这根bar的事件处理完之后才进入限价单簿，不会被这次撤单撤销。
+    """
+    __slots__ = ('datetime', 'symbol')
+    type = EventType.CANCEL
+    priority = 1
+
+    def __init__(self, datetime, symbol=None):
+        """
+        :param datetime: 撤单的时间
+        :param symbol: 撤销这只股票的全部限价单，为None时撤销所有限价单
+        """
+        self.datetime = datetime
+        self.symbol = symbol
+
+    def __repr__(self):
+        return '<CancelEvent> Datetime={}, Symbol={}'.format(self.datetime, self.symbol)
 
 
 class FillEvent(Event):
@@ -115,6 +152,10 @@ class FillEvent(Event):
     Stores the quantity of an instrument actually filled and at what price. In
     addition, stores the commission of the trade from the brokerage.
     """
+    __slots__ = ('datetime', 'symbol', 'direction', 'fill_cost', 'quantity', 'commission', 'order_time')
+    type = EventType.FILL
+    priority = 1
+
     def __init__(self, datetime, symbol, direction, fill_cost, quantity, commission, order_time):
         """
         Initializes the FillEvent object. Sets the symbol, exchange, quantity,
@@ -129,9 +170,6 @@ class FillEvent(Event):
         :param fill_cost: The holdings value in dollars.
         :param commission: an optional commission sent from IB.
         """
-
-        self.type = EventType.FILL
-        self.priority = 1
         self.datetime = datetime
         self.symbol = symbol
         self.direction = direction
@@ -144,6 +182,79 @@ class FillEvent(Event):
         return '<FillEvent> Datetime={}, Symbol={}, Direction={}, FillCost={:.2}, Quantity={}, Commission={:.2}, OrderTime={}'.format(
             self.datetime, self.symbol, self.direction, self.fill_cost, self.quantity, self.commission, self.order_time)
 
-    def __eq__(self, other):
-        return True
 
+class FillBatch:
+    """
+    同一批撮合产生的全部成交，按列保存的数组，Portfolio.updateFromFills()一次更新，不需要为每笔成交创建FillEvent。
+    卖单在前，买单在后，迭代时按这个顺序逐个生成FillEvent，只在需要打印或记录单笔成交时使用。
+    """
+    __slots__ = ('datetimes', 'symbols', 'symbol_indices', 'directions', 'buy', 'fill_costs', 'quantities',
+                 'commissions', 'order_times')
+    type = EventType.FILL
+    priority = 1
+
+    def __init__(self, datetimes, symbols, symbol_indices, directions, fill_costs, quantities, commissions,
+                 order_times):
+        """
+        :param datetimes: 每笔成交的时间
+        :param symbols: 股票代码列表
+        :param symbol_indices: 股票序号数组
+        :param directions: Direction列表
+        :param fill_costs: 成交价数组
+        :param quantities: 成交数量数组
+        :param commissions: 手续费数组
+        :param order_times: OrderTime列表
+        """
+        self.datetimes = datetimes
+        self.symbols = symbols
+        self.symbol_indices = np.asarray(symbol_indices, dtype=np.int64)
+        self.directions = directions
+        self.buy = np.array([direction == Direction.LONG for direction in directions], dtype=bool)
+        self.fill_costs = np.asarray(fill_costs, dtype=np.float64)
+        self.quantities = np.asarray(quantities, dtype=np.int64)
+        self.commissions = np.asarray(commissions, dtype=np.float64)
+        self.order_times = order_times
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __iter__(self):
+        for i in range(len(self.symbols)):
+            yield self.fillEvent(i)
+
+    def fillEvent(self, i):
+        """
+        :return: 第i笔成交对应的FillEvent
+        """
+        return FillEvent(self.datetimes[i], self.symbols[i], self.directions[i], float(self.fill_costs[i]),
+                         int(self.quantities[i]), float(self.commissions[i]), self.order_times[i])
+
+    def __repr__(self):
+        return '<FillBatch> Fills={}'.format(len(self))
+
+
+class EventPool:
+    """
+    事件对象的回收池，acquire()优先复用release()归还的对象，只重新调用__init__，减少主循环中的对象分配和垃圾回收。
+    归还之后不能再使用原来的引用，所以只能归还确定没有其他地方持有的事件，例如已经成交的市价单。
+    """
+
+    def __init__(self, event_class, maxsize=4096):
+        """
+        :param event_class: 池中事件的类
+        :param maxsize: 最多保存的空闲对象数，为0时不回收
+        """
+        self.event_class = event_class
+        self.maxsize = maxsize
+        self._free = []
+
+    def acquire(self, *args, **kwargs):
+        if self._free:
+            event = self._free.pop()
+            event.__init__(*args, **kwargs)
+            return event
+        return self.event_class(*args, **kwargs)
+
+    def release(self, event):
+        if len(self._free) < self.maxsize:
+            self._free.append(event)
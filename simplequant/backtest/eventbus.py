@@ -0,0 +1,69 @@
+from collections import deque
+
+
+class EventBus:
+    """
+    单线程回测用的事件总线，代替queue.PriorityQueue。
+    每个优先级一个deque，数字小的优先级先处理，同一优先级内严格先进先出，不需要加锁，也不需要事件支持比较运算；
+    事件按event.type查分发表交给注册的处理函数，drain()一次处理完队列中的全部事件，包括处理过程中新产生的事件。
+    """
+
+    def __init__(self, priorities=(1, 2)):
+        """
+        :param priorities: 用到的全部优先级，Order和Fill为1，Market和Signal为2
+        """
+        self._priorities = sorted(priorities)
+        self._queues = {priority: deque() for priority in self._priorities}
+        self._ordered = [self._queues[priority] for priority in self._priorities]
+        self._handlers = {}  # {EventType: 处理函数}
+
+    def __len__(self):
+        return sum(len(events) for events in self._ordered)
+
+    def empty(self):
+        return not any(self._ordered)
+
+    def put(self, item):
+        """
+        :param item: 事件，或者与queue.PriorityQueue用法一致的(priority, event)元组
+        """
+        if isinstance(item, tuple):
+            priority, event = item
+        else:
+            priority, event = item.priority, item
+        self._queues[priority].append(event)
+
+    def get(self):
+        """
+        :return: 优先级最高的最早的事件，队列为空时返回None
+        """
+        for events in self._ordered:
+            if events:
+                return events.popleft()
+        return None
+
+    def register(self, event_type, handler):
+        """
+        :param handler: 以事件为唯一参数的函数，同一类事件只能有一个处理函数，后注册的覆盖先注册的
+        """
+        self._handlers[event_type] = handler
+
+    def drain(self):
+        """
+        按优先级依次处理队列中的事件，直到队列为空；没有注册处理函数的事件直接丢弃
+        :return: 处理的事件数
+        """
+        handlers = self._handlers
+        ordered = self._ordered
+        count = 0
+        while True:
+            for events in ordered:
+                if events:
+                    break
+            else:
+                return count
+            event = events.popleft()
+            handler = handlers.get(event.type)
+            if handler is not None:
+                handler(event)
+            count += 1
@@ -1,9 +1,9 @@
 from abc import ABCMeta, abstractmethod
 import numpy as np
 
-from simplequant.backtest.event import FillEvent
-from simplequant.backtest.exception import NotTradable
-from simplequant.constant import Direction
+from simplequant.backtest.event import FillBatch
+from simplequant.backtest.orderbook import OrderBook
+from simplequant.constant import Direction, OrderType
 
 
 class ExecutionHandler:
@@ -29,6 +29,13 @@ class ExecutionHandler:
         """
         raise NotImplementedError("Should implement execute_order()")
 
+    @abstractmethod
+    def executeOrders(self, order_events):
+        """
+        批量执行同一根bar的全部订单，返回FillBatch
+        """
+        raise NotImplementedError("Should implement executeOrders()")
+
 
 class SimulatedExecutionHandler(ExecutionHandler):
     """
@@ -39,6 +46,7 @@ class SimulatedExecutionHandler(ExecutionHandler):
     before implementation with a more sophisticated execution
     handler.
     发出的订单将会以经过滑点调整的第二天的开盘价成交。
+    限价单保存在OrderBook中，一直有效，每根bar用最高价和最低价撮合，直到全部成交或被cancelOrders()撤销。
     """
 
     def __init__(self, gateway, account, rate=3/10000, slippage=0.2/100):
@@ -53,6 +61,7 @@ class SimulatedExecutionHandler(ExecutionHandler):
         self.slippage = slippage  # 滑点，默认0.2%
         self.stamp = 0.001  # 印花税千分之一，卖出时按成交额收取
         self.transfer = 0.00002  # 过户费，买入和卖出时按成交面额（等于成交量）收取
+        self.order_book = OrderBook()
 
     def executeOrder(self, events_queue, order_event):
         """
@@ -60,41 +69,163 @@ class SimulatedExecutionHandler(ExecutionHandler):
         i.e. without any latency, slippage or fill ratio problems.
         :param event: Contains an Event object with order information.
         """
-        fill_event = self.generateFill(order_event)
-        if fill_event.quantity > 0:
+        for fill_event in self.executeOrders([order_event]):
             events_queue.put((fill_event.priority, fill_event))
 
-    def generateFill(self, order_event):
-
-        try:
-            base_price = self.gateway.getSimulatedRealTimePrice(order_event.symbol, order_event.datetime,
-                                                                order_event.order_time)
-        except NotTradable:  # 已进入回测最后一天，不能继续在第二天下单，或者停牌不可交易
-            slippage_price = 0
-            quantity = 0
-            commission = 0
-        else:
-            if order_event.direction == Direction.LONG:
-                cash = self.account.getCurrentCash()
-                slippage_price = base_price * (1 + self.slippage / 2)  # 实际购买价格，还没算各种手续费
-                max_quantity = np.floor(cash / (slippage_price * (1 + self.rate + self.transfer))) // 100 * 100
-                target_quantity = order_event.quantity // 100 * 100
-                quantity = target_quantity if target_quantity <= max_quantity else max_quantity
-                commission = slippage_price * quantity * (self.rate + self.transfer)
-            elif order_event.direction == Direction.SHORT:
-                max_quantity = self.account.getCurrentPosition(order_event.symbol)  # 不允许卖空，当前A股有很多限制
-                target_quantity = order_event.quantity // 100 * 100
-                quantity = target_quantity if target_quantity <= max_quantity else max_quantity
-                slippage_price = base_price * (1 - self.slippage / 2)
-                commission = slippage_price * quantity * (self.rate + self.transfer + self.stamp)
-            elif order_event.direction == Direction.NET:
-                quantity = order_event.quantity // 100 * 100
-                slippage_price = base_price * (1 - self.slippage / 2)
-                commission = slippage_price * quantity * (self.rate + self.transfer + self.stamp)
-            else:
+    def executeOrders(self, order_events):
+        """
+        批量撮合同一根bar发出的全部订单，成交价、滑点、整手、现金约束和手续费都按数组计算。
+        限价单不在这里成交，而是放入限价单簿，从下一根bar开始由matchOrders()撮合。
+        :param order_events: OrderEvent列表，股票必须已经subscribe()
+        :return: FillBatch，见_settle()
+        """
+        for order_event in order_events:
+            if order_event.direction not in (Direction.LONG, Direction.SHORT, Direction.NET):
                 raise ValueError('订单类型只能是Direction.LONG、Direction.SHORT或Direction.NET三种类型之一')
+        symbol_index = self.gateway.getSymbolIndex()
+        market_orders = []
+        for order_event in order_events:
+            if order_event.order_type == OrderType.LIMIT:
+                self.order_book.add(symbol_index[order_event.symbol], order_event,
+                                    order_event.direction == Direction.LONG)
+            else:
+                market_orders.append(order_event)
+        if not market_orders:
+            return self._emptyBatch()
+
+        ids = np.array([symbol_index[order_event.symbol] for order_event in market_orders], dtype=np.int64)
+        buy = np.array([order_event.direction == Direction.LONG for order_event in market_orders])
+
+        # 同一批订单的下单时间和成交时点可能不同，分组取价
+        groups = {}
+        for i, order_event in enumerate(market_orders):
+            groups.setdefault((order_event.datetime, order_event.order_time), []).append(i)
+        base_prices = np.zeros(len(market_orders))
+        tradable = np.zeros(len(market_orders), dtype=bool)
+        for (datetime, order_time), rows in groups.items():
+            base_prices[rows], tradable[rows] = self.gateway.getSimulatedRealTimePrices(ids[rows], datetime,
+                                                                                        order_time, buy[rows])
+        prices = np.where(buy, base_prices * (1 + self.slippage / 2), base_prices * (1 - self.slippage / 2))
+
+        fill_batch, _ = self._settle(market_orders, ids, buy, prices, tradable)
+        return fill_batch
+
+    def matchOrders(self, market_event):
+        """
+        用当前bar的最高价和最低价撮合限价单簿中的挂单：买单在最低价不高于限价时成交，成交价为限价和开盘价中较低的一个；
+        卖单在最高价不低于限价时成交，成交价为限价和开盘价中较高的一个。限价单不计滑点，现金约束与executeOrders()相同，
+        没有成交或者只部分成交的挂单继续保留到下一根bar。停牌时不撮合，涨停时买单不撮合，跌停时卖单不撮合。
+        :return: FillBatch，成交时间为当前bar
+        """
+        symbol_indices = self.order_book.getSymbolIndices()
+        if not len(symbol_indices):
+            return self._emptyBatch()
+        opens, highs, lows, can_buy, can_sell = self.gateway.getPriceRanges(symbol_indices, market_event.datetime)
+        tradable = can_buy | can_sell
 
-        # 定义在if, try, for, while内的变量具有“全局”作用域，只有def, class, lambda才是局部作用于
-        return FillEvent(order_event.datetime, order_event.symbol, order_event.direction,
-                         slippage_price, quantity, commission, order_event.order_time)
+        matched, ids, buy, prices = [], [], [], []
+        for symbol_index, open_, high, low, bid_open, ask_open in zip(
+                symbol_indices[tradable], opens[tradable], highs[tradable], lows[tradable], can_buy[tradable],
+                can_sell[tradable]):
+            bids, asks = self.order_book.match(symbol_index, low, high)
+            bids = bids if bid_open else []
+            asks = asks if ask_open else []
+            for order_event in asks:
+                matched.append(order_event)
+                prices.append(max(order_event.limit_price, open_))
+            for order_event in bids:
+                matched.append(order_event)
+                prices.append(min(order_event.limit_price, open_))
+            ids.extend([symbol_index] * (len(asks) + len(bids)))
+            buy.extend([False] * len(asks) + [True] * len(bids))
+        if not matched:
+            return self._emptyBatch()
 
+        ids = np.array(ids, dtype=np.int64)
+        buy = np.array(buy)
+        fill_batch, quantities = self._settle(matched, ids, buy, np.array(prices), np.ones(len(matched), dtype=bool),
+                                              market_event.datetime)
+        for order_event, quantity in zip(matched, quantities):
+            order_event.quantity -= int(quantity)
+        for symbol_index in np.unique(ids):
+            self.order_book.removeFilled(symbol_index, True, int(np.count_nonzero((ids == symbol_index) & buy)))
+            self.order_book.removeFilled(symbol_index, False, int(np.count_nonzero((ids == symbol_index) & ~buy)))
+        return fill_batch
+
+    def cancelOrders(self, symbol=None):
+        """
+        撤销symbol的全部限价单，symbol为None时撤销所有限价单
+        """
+        if symbol is None:
+            self.order_book.cancel()
+        elif symbol in self.gateway.getSymbolIndex():
+            self.order_book.cancel(self.gateway.getSymbolIndex()[symbol])
+
+    def _settle(self, order_events, ids, buy, prices, tradable, datetime=None):
+        """
+        按数组计算整手、现金约束和手续费，生成成交。
+        现金的分配顺序：先执行全部卖单（Direction.SHORT和Direction.NET），卖出所得扣除手续费后计入可用现金；
+        再按提交顺序执行买单，现金足够时全部成交，不够时只按整手成交买得起的部分，剩余现金继续分配给后面的买单。
+        :param prices: 含滑点的成交价
+        :param tradable: 不可交易的订单成交数量为0
+        :param datetime: 成交时间，默认为订单的时间
+        :return: (fill_batch, quantities)，fill_batch是成交数量大于0的订单组成的FillBatch，卖单在前，买单在后，
+                 按这个顺序更新Portfolio时现金不会出现负数；quantities是每笔订单的成交数量
+        """
+        quantities = np.array([order_event.quantity for order_event in order_events], dtype=np.int64) // 100 * 100
+        quantities[~tradable] = 0  # 已进入回测最后一天，或者停牌、涨跌停不可交易
+
+        # 卖单：不允许卖空，当前A股有很多限制
+        sell_rows = np.flatnonzero(~buy & tradable)
+        positions = self.account.current_positions[ids[sell_rows]]
+        quantities[sell_rows] = self._capSells(ids[sell_rows], quantities[sell_rows], positions)
+        commissions = np.where(buy, self.rate + self.transfer, self.rate + self.transfer + self.stamp) \
+                      * prices * quantities
+        cash = self.account.getCurrentCash() \
+               + (prices[sell_rows] * quantities[sell_rows] - commissions[sell_rows]).sum()
+
+        # 买单：按提交顺序分配现金，前面全部买得起的订单一次算完，之后的订单逐笔按剩余现金成交
+        buy_rows = np.flatnonzero(buy & tradable)
+        unit_costs = prices[buy_rows] * (1 + self.rate + self.transfer)  # 每股成本，含佣金和过户费
+        affordable = np.cumsum(unit_costs * quantities[buy_rows]) <= cash
+        head = len(buy_rows) if affordable.all() else int(affordable.argmin())
+        cash -= (unit_costs[:head] * quantities[buy_rows[:head]]).sum()
+        for row, unit_cost in zip(buy_rows[head:], unit_costs[head:]):
+            max_quantity = int(cash // unit_cost) // 100 * 100
+            quantities[row] = min(quantities[row], max_quantity)
+            cash -= unit_cost * quantities[row]
+        commissions[buy_rows] = prices[buy_rows] * quantities[buy_rows] * (self.rate + self.transfer)
+
+        rows = np.concatenate([sell_rows, buy_rows])
+        rows = rows[quantities[rows] > 0]
+        filled = [order_events[row] for row in rows]
+        fill_batch = FillBatch([order_event.datetime if datetime is None else datetime for order_event in filled],
+                               [order_event.symbol for order_event in filled], ids[rows],
+                               [order_event.direction for order_event in filled], prices[rows], quantities[rows],
+                               commissions[rows], [order_event.order_time for order_event in filled])
+        return fill_batch, quantities
+
+    @staticmethod
+    def _emptyBatch():
+        return FillBatch([], [], [], [], [], [], [], [])
+
+    @staticmethod
+    def _capSells(ids, quantities, positions):
+        """
+        同一只股票的多笔卖单按提交顺序合计，不超过当前持仓
+        :param ids: 卖单的股票序号
+        :param quantities: 卖单的目标数量
+        :param positions: 卖单对应股票的当前持仓
+        :return: 实际可卖的数量
+        """
+        if len(ids) == 0:
+            return quantities
+        order = np.argsort(ids, kind='stable')
+        sorted_ids = ids[order]
+        sorted_quantities = quantities[order]
+        before = np.cumsum(sorted_quantities) - sorted_quantities  # 排序后之前所有卖单的合计
+        starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+        group_before = before - np.repeat(before[starts], np.diff(np.r_[starts, len(order)]))
+        capped = np.empty_like(quantities)
+        capped[order] = np.clip(positions[order] - group_before, 0, sorted_quantities)
+        return capped
@@ -0,0 +1,52 @@
+from collections import deque
+
+from simplequant.backtest.event import FillBatch
+
+
+class EventJournal:
+    """
+    最近事件的环形缓冲区，只保留最后maxlen条，用于回测出错或结果异常时查看之前发生了什么。
+    记录时只保存事件各字段的快照，不调用__repr__，事件对象之后被EventPool复用或者被修改（例如部分成交的限价单）也不影响记录；
+    FillBatch创建后不再修改，其中每笔成交各占一条，只保存批次和序号，读取时再生成FillEvent。
+    """
+
+    def __init__(self, maxlen=1000):
+        self.maxlen = maxlen
+        self._records = deque(maxlen=maxlen)
+
+    def __len__(self):
+        return len(self._records)
+
+    def record(self, event):
+        if isinstance(event, FillBatch):
+            n = len(event)
+            start = 0 if self.maxlen is None else max(n - self.maxlen, 0)  # 放不下的成交不必生成记录
+            self._records.extend((FillBatch, (event, i)) for i in range(start, n))
+        else:
+            self._records.append((type(event), tuple(getattr(event, name) for name in event.__slots__)))
+
+    def records(self, n=None):
+        """
+        :param n: 只返回最近n条，None表示全部
+        :return: 事件列表，越新的越靠后
+        """
+        records = list(self._records)
+        if n is not None:
+            records = records[-n:] if n > 0 else []
+        events = []
+        for event_class, values in records:
+            if event_class is FillBatch:
+                batch, i = values
+                events.append(batch.fillEvent(i))
+            else:
+                event = event_class.__new__(event_class)
+                for name, value in zip(event_class.__slots__, values):
+                    setattr(event, name, value)
+                events.append(event)
+        return events
+
+    def format(self, n=None):
+        return '\n'.join(repr(event) for event in self.records(n))
+
+    def clear(self):
+        self._records.clear()
@@ -0,0 +1,94 @@
+import numpy as np
+
+
+class DenseLedger:
+    """
+    日期×股票的稠密账本，每个交易日保存一整行，适合股票池较小的回测
+    """
+
+    def __init__(self, rows, capacity):
+        """
+        :param rows: 最多记录的行数，即回测区间的交易日数
+        :param capacity: 初始列数，即预留的股票数
+        """
+        self._values = np.zeros((rows, capacity), dtype=np.float64)
+
+    def grow(self, capacity):
+        grown = np.zeros((self._values.shape[0], capacity), dtype=np.float64)
+        grown[:, :self._values.shape[1]] = self._values
+        self._values = grown
+
+    def record(self, row, values):
+        """
+        :param row: 行号，必须按顺序写入
+        :param values: 以股票序号为下标的一维数组
+        """
+        self._values[row, :len(values)] = values
+
+    def toDense(self, count, n):
+        """
+        :return: 前count行、前n只股票的count×n数组
+        """
+        return self._values[:count, :n].copy()
+
+    def getColumn(self, index, count):
+        """
+        :return: 序号为index的股票前count行的记录
+        """
+        return self._values[:count, index].copy()
+
+
+class SparseLedger:
+    """
+    按CSR格式保存的稀疏账本，每个交易日只保存不为0的股票序号和数值，
+    占用的内存与持仓股票数成正比，与股票池大小无关，适合全市场回测。
+    第row行的记录是self._indices和self._data中indptr[row]到indptr[row + 1]的部分。
+    """
+
+    def __init__(self, rows, capacity=None):
+        """
+        :param rows: 最多记录的行数，即回测区间的交易日数
+        :param capacity: 与DenseLedger保持一致，稀疏账本不需要预留列
+        """
+        self._indptr = np.zeros(rows + 1, dtype=np.int64)
+        self._indices = np.zeros(64, dtype=np.int64)
+        self._data = np.zeros(64, dtype=np.float64)
+
+    def grow(self, capacity):
+        pass
+
+    def record(self, row, values):
+        """
+        :param row: 行号，必须按顺序写入
+        :param values: 以股票序号为下标的一维数组
+        """
+        nonzero = np.flatnonzero(values)
+        start = self._indptr[row]
+        end = start + len(nonzero)
+        if end > len(self._data):
+            size = max(len(self._data) * 2, end)
+            self._indices = np.resize(self._indices, size)
+            self._data = np.resize(self._data, size)
+        self._indices[start:end] = nonzero
+        self._data[start:end] = values[nonzero]
+        self._indptr[row + 1] = end
+
+    def toDense(self, count, n):
+        """
+        :return: 前count行、前n只股票的count×n数组
+        """
+        dense = np.zeros((count, n), dtype=np.float64)
+        end = self._indptr[count]
+        rows = np.repeat(np.arange(count), np.diff(self._indptr[:count + 1]))
+        dense[rows, self._indices[:end]] = self._data[:end]
+        return dense
+
+    def getColumn(self, index, count):
+        """
+        :return: 序号为index的股票前count行的记录
+        """
+        column = np.zeros(count, dtype=np.float64)
+        positions = np.flatnonzero(self._indices[:self._indptr[count]] == index)
+        rows = np.searchsorted(self._indptr[:count + 1], positions, side='right') - 1
+        column[rows] = self._data[positions]
+        return column
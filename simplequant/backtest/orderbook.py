@@ -0,0 +1,79 @@
+import bisect
+import itertools
+
+import numpy as np
+
+
+class OrderBook:
+    """
+    按股票分开保存的限价单簿，挂单一直有效，直到全部成交或被撤销。
+    每只股票的买单按价格从高到低、卖单按价格从低到高排序，价格相同时先提交的在前，
+    所以一根bar内能成交的挂单总是排序后的前缀，用二分查找就能取出，不需要扫描全部挂单；
+    没有挂单的股票也不会被检查。
+    """
+
+    def __init__(self):
+        self._bids = {}  # {股票序号: ([排序键], [OrderEvent])}，排序键为(-价格, 序号)
+        self._asks = {}  # {股票序号: ([排序键], [OrderEvent])}，排序键为(价格, 序号)
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return sum(len(orders) for book in (self._bids, self._asks) for _, orders in book.values())
+
+    def add(self, symbol_index, order_event, buy):
+        """
+        :param symbol_index: 股票序号
+        :param order_event: 限价单，成交后直接修改其quantity为剩余数量
+        :param buy: 是否是买单
+        """
+        book = self._bids if buy else self._asks
+        keys, orders = book.setdefault(symbol_index, ([], []))
+        price = order_event.limit_price
+        key = (-price if buy else price, next(self._sequence))
+        i = bisect.bisect_right(keys, key)
+        keys.insert(i, key)
+        orders.insert(i, order_event)
+
+    def getSymbolIndices(self):
+        """
+        :return: 有挂单的股票序号数组，从小到大排列
+        """
+        return np.array(sorted(set(self._bids) | set(self._asks)), dtype=np.int64)
+
+    def match(self, symbol_index, low, high):
+        """
+        :return: (bids, asks)，价格不低于low的买单和价格不高于high的卖单，按优先级排列，仍然留在簿中
+        """
+        bids, asks = [], []
+        if symbol_index in self._bids:
+            keys, orders = self._bids[symbol_index]
+            bids = orders[:bisect.bisect_right(keys, (-low, float('inf')))]
+        if symbol_index in self._asks:
+            keys, orders = self._asks[symbol_index]
+            asks = orders[:bisect.bisect_right(keys, (high, float('inf')))]
+        return bids, asks
+
+    def removeFilled(self, symbol_index, buy, count):
+        """
+        删除match()返回的前count笔挂单中已经全部成交的部分，部分成交的挂单保留原来的位置
+        """
+        book = self._bids if buy else self._asks
+        if symbol_index not in book:
+            return
+        keys, orders = book[symbol_index]
+        keep = [i for i in range(count) if orders[i].quantity > 0]
+        keys[:count] = [keys[i] for i in keep]
+        orders[:count] = [orders[i] for i in keep]
+        if not orders:
+            del book[symbol_index]
+
+    def cancel(self, symbol_index=None):
+        """
+        撤销symbol_index的全部挂单，symbol_index为None时撤销所有挂单
+        """
+        if symbol_index is None:
+            self._bids.clear()
+            self._asks.clear()
+        else:
+            self._bids.pop(symbol_index, None)
+            self._asks.pop(symbol_index, None)
@@ -1,4 +1,3 @@
-import statsmodels.api as sm
 import pandas as pd
 import numpy as np
 import datetime
@@ -7,11 +6,16 @@ from simplequant.environment import Env
 
 
 class Performance(Env):
+    """
+    基准、市场组合和无风险利率都通过Database的参考序列缓存读取，每个进程只读取一次，并保存在本地，
+    只有本地的无风险利率没有覆盖回测区间时才需要登录聚宽下载。
+    all_positions只用到datetime列，all_holdings只用到total列，回测时两者都传入Portfolio.summary
+    """
+
+    jq_auth = ('13802947200', '947200')
+
     def __init__(self, initial_capital, all_positions, all_holdings, benchmark='000300.XSHG', risk_free_rate='SHIBOR',
                  market_portfolio='000985.XSHG'):
-        if not Env._database.is_auth():
-            Env._database.auth('13802947200', '947200')
-
         self.initial_capital = initial_capital
         self.all_positions = all_positions
         self.all_holdings = all_holdings
@@ -27,6 +31,7 @@ class Performance(Env):
         self.risk_free_rate = self.getRiskFreeRate(risk_free_rate, self.trading_dates)
 
         self.market_portfolio = market_portfolio  # 以中证全指作为市场组合
+        self.market_data = self.getBenchmarkData(market_portfolio, self.trading_dates)
 
         self.return_ = self.calculateReturn()
         self.annualized_return = self.calculateAnnualizedReturn()
@@ -48,10 +53,7 @@ class Performance(Env):
 
     @staticmethod
     def getBenchmarkData(benchmark, trading_dates):
-        try:
-            benchmark_data = Env._database.allHistoryIndexes()[benchmark]
-        except IndexError:
-            benchmark_data = Env._database.allHistoryBars()[benchmark]
+        benchmark_data = pd.DataFrame({'close': Env._database.referenceSeries(benchmark)})
         benchmark_data = benchmark_data.reindex(trading_dates, method='ffill').fillna(0)
         return benchmark_data
 
@@ -70,21 +72,11 @@ class Performance(Env):
     def calculateBenchmarkCurve(benchmark_data):
         return benchmark_data['close'] / benchmark_data['close'].iloc[0]
 
-    @staticmethod
-    def getRiskFreeRate(risk_free_rate, trading_dates):
-        str2arg = {'HIBOR': 1, 'LIBOR': 2, 'CHIBOR': 3, 'SIBOR': 4, 'SHIBOR': 5}
-        macro = Env._database.macro
-        query = Env._database.query
-
-        q = query(macro.MAC_LEND_RATE).filter(macro.MAC_LEND_RATE.currency_id == 1,
-                                              macro.MAC_LEND_RATE.market_id == str2arg[risk_free_rate],
-                                              macro.MAC_LEND_RATE.term_id == 20).order_by(macro.MAC_LEND_RATE.day.asc())
-        df = macro.run_query(q)
-
-        df['datetime'] = df['day'].apply(lambda s: int(''.join(s.split('-'))))
-        df.index = df['datetime']
+    @classmethod
+    def getRiskFreeRate(cls, risk_free_rate, trading_dates):
+        rates = Env._database.riskFreeRate(risk_free_rate, end=trading_dates[-1], auth=cls.jq_auth)
+        df = pd.DataFrame({'datetime': rates.index, 'interest_rate': rates.values}, index=rates.index)
         df = df.reindex(trading_dates, method='ffill').fillna(0)
-
         return df[['datetime', 'interest_rate']]
 
     def calculateReturn(self):
@@ -122,6 +114,8 @@ class Performance(Env):
         return max_duration.days  # 返回以天为单位的计数
 
     def calculateAlphaNBeta(self, window=5):
+        import statsmodels.api as sm  # statsmodels导入较慢，只在计算alpha和beta时导入
+
         overnight = self.risk_free_rate['interest_rate'] / 100 / 250  # 转化为非年化的无风险利率
 
         returns = self.all_holdings['total'].pct_change()
@@ -132,8 +126,7 @@ class Performance(Env):
         adjusted_returns = returns.rolling(window=window).mean().iloc[window - 1:] \
                            - overnight.rolling(window=window).mean().iloc[window - 1:]
 
-        market_data = self.getBenchmarkData(self.market_portfolio, self.trading_dates)
-        market_returns = market_data['close'].pct_change()
+        market_returns = self.market_data['close'].pct_change()
         market_returns.iloc[0] = 1
         adjusted_market_returns = market_returns.rolling(window=window).mean().iloc[window - 1:] \
                                   - overnight.rolling(window=window).mean().iloc[window - 1:]
@@ -153,8 +146,7 @@ class Performance(Env):
     def calculateInformationRatio(self):
         returns = self.all_holdings['total'].pct_change()
         returns.iloc[0] = self.all_holdings['total'].iloc[0] / self.initial_capital
-        market_data = self.getBenchmarkData(self.market_portfolio, self.trading_dates)
-        market_returns = market_data['close'].pct_change()
+        market_returns = self.market_data['close'].pct_change()
         market_returns.iloc[0] = 1
         return np.mean(returns - market_returns) / np.std(returns - market_returns)
 
@@ -1,7 +1,9 @@
+import numpy as np
 import pandas as pd
 
-from simplequant.backtest.event import OrderEvent
-from simplequant.constant import Direction
+from simplequant.backtest.event import OrderEvent, EventPool
+from simplequant.backtest.ledger import DenseLedger, SparseLedger
+from simplequant.constant import Direction, OrderType
 from simplequant.backtest.exception import NotTradable
 
 
@@ -16,9 +18,19 @@ class Portfolio:
     holdings value of each symbol for a particular
     time-index, as well as the percentage change in
     portfolio total across bars.
+
+    持仓和市值保存在预先分配好的numpy数组中：当前持仓self.current_positions和当前市值self.current_holdings
+    是以股票序号（与self.symbol_list的顺序一致）为下标的一维数组，现金、手续费和总资产是单独的标量；
+    每个交易日的记录写入按self.trading_dates预先分配的日期×股票的账本，只有读取all_positions和all_holdings时
+    才生成DataFrame，供Performance使用。
+    sparse为True时持仓和市值的账本只保存不为0的股票，内存与持仓股票数成正比，适合全市场回测，
+    单只股票的记录可以通过getPositionSeries和getHoldingSeries读取。
     """
 
-    def __init__(self, data_handler, initial_capital=100000):
+    summary_columns = ['total', 'cash', 'commission']
+    mark_held_only = True  # 盯市时只计算持仓不为0的股票，为False时对整个股票池做点积
+
+    def __init__(self, data_handler, initial_capital=100000, sparse=False):
         """
         Initialises the portfolio with bars and an event queue.
         Also includes a starting datetime index and initial capital
@@ -27,71 +39,182 @@ class Portfolio:
         :param events: The Event Queue object.
         :param start_date: The start date (bar) of the portfolio.
         :param initial_capital: The starting capital in USD.
+        :param sparse: 是否使用稀疏账本记录持仓和市值
         """
         self.initial_capital = initial_capital
         self.data_handler = data_handler
         self.symbol_list = data_handler.getSymbolList()
+        self.symbol_index = data_handler.getSymbolIndex()
         self.trading_dates = data_handler.getTradingDates()
-
-        self.all_positions = pd.DataFrame(columns=['datetime'] + self.symbol_list)
-        self.current_positions = self.initCurrentPosition()  # 注意self.current_positions是Series
-
-        self.all_holdings = pd.DataFrame(columns=['datetime', 'total', 'cash', 'commission'] + self.symbol_list)
-        self.current_holdings = self.initCurrentHoldings()  # 注意self.current_holdings是Series
+        self.close_index = data_handler.getFieldIndex()['close']
+
+        self.datetime = None
+        self.cash = float(initial_capital)
+        self.commission = 0.
+        self.market_value = 0.
+        self.total = float(initial_capital)
+
+        # 列数预留给按需订阅的股票，不够时翻倍扩容
+        self._capacity = max(len(self.symbol_list), 1)
+        self._positions = np.zeros(self._capacity, dtype=np.float64)
+        self._holdings = np.zeros(self._capacity, dtype=np.float64)
+        self._held = set()  # 持仓不为0的股票序号
+        self._held_index = np.zeros(0, dtype=np.int64)
+
+        # 每个交易日最多记录一行
+        self._record_count = 0
+        self._record_dates = np.zeros(len(self.trading_dates), dtype=np.int64)
+        self._summary_ledger = np.zeros((len(self.trading_dates), len(self.summary_columns)), dtype=np.float64)
+        Ledger = SparseLedger if sparse else DenseLedger
+        self._positions_ledger = Ledger(len(self.trading_dates), self._capacity)
+        self._holdings_ledger = Ledger(len(self.trading_dates), self._capacity)
 
         self.equity_curve = None  # will be calculated in method of
         # create_equity_curve_dataframe
 
-    def initCurrentPosition(self):
+        self.order_pool = EventPool(OrderEvent)  # 成交后的市价单由Backtest归还，generateOrder()复用
+
+        data_handler.addSubscribeListener(self.addSymbol)
+
+    @property
+    def current_positions(self):
         """
-        :return:
+        当前持仓，下标是股票序号
         """
+        return self._positions[:len(self.symbol_list)]
 
-        current_positions = pd.Series(index=['datetime'] + self.symbol_list)
-        current_positions[1:] = 0  # datetime空缺
+    @property
+    def current_holdings(self):
+        """
+        当前各股票的市值，下标是股票序号，现金、累计手续费、总市值和总资产见self.cash、self.commission、
+        self.market_value和self.total
+        """
+        return self._holdings[:len(self.symbol_list)]
 
-        return current_positions
+    @property
+    def summary(self):
+        """
+        :return: 每个交易日收盘后的总资产、现金和累计手续费，索引和datetime列都是形如20170103的整数日期，
+                 只读取汇总账本，不展开按股票记录的账本
+        """
+        count = self._record_count
+        dates = self._record_dates[:count]
+        summary = pd.DataFrame(self._summary_ledger[:count], index=dates, columns=self.summary_columns)
+        summary.insert(0, 'datetime', dates)
+        return summary
+
+    @property
+    def all_positions(self):
+        """
+        :return: 每个交易日收盘后的持仓，索引和datetime列都是形如20170103的整数日期，其余各列是股票代码
+        """
+        count = self._record_count
+        dates = self._record_dates[:count]
+        all_positions = pd.DataFrame(self._positions_ledger.toDense(count, len(self.symbol_list)), index=dates,
+                                     columns=self.symbol_list)
+        all_positions.insert(0, 'datetime', dates)
+        return all_positions
+
+    @property
+    def all_holdings(self):
+        """
+        :return: 每个交易日收盘后的总资产、现金、累计手续费和各股票市值，索引和datetime列都是形如20170103的整数日期
+        """
+        summary = self.summary
+        holdings = pd.DataFrame(self._holdings_ledger.toDense(self._record_count, len(self.symbol_list)),
+                                index=summary.index, columns=self.symbol_list)
+        return pd.concat([summary, holdings], axis=1)
 
-    def initCurrentHoldings(self):
+    def getPositionSeries(self, symbol):
         """
-        This constructs the dictionary which will hold the instantaneous
-        value of the portfolio across all symbols.
+        :return: 单只股票每个交易日收盘后的持仓，不需要生成整个all_positions
         """
+        count = self._record_count
+        return pd.Series(self._positions_ledger.getColumn(self.symbol_index[symbol], count),
+                         index=self._record_dates[:count], name=symbol)
 
-        current_holdings = pd.Series(index=['datetime', 'total', 'cash', 'commission'] + self.symbol_list)
-        current_holdings['total'] = self.initial_capital
-        current_holdings['cash'] = self.initial_capital
-        current_holdings['commission'] = 0
-        current_holdings[self.symbol_list] = 0
+    def getHoldingSeries(self, symbol):
+        """
+        :return: 单只股票每个交易日收盘后的市值，不需要生成整个all_holdings
+        """
+        count = self._record_count
+        return pd.Series(self._holdings_ledger.getColumn(self.symbol_index[symbol], count),
+                         index=self._record_dates[:count], name=symbol)
 
-        return current_holdings
+    def _growLedgers(self, capacity):
+        """
+        把当前持仓、当前市值和两个账本的列数扩大到capacity，已有的数据原样复制
+        """
+        for name in ('_positions', '_holdings'):
+            grown = np.zeros(capacity, dtype=np.float64)
+            grown[:self._capacity] = getattr(self, name)
+            setattr(self, name, grown)
+        self._positions_ledger.grow(capacity)
+        self._holdings_ledger.grow(capacity)
+        self._capacity = capacity
+
+    def addSymbol(self, symbol):
+        """
+        data_handler按需加载了股票池以外的股票后调用，为这只股票增加持仓和市值的记录。
+        self.symbol_list与data_handler共用同一个列表，不需要在这里修改，新股票的序号就是列表的最后一位。
+        """
+        if len(self.symbol_list) > self._capacity:
+            self._growLedgers(max(self._capacity * 2, len(self.symbol_list)))
 
-    def updateCurrentHoldingsFromMarket(self, market_event):
-        self.current_holdings.name = market_event.datetime
-        self.current_holdings['datetime'] = market_event.datetime
-        self.current_holdings['total'] = self.current_holdings['cash'] - self.current_holdings['commission']
-        self.current_holdings['cash'] = self.current_holdings['cash']
-        self.current_holdings['commission'] = self.current_holdings['commission']
+    def _updateHeld(self, index):
+        """
+        成交后维护持仓不为0的股票序号，只有股票进出持仓时才重建self._held_index
+        """
+        if self._positions[index] != 0:
+            if index in self._held:
+                return
+            self._held.add(index)
+        elif index in self._held:
+            self._held.remove(index)
+        else:
+            return
+        self._held_index = np.array(sorted(self._held), dtype=np.int64)
+
+    def markToMarket(self, closes, held=None):
+        """
+        用收盘价对持仓估值，总市值是持仓向量和收盘价向量的点积，同时更新各股票的市值。
+        :param closes: 以股票序号为下标的收盘价
+        :param held: 只对这些股票序号估值，其余股票的持仓必须为0；为None时对整个股票池估值
+        :return: 总市值
+        """
+        if held is None:
+            n = len(closes)
+            positions = self._positions[:n]
+            np.multiply(positions, closes, out=self._holdings[:n])
+            return positions.dot(closes)
+
+        positions = self._positions[held]
+        prices = closes[held]
+        self._holdings[held] = positions * prices
+        return positions.dot(prices)
+
+    def revalue(self, closes):
+        """
+        用最新收盘价重新估值，覆盖成交时增量累加的总市值，消除累积误差，保证记录下来的总资产与各股票市值一致
+        """
+        held = self._held_index if self.mark_held_only else None
+        self.market_value = self.markToMarket(closes, held)
+        self.total = self.cash + self.market_value
 
-        for symbol in self.symbol_list:
-            market_value = self.current_positions[symbol] * market_event.symbol_data[symbol]['close']
-            self.current_holdings[symbol] = market_value
-            self.current_holdings['total'] += market_value
+    def updateCurrentHoldingsFromMarket(self, market_event):
+        self.datetime = market_event.date
+        self.revalue(market_event.symbol_data[:, self.close_index])  # 行号与self.symbol_list的顺序一致
 
     def updateAllHoldingsFromMarket(self, market_event):
-        try:
-            self.all_holdings = pd.concat([self.all_holdings, pd.DataFrame(self.current_holdings).T], axis=0)
-        except KeyError:
-            self.all_holdings = pd.DataFrame(self.current_holdings).T
+        row = self._record_count
+        self._record_dates[row] = market_event.date
+        self._summary_ledger[row] = (self.total, self.cash, self.commission)
+        self._holdings_ledger.record(row, self._holdings[:len(self.symbol_list)])
 
     def updateAllPositions(self, market_event):
-        self.current_positions.name = market_event.datetime
-        self.current_positions['datetime'] = market_event.datetime
-        temp = pd.DataFrame(self.current_positions).T
-        try:
-            self.all_positions = pd.concat([self.all_positions, temp], axis=0)
-        except KeyError:
-            self.all_positions = temp
+        row = self._record_count
+        self._record_dates[row] = market_event.date
+        self._positions_ledger.record(row, self._positions[:len(self.symbol_list)])
 
     def updateFromMarket(self, market_event):
         """
@@ -102,8 +225,10 @@ class Portfolio:
         """
 
         self.updateCurrentHoldingsFromMarket(market_event)
-        self.updateAllHoldingsFromMarket(market_event)
-        self.updateAllPositions(market_event)
+        if market_event.record:  # 分钟线回测时每个交易日只记录最后一分钟
+            self.updateAllHoldingsFromMarket(market_event)
+            self.updateAllPositions(market_event)
+            self._record_count += 1
 
     def generateOrder(self, signal_event):
         datetime = signal_event.datetime
@@ -113,12 +238,15 @@ class Portfolio:
         if direction == Direction.LONG or direction == Direction.SHORT:
             quantity = signal_event.quantity // 100 * 100  # quantity的作用域直到函数结束，if不会形成局部作用域
         elif direction == Direction.NET:
-            quantity = self.current_positions[symbol] // 100 * 100
+            quantity = int(self.getCurrentPosition(symbol)) // 100 * 100
         else:
             raise ValueError('订单类型只能是Direction.LONG、Direction.SHORT或Direction.NET三种类型之一')
         order_time = signal_event.order_time
+        if signal_event.order_type == OrderType.LIMIT and not signal_event.limit_price:
+            raise ValueError('限价单必须给出limit_price')
 
-        return OrderEvent(post_datetime, symbol, direction, quantity, order_time)
+        return self.order_pool.acquire(post_datetime, symbol, direction, quantity, order_time,
+                                       signal_event.order_type, signal_event.limit_price)
 
     def updateSignal(self, events_queue, signal_event):
         """
@@ -126,12 +254,15 @@ class Portfolio:
         based on the portfolio logic.
         """
         try:
+            self.data_handler.subscribe(signal_event.symbol)
             order_event = self.generateOrder(signal_event)
         except NotTradable:
             pass
         else:
             if order_event.quantity > 0:
                 events_queue.put((order_event.priority, order_event))
+            else:  # 不需要下单，订单没有交给其他地方，直接归还
+                self.order_pool.release(order_event)
 
     def updateCurrentPositionFromFill(self, fill_event):
         """
@@ -142,16 +273,17 @@ class Portfolio:
         """
 
         # 更新时间其实意义不大，因为一天当中可能有多个fill_event，
-        # self.current_positions的时间在接收第一个fill_event时就发生改变，但此时的仓位不一定是当天的最终仓位
-        self.current_positions.name = fill_event.datetime
-        self.current_positions['datetime'] = fill_event.datetime
+        # self.datetime在接收第一个fill_event时就发生改变，但此时的仓位不一定是当天的最终仓位
+        self.datetime = fill_event.datetime
 
+        index = self.symbol_index[fill_event.symbol]
         if fill_event.direction == Direction.LONG:
-            self.current_positions[fill_event.symbol] += fill_event.quantity
+            self._positions[index] += fill_event.quantity
         elif fill_event.direction == Direction.SHORT or fill_event.direction == Direction.NET:
-            self.current_positions[fill_event.symbol] -= fill_event.quantity
+            self._positions[index] -= fill_event.quantity
         else:
             raise ValueError('订单类型只能是Direction.LONG、Direction.SHORT或Direction.NET')
+        self._updateHeld(index)
 
     def updateCurrentHoldingsFromFill(self, fill_event):
         """
@@ -160,29 +292,27 @@ class Portfolio:
         Parameters:
         fill - The Fill object to update the holdings with.
         """
-        datetime = fill_event.datetime
-        symbol = fill_event.symbol
+        index = self.symbol_index[fill_event.symbol]
         direction = fill_event.direction
         fill_cost = fill_event.fill_cost
         quantity = fill_event.quantity
         commission = fill_event.commission
 
-        self.current_holdings.name = datetime
-        self.current_holdings['datetime'] = datetime
-        self.current_holdings['commission'] += commission
-        self.current_holdings[symbol] = fill_cost * self.current_positions[symbol]
+        self.datetime = fill_event.datetime
+        self.commission += commission
         if direction == Direction.LONG:
-            self.current_holdings['cash'] = self.current_holdings['cash'] - fill_cost * quantity - commission
+            self.cash = self.cash - fill_cost * quantity - commission
         elif direction == Direction.SHORT or direction == Direction.NET:
-            self.current_holdings['cash'] = self.current_holdings['cash'] + fill_cost * quantity - commission
+            self.cash = self.cash + fill_cost * quantity - commission
         else:
             raise ValueError('订单类型只能是Direction.LONG、Direction.SHORT或Direction.NET')
-        self.current_holdings['total'] = self.current_holdings['cash'] - self.current_holdings['commission']\
-                                         + sum(self.current_holdings[self.symbol_list])
 
-        # 更新self.current_holdings[symbol]和self.current_holdings['total']其实没有意义，
-        # 因为symbol以外的股票的价格可能已经发生变动，但并未更新，所以self.current_holdings['total']很不准确，
-        # 关注点主要在于self.current_holdings['cash']和self.current_holdings['commission']的更新。
+        # 只更新成交股票的市值，按成交价估值，其余股票仍按上一次盯市的价格，收盘后由revalue统一重新估值。
+        # 手续费已经从现金中扣除，总资产不再重复扣除self.commission
+        holding = fill_cost * self._positions[index]
+        self.market_value += holding - self._holdings[index]
+        self._holdings[index] = holding
+        self.total = self.cash + self.market_value
 
     def updateFromFill(self, fill_event):
         """
@@ -192,9 +322,37 @@ class Portfolio:
         self.updateCurrentPositionFromFill(fill_event)
         self.updateCurrentHoldingsFromFill(fill_event)
 
+    def updateFromFills(self, fill_batch):
+        """
+        按数组一次更新一个FillBatch中的全部成交，结果与按顺序逐笔调用updateFromFill()相同：
+        持仓和现金直接累加，成交股票的市值按该股票最后一笔成交价估值。
+        """
+        if not len(fill_batch):
+            return
+        symbol_indices = fill_batch.symbol_indices
+        quantities = np.where(fill_batch.buy, fill_batch.quantities, -fill_batch.quantities)
+        np.add.at(self._positions, symbol_indices, quantities)
+        self.commission += fill_batch.commissions.sum()
+        self.cash -= (quantities * fill_batch.fill_costs + fill_batch.commissions).sum()
+
+        reverse_symbols, reverse_rows = np.unique(symbol_indices[::-1], return_index=True)
+        last_rows = len(symbol_indices) - 1 - reverse_rows
+        holdings = fill_batch.fill_costs[last_rows] * self._positions[reverse_symbols]
+        self.market_value += (holdings - self._holdings[reverse_symbols]).sum()
+        self._holdings[reverse_symbols] = holdings
+        self.total = self.cash + self.market_value
+        for index in reverse_symbols:
+            self._updateHeld(index)
+        self.datetime = fill_batch.datetimes[-1]
+
     def getCurrentCash(self):
-        return self.current_holdings['cash']
+        return self.cash
 
     def getCurrentPosition(self, symbol):
-        return self.current_positions[symbol]
+        return self._positions[self.symbol_index[symbol]]
 
+    def getHeldSymbols(self):
+        """
+        :return: 当前持仓不为0的股票代码列表
+        """
+        return [self.symbol_list[i] for i in np.flatnonzero(self.current_positions)]
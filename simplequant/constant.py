@@ -13,6 +13,7 @@ class EventType(Enum):
     SIGNAL = 'SignalEvent事件'
     ORDER = 'OrderEvent事件'
     FILL = 'FillEvent事件'
+    CANCEL = 'CancelEvent事件'
 
 
 class OrderType(Enum):
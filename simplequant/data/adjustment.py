@@ -0,0 +1,88 @@
+import numpy as np
+
+from simplequant import utils
+from simplequant.constant import PRICE_FIELDS
+
+
+class ExCumFactorTable:
+    """
+    一次性读入ex_cum_factor.h5中所有股票的累计除权因子，首尾相接保存在几个一维数组中，
+    用于对整个股票池的行情进行批量复权。
+
+    查找因子时把(股票序号, 日期)编码成一个uint64的键：序号 × KEY_SHIFT + 日期，
+    所有股票的除权日期因此构成一个整体有序的数组，一次searchsorted就能找到全市场每根bar对应的因子，
+    不再需要逐只股票打开文件、逐只股票查找。
+    """
+
+    KEY_SHIFT = np.uint64(10 ** 15)  # 日期是YYYYMMDDHHMMSS格式的整数，小于10 ** 15
+
+    def __init__(self, codes, start_dates, factors, lengths):
+        self.codes = codes
+        self.code_index = {code: i for i, code in enumerate(codes)}
+        self.start_dates = start_dates
+        self.factors = factors
+        self.row_codes = np.repeat(np.arange(len(codes), dtype=np.uint64), lengths)
+        self.keys = self.row_codes * self.KEY_SHIFT + start_dates
+        self.ex_dates = np.unique(start_dates)
+
+    @classmethod
+    def load(cls, ex_cum_factor_path):
+        ex_cum_factor = utils.open_h5(ex_cum_factor_path)
+        codes = sorted(ex_cum_factor.keys())
+        tables = [ex_cum_factor[code][:] for code in codes]
+        lengths = [len(table) for table in tables]
+        start_dates = np.concatenate([table['start_date'] for table in tables]).astype(np.uint64)
+        factors = np.concatenate([table['ex_cum_factor'] for table in tables]).astype(np.float64)
+        return cls(codes, start_dates, factors, lengths)
+
+    def lookup(self, code_ids, dates):
+        """
+        返回每个(股票序号, 日期)对应的累计除权因子。日期早于第一个除权日，或者股票没有除权记录（序号为-1）时为1.0
+        :param code_ids: 整数数组，股票在self.codes中的序号
+        :param dates: YYYYMMDDHHMMSS格式的日期数组，与code_ids等长
+        """
+        code_ids = np.asarray(code_ids, dtype=np.int64)
+        known = code_ids >= 0
+        keys = np.where(known, code_ids, 0).astype(np.uint64) * self.KEY_SHIFT + np.asarray(dates, dtype=np.uint64)
+        pos = self.keys.searchsorted(keys, side='right') - 1
+        clipped = np.maximum(pos, 0)
+        found = known & (pos >= 0) & (self.row_codes[clipped] == code_ids.astype(np.uint64))
+        return np.where(found, self.factors[clipped], 1.0)
+
+    def effectiveOrigin(self, adjust_orig):
+        """
+        返回不晚于adjust_orig的最后一个除权日（YYYYMMDDHHMMSS格式），以它为基准与以adjust_orig为基准的前复权结果相同
+        """
+        orig = np.uint64(utils.convert_date_to_int(adjust_orig))
+        ind = self.ex_dates.searchsorted(orig, side='right')
+        return int(self.ex_dates[ind - 1]) if ind > 0 else 0
+
+    def adjust(self, stocks_bars, adjust_orig, adjust_type='pre'):
+        """
+        对一批股票的行情同时复权。
+        :param stocks_bars: {order_book_id: 结构化数组}，datetime字段为YYYYMMDDHHMMSS格式
+        :param adjust_orig: 前复权的基准日期，datetime.datetime
+        :param adjust_type: 'pre'为前复权，'post'为后复权
+        :return: {order_book_id: 复权后的结构化数组}，数组是新复制的，不会修改传入的数据
+        """
+        order_book_ids = list(stocks_bars.keys())
+        if len(order_book_ids) == 0:
+            return {}
+        lengths = np.array([len(stocks_bars[order_book_id]) for order_book_id in order_book_ids])
+        code_ids = np.array([self.code_index.get(order_book_id, -1) for order_book_id in order_book_ids])
+        result = np.concatenate([stocks_bars[order_book_id] for order_book_id in order_book_ids])
+
+        row_code_ids = np.repeat(code_ids, lengths)
+        factors = self.lookup(row_code_ids, result['datetime'])
+        if adjust_type == 'pre':
+            orig = np.full(len(code_ids), utils.convert_date_to_int(adjust_orig), dtype=np.uint64)
+            factors /= np.repeat(self.lookup(code_ids, orig), lengths)
+
+        for field in result.dtype.names:
+            if field in PRICE_FIELDS:
+                result[field] *= factors
+            elif field == 'volume':
+                result[field] *= (1 / factors)
+
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        return {order_book_id: result[offsets[i]:offsets[i + 1]] for i, order_book_id in enumerate(order_book_ids)}
@@ -0,0 +1,151 @@
+import json
+import os
+import shutil
+import numpy as np
+
+from simplequant import utils
+
+
+class BarStore:
+    """
+    全市场日线行情的列式存储：一个 symbols × dates × fields 的稠密float64三维数组，
+    由stocks.h5一次性转换而来，保存为.npy文件，之后以只读的memmap方式打开。
+    回测时按整数索引读取，只有真正被访问到的页才会从磁盘读入内存。
+
+    数组中保存的是已经前复权的行情；某只股票在某个交易日没有成交（未上市、停牌）时，
+    沿用前一个有成交的交易日的数据，上市之前的部分置零，
+    与原先reindex(method='ffill').fillna(0)的处理结果一致。
+    traded数组（symbols × dates）记录每只股票在每个交易日是否真实成交。
+    """
+
+    bars_file = 'bars.npy'
+    traded_file = 'traded.npy'
+    symbols_file = 'symbols.npy'
+    dates_file = 'dates.npy'
+    meta_file = 'meta.json'
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self.meta = self.readMeta(store_path)
+        self.fields = self.meta['fields']
+        self.adjust_orig = self.meta.get('adjust_orig')
+        self.symbols = [str(symbol) for symbol in np.load(os.path.join(store_path, self.symbols_file))]
+        self.dates = np.load(os.path.join(store_path, self.dates_file))
+        self.bars = np.load(os.path.join(store_path, self.bars_file), mmap_mode='r')
+        self.traded = np.load(os.path.join(store_path, self.traded_file), mmap_mode='r')
+
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.field_index = {field: i for i, field in enumerate(self.fields)}
+
+    @classmethod
+    def readMeta(cls, store_path):
+        meta_path = os.path.join(store_path, cls.meta_file)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+
+    @classmethod
+    def isValid(cls, store_path, version):
+        """
+        store_path下存在与当前数据包版本一致的完整存储时返回True
+        """
+        meta = cls.readMeta(store_path)
+        return meta is not None and meta.get('version') == version
+
+    @classmethod
+    def build(cls, store_path, symbol_bars, symbols, trading_dates, version, adjust_orig=None):
+        """
+        把逐只股票的行情写入新的存储。先写到本进程独有的临时目录，全部完成后再替换store_path，
+        中途出错不会留下不完整的存储；其他进程已经生成了同一版本的存储时直接使用它。
+        :param store_path: 存储目录
+        :param symbol_bars: 依次产生(order_book_id, bars)的可迭代对象，bars为已复权、已剔除停牌日的结构化数组，
+                            datetime字段为YYYYMMDD格式的整数
+        :param symbols: 股票代码列表，决定存储中股票的顺序
+        :param trading_dates: YYYYMMDD格式的交易日数组
+        :param version: 数据包版本，用于判断存储是否过期
+        :param adjust_orig: 前复权基准，YYYYMMDDHHMMSS格式的整数，记录下来用于换算成不复权或后复权的价格
+        :return: 新建的BarStore
+        """
+        building_path = utils.make_building_dir(store_path)
+        try:
+            cls._write(building_path, symbol_bars, symbols, trading_dates, version, adjust_orig)
+        except BaseException:
+            shutil.rmtree(building_path, ignore_errors=True)
+            raise
+        if cls.isValid(store_path, version):
+            shutil.rmtree(building_path, ignore_errors=True)
+        elif not utils.replace_dir(building_path, store_path) and not cls.isValid(store_path, version):
+            raise IOError('其他进程同时写入了{}，且版本不是{}'.format(store_path, version))
+        return cls(store_path)
+
+    @classmethod
+    def _write(cls, building_path, symbol_bars, symbols, trading_dates, version, adjust_orig):
+        symbol_index = {symbol: i for i, symbol in enumerate(symbols)}
+        n_dates = len(trading_dates)
+        bars_arr = None
+        traded_arr = np.lib.format.open_memmap(os.path.join(building_path, cls.traded_file), mode='w+',
+                                               dtype=np.bool_, shape=(len(symbols), n_dates))
+        fields = None
+        for order_book_id, bars in symbol_bars:
+            if bars_arr is None:
+                fields = [name for name in bars.dtype.names if name != 'datetime']
+                bars_arr = np.lib.format.open_memmap(os.path.join(building_path, cls.bars_file), mode='w+',
+                                                     dtype=np.float64, shape=(len(symbols), n_dates, len(fields)))
+            i = symbol_index[order_book_id]
+            cls._fillSymbol(bars_arr, traded_arr, i, bars, fields, trading_dates)
+
+        if bars_arr is None:
+            raise ValueError('没有可写入的行情数据')
+        bars_arr.flush()
+        traded_arr.flush()
+        del bars_arr, traded_arr
+
+        np.save(os.path.join(building_path, cls.symbols_file), np.array(symbols))
+        np.save(os.path.join(building_path, cls.dates_file), np.asarray(trading_dates))
+        with open(os.path.join(building_path, cls.meta_file), 'w') as f:
+            json.dump({'version': version, 'fields': fields, 'adjust_orig': adjust_orig}, f)
+
+    @staticmethod
+    def _fillSymbol(bars_arr, traded_arr, i, bars, fields, trading_dates):
+        if len(bars) == 0:
+            return
+        bar_dates = bars['datetime'].astype(np.int64)
+        positions = trading_dates.searchsorted(bar_dates)
+        in_range = positions < len(trading_dates)
+        in_range[in_range] = trading_dates[positions[in_range]] == bar_dates[in_range]
+        positions = positions[in_range]
+        bars = bars[in_range]
+
+        values = np.column_stack([bars[field].astype(np.float64) for field in fields])
+        # 每个交易日对应的最近一根bar的位置，向前填充
+        latest = positions.searchsorted(np.arange(len(trading_dates)), side='right') - 1
+        listed = latest >= 0
+        row = np.zeros((len(trading_dates), len(fields)))
+        row[listed] = values[latest[listed]]
+        bars_arr[i] = row
+        traded_arr[i, positions] = True
+
+    @classmethod
+    def restamp(cls, store_path, version):
+        """
+        数据包更新但行情数据没有变化时，只修改存储的版本号
+        """
+        meta = cls.readMeta(store_path)
+        meta['version'] = version
+        temp_path = os.path.join(store_path, cls.meta_file + '.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp_path, os.path.join(store_path, cls.meta_file))
+
+    def getSymbolIndex(self, symbol):
+        return self.symbol_index[symbol]
+
+    def getDateIndex(self, date):
+        """
+        返回date在存储中的位置，date不是存储中的交易日时抛出KeyError
+        """
+        ind = self.dates.searchsorted(date)
+        if ind >= len(self.dates) or self.dates[ind] != date:
+            raise KeyError(date)
+        return ind
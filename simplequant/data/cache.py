@@ -0,0 +1,91 @@
+import os
+import shutil
+import numpy as np
+
+from simplequant import utils
+
+
+class AdjustedBarsCache:
+    """
+    把Database.allHistoryBars中读取、筛选、复权之后的全市场行情保存到磁盘，之后的进程直接读取，
+    不再重复读HDF5和复权。
+    每条缓存是cache_path下的一个子目录，所有股票的行情首尾相接保存在bars.npy中，
+    codes.npy和offsets.npy记录每只股票在其中的起止位置，读取时以memmap方式打开。
+    子目录名由数据包版本、复权方式、实际生效的复权基准日和是否剔除停牌日组成，
+    数据包版本变化后，旧版本的缓存会被删除。
+    """
+
+    bars_file = 'bars.npy'
+    codes_file = 'codes.npy'
+    offsets_file = 'offsets.npy'
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+
+    @staticmethod
+    def makeKey(version, adjust_type, adjust_orig, skip_suspended):
+        """
+        :param adjust_orig: 实际生效的复权基准，即不晚于复权基准日的最后一个除权日，
+                            两个基准日之间没有任何股票除权时，复权结果完全相同，可以共用缓存
+        """
+        return '{v}_{t}_{o}_{s}'.format(v=version, t=adjust_type, o=adjust_orig, s=int(skip_suspended))
+
+    def load(self, key):
+        """
+        返回{order_book_id: 只读的结构化数组}，没有对应的缓存时返回None
+        """
+        entry_path = os.path.join(self.cache_path, key)
+        if not os.path.exists(os.path.join(entry_path, self.offsets_file)):
+            return None
+        bars = np.load(os.path.join(entry_path, self.bars_file), mmap_mode='r')
+        codes = np.load(os.path.join(entry_path, self.codes_file))
+        offsets = np.load(os.path.join(entry_path, self.offsets_file))
+        return {str(code): bars[offsets[i]:offsets[i + 1]] for i, code in enumerate(codes)}
+
+    def save(self, key, stocks_bars):
+        """
+        先写入本进程独有的临时目录，写完后改名，其他进程不会读到写了一半的缓存；
+        其他进程已经保存了同一条缓存时丢弃本进程写的内容
+        """
+        self.invalidate(key.split('_')[0])
+        entry_path = os.path.join(self.cache_path, key)
+        building_path = utils.make_building_dir(entry_path)
+
+        codes = list(stocks_bars.keys())
+        lengths = [len(stocks_bars[code]) for code in codes]
+        try:
+            np.save(os.path.join(building_path, self.bars_file),
+                    np.concatenate([stocks_bars[code] for code in codes]))
+            np.save(os.path.join(building_path, self.codes_file), np.array(codes))
+            np.save(os.path.join(building_path, self.offsets_file), np.concatenate([[0], np.cumsum(lengths)]))
+        except BaseException:
+            shutil.rmtree(building_path, ignore_errors=True)
+            raise
+
+        if os.path.exists(os.path.join(entry_path, self.offsets_file)):
+            shutil.rmtree(building_path, ignore_errors=True)
+        else:
+            utils.replace_dir(building_path, entry_path)
+
+    def invalidate(self, version):
+        """
+        删除不属于version这一数据包版本的所有缓存
+        """
+        if not os.path.exists(self.cache_path):
+            return
+        for entry in os.listdir(self.cache_path):
+            if entry.split('_')[0] != str(version):
+                shutil.rmtree(os.path.join(self.cache_path, entry), ignore_errors=True)
+
+    def restamp(self, old_version, version):
+        """
+        数据包更新但缓存依赖的文件没有变化时，把old_version的缓存改为version的缓存，其余版本的缓存删除
+        """
+        if not os.path.exists(self.cache_path):
+            return
+        for entry in os.listdir(self.cache_path):
+            parts = entry.split('_')
+            if parts[0] == str(old_version) and '.building' not in entry:
+                parts[0] = str(version)
+                os.rename(os.path.join(self.cache_path, entry), os.path.join(self.cache_path, '_'.join(parts)))
+        self.invalidate(version)
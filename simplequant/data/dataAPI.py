@@ -22,9 +22,9 @@ class DataAPI(Env):
         return Env._database.is_auth()
 
     def historyBars(self, order_book_id, frequency='1d', fields=None, start=None, end=None,
-                    skip_suspended=True, include_now=False, adjust_type='pre', adjust_orig=None):
+                    skip_suspended=True, include_now=False, adjust_type='pre', adjust_orig=None, bar_count=None):
         return Env._database.historyBars(order_book_id, frequency, fields, start, end, skip_suspended,
-                                         include_now, adjust_type, adjust_orig)
+                                         include_now, adjust_type, adjust_orig, bar_count)
 
     def get_price(self, security, start_date=None, end_date=None, frequency='daily', fields=None,
                   skip_paused=False, fq='pre', count=None, panel=True, fill_paused=True):
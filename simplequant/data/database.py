@@ -1,16 +1,24 @@
 import datetime
-import requests
-import dateutil
+import filecmp
+import importlib
+import dateutil.relativedelta
 import os
 import shutil
+import time
 import pandas as pd
-import jqdatasdk
 import numpy as np
-from bisect import bisect_right
 import six
 
 from simplequant import utils
-from simplequant.constant import FIELDS_REQUIRE_ADJUSTMENT, PRICE_FIELDS
+from simplequant.constant import PRICE_FIELDS
+from simplequant.data.adjustment import ExCumFactorTable
+from simplequant.data.cache import AdjustedBarsCache
+from simplequant.data.tradingcalendar import TradingCalendar
+from simplequant.data.minutestore import MinuteBarStore
+from simplequant.data.fundamentals import FundamentalsStore, SNAPSHOT_TABLES, Query, parse_stat_date
+from simplequant.data.reference import ReferenceSeriesCache
+from simplequant.data.barstore import BarStore
+from simplequant.data.metadata import BundleMetadata
 
 
 class Database:
@@ -21,74 +29,427 @@ class Database:
     ex_cum_factor_file = 'ex_cum_factor.h5'
     trading_dates_file = 'trading_dates.npy'
     indexes_file = 'indexes.h5'
+    bar_store_dir = 'bar_store'
+    adjusted_cache_dir = 'adjusted_cache'
+    minute_store_dir = 'minute_bars'
+    fundamentals_dir = 'fundamentals'
+    reference_dir = 'reference'
+    staging_dir = '.staging'
+    swap_backup_dir = '.previous'  # 替换数据包文件期间保存被替换的原有文件
+    swap_marker_file = '.swapping'  # 替换数据包文件期间存在，记录新版本和被替换的文件，完成后删除
+    update_lock_file = '.update.lock'
+    update_lock_timeout = 6 * 60 * 60  # 秒，超过这个时间的更新锁视为已失效
+    update_poll_interval = 10  # 秒，等待其他进程完成首次下载时的轮询间隔
+    max_probe_months = 24
+    probe_timeout = 10  # 秒，探测数据包是否存在的HEAD请求的超时时间
+    probe_file = '.latest_bundle'  # 记录当天探测到的最新数据包，每天最多探测一次
+
+    # 派生缓存及其依赖的数据包文件，更新数据包时据此判断缓存是否需要重新生成
+    derived_sources = {
+        'metadata': (stock_file, ex_cum_factor_file, trading_dates_file),
+        'bar_store': (stock_file, ex_cum_factor_file, trading_dates_file),
+        'adjusted_cache': (stock_file, ex_cum_factor_file),
+    }
 
     def __init__(self):
         self.data_path = os.path.join(os.path.dirname(__file__), self.data_dir)  # .表示当前工作路径，并不是本文件所在的目录
         self.loaded = False
-        self.mergeJQData()
+        self._bar_store = None
+        self._metadata = None
+        self._ex_cum_factor_table = None
+        self._calendar = None
+        self._latest_bundle = None
+        self._fundamentals_store = None
+        self._reference_series = {}
+        self._risk_free_rates = {}  # {key: (Series, 下载日期)}
+
+    def __getattr__(self, name):
+        '''
+        让jqdatasdk.fun()都可以以Database的实例database.fun()的形式调用。
+        jqdatasdk在第一次用到它的函数时才导入，取到的函数绑定在实例上，之后不再经过__getattr__
+        '''
+        if name.startswith('_'):
+            raise AttributeError(name)
+        jqdatasdk = importlib.import_module('jqdatasdk')
+        if name not in jqdatasdk.__dict__['__all__']:
+            raise AttributeError("'{c}' object has no attribute '{n}'".format(c=type(self).__name__, n=name))
+        setattr(self, name, jqdatasdk.__dict__[name])
+        return jqdatasdk.__dict__[name]
 
     def mergeJQData(self):
         '''
-        让jqdatasdk.fun()都可以以Database的实例database.fun()的形式调用
+        立即导入jqdatasdk，并把它的所有函数绑定到实例上
         :return:
         '''
+        jqdatasdk = importlib.import_module('jqdatasdk')
         for fun_name in jqdatasdk.__dict__['__all__']:
             setattr(self, fun_name, jqdatasdk.__dict__[fun_name])
 
     def changePath(self, data_path):
         self.data_path = data_path
+        self._bar_store = None
+        self._metadata = None
+        self._ex_cum_factor_table = None
+        self._calendar = None
+        self._fundamentals_store = None
+        self._reference_series = {}
+        self._risk_free_rates = {}
+
+    def changeCDN(self, cdn_url):
+        '''
+        :param cdn_url: 形如'http://localhost:8000/rqbundle_%04d%02d.tar.bz2'的地址模板，可以指向本地的HTTP服务
+        '''
+        self.CDN_URL = cdn_url
+        self._latest_bundle = None
 
     def load(self):
-        year, month = self._getLatestTimestamp()
+        '''
+        本地已有完整的数据包时直接使用，并尝试增量更新到最新的数据包；更新失败（如网络不通）时继续使用本地数据包。
+        本地没有数据包时下载完整的数据包，如果其他进程正在下载，则等待其完成。
+        上次更新在替换文件的中途退出时，先恢复到替换之前的数据包。
+        '''
+        self._recoverSwap()
+        if self._hasLocalBundle():
+            try:
+                self.update()
+            except IOError as e:  # requests的网络异常都是IOError的子类
+                print('failed to update data: {}, use local data of version {}'.format(e, self.getBundleVersion()))
+            else:
+                print('data is already loaded')
+        else:
+            while not self.update():
+                time.sleep(self.update_poll_interval)
+                if self._hasLocalBundle():
+                    break
+            print('successfully load data')
+        self.loaded = True
 
-        timestamp_path = os.path.join(self.data_path, str(year) + str(month) + '.txt')
-        stocks_path = os.path.join(self.data_path, self.stock_file)
-        ex_cum_factor_path = os.path.join(self.data_path, self.ex_cum_factor_file)
-        trading_dates_path = os.path.join(self.data_path, self.trading_dates_file)
+    def update(self, force=False, checksum=None):
+        '''
+        增量更新数据包：只查找一次最新的数据包，下载并解压到暂存目录，只把内容发生变化的文件整体替换到数据目录中，
+        然后更新派生的缓存，最后写入新的时间戳和探测结果。替换过程中已经打开的文件仍然可以读取原有的内容，
+        替换完成之前getBundleVersion()返回None，不会把新旧版本混杂的文件当作完整的数据包。
+        同一时间只有一个进程执行更新，其他进程发现更新锁被占用时直接返回，继续使用原有的数据包。
+        :param force: 本地数据包已经是最新版本时也重新探测并下载
+        :param checksum: 可选，数据包压缩文件的sha256，下载完成后校验；CDN没有发布校验和，不指定时只检查下载长度
+        :return: 本进程完成了更新，或者本地已是最新版本时返回True；其他进程正在更新时返回False
+        '''
+        old_version = self.getBundleVersion()
+        today = datetime.date.today()
+        if old_version == str(today.year) + str(today.month) and not force and self._hasLocalBundle():
+            return True  # 已经是本月的数据包，不可能有更新的版本，不需要探测
+        latest_bundle = self._findLatestBundle(reprobe=force, record=False)
+        year, month, url = latest_bundle
+        version = str(year) + str(month)
+        if old_version == version and not force and self._hasLocalBundle():
+            self._writeProbe(latest_bundle)
+            return True
 
-        if os.path.exists(timestamp_path) and os.path.exists(stocks_path)\
-                and os.path.exists(ex_cum_factor_path) and os.path.exists(trading_dates_path):
-            self.loaded = True
-            print('data is already loaded')
-        else:
-            if os.path.exists(self.data_path):
-                shutil.rmtree(self.data_path)
+        if not os.path.exists(self.data_path):
             os.makedirs(self.data_path)
-            url = self._getExactURL()
-            tar_path = utils.download(url, self.data_path)
-            utils.extract(tar_path, self.data_path, 'bz2')
-            os.remove(tar_path)
-            open(os.path.join(self.data_path, str(year) + str(month) + '.txt'), 'a').close()
-            self.loaded = True
-            print('successfully load data')
+        if not self._acquireUpdateLock():
+            print('another process is updating data')
+            return False
+        try:
+            if self._recoverSwap(locked=True):
+                old_version = self.getBundleVersion()
+                if old_version == version and not force:
+                    self._writeProbe(latest_bundle)
+                    return True
+            staging_path = os.path.join(self.data_path, self.staging_dir)
+            if os.path.exists(staging_path):
+                shutil.rmtree(staging_path)
+            os.makedirs(staging_path)
+            utils.download_and_extract(url, staging_path, 'bz2', checksum=checksum)
+
+            changed_files = self._swapBundleFiles(staging_path, version)
+            shutil.rmtree(staging_path)
+            # 派生缓存生成完之后才写入新的时间戳，时间戳写入之前出错时恢复原有的文件
+            try:
+                self._refreshDerivedCaches(changed_files, old_version, version)
+                self._writeTimestamp(version)
+            except BaseException:
+                self._recoverSwap(locked=True)
+                raise
+            self._writeProbe(latest_bundle)
+            self._finishSwap()
+            print('successfully update data to version {}, changed files: {}'.format(version, sorted(changed_files)))
+        finally:
+            self._releaseUpdateLock()
+        return True
+
+    def _hasLocalBundle(self):
+        if self.getBundleVersion() is None:
+            return False
+        for file_name in [self.stock_file, self.ex_cum_factor_file, self.trading_dates_file]:
+            if not os.path.exists(os.path.join(self.data_path, file_name)):
+                return False
+        return True
+
+    def _swapBundleFiles(self, staging_path, version):
+        '''
+        逐个比较暂存目录与数据目录中的文件，把新增和内容发生变化的文件作为一个整体替换过去。
+        替换之前先写入标记文件，记录新版本和要替换的文件，原有的文件移到备份目录中；标记存在期间数据包视为不完整。
+        替换中途出错时把已经替换的文件恢复为原有的文件；进程中途退出时由下次的_recoverSwap()恢复。
+        全部完成后由update()在写入时间戳之后调用_finishSwap()删除标记和备份
+        :return: 发生变化的文件（相对路径）集合
+        '''
+        changed_files = []
+        for dir_path, _, file_names in os.walk(staging_path):
+            for file_name in file_names:
+                staged = os.path.join(dir_path, file_name)
+                relative_path = os.path.relpath(staged, staging_path)
+                target = os.path.join(self.data_path, relative_path)
+                if os.path.exists(target) and filecmp.cmp(staged, target, shallow=False):
+                    continue
+                changed_files.append((relative_path, os.path.exists(target)))
+        if not changed_files:
+            return set()
+
+        backup_path = os.path.join(self.data_path, self.swap_backup_dir)
+        if os.path.exists(backup_path):
+            shutil.rmtree(backup_path)
+        os.makedirs(backup_path)
+        self._writeSwapMarker(version, changed_files)
+        try:
+            for relative_path, existed in changed_files:
+                target = os.path.join(self.data_path, relative_path)
+                if existed:
+                    backup = os.path.join(backup_path, relative_path)
+                    if not os.path.exists(os.path.dirname(backup)):
+                        os.makedirs(os.path.dirname(backup))
+                    os.replace(target, backup)
+                elif not os.path.exists(os.path.dirname(target)):
+                    os.makedirs(os.path.dirname(target))
+                os.replace(os.path.join(staging_path, relative_path), target)
+        except BaseException:
+            self._rollbackSwap(changed_files)
+            raise
+        return set(relative_path for relative_path, _ in changed_files)
+
+    def _writeSwapMarker(self, version, changed_files):
+        marker_path = os.path.join(self.data_path, self.swap_marker_file)
+        temp_path = '{}.{}.tmp'.format(marker_path, os.getpid())
+        with open(temp_path, 'w') as f:
+            f.write(version + '\n')
+            for relative_path, existed in changed_files:
+                f.write('{}\t{}\n'.format(int(existed), relative_path))
+        os.replace(temp_path, marker_path)
+
+    def _readSwapMarker(self):
+        '''
+        :return: (新版本, [(相对路径, 替换前是否存在)])，没有标记时返回None
+        '''
+        marker_path = os.path.join(self.data_path, self.swap_marker_file)
+        if not os.path.exists(marker_path):
+            return None
+        with open(marker_path) as f:
+            lines = f.read().splitlines()
+        changed_files = []
+        for line in lines[1:]:
+            existed, relative_path = line.split('\t', 1)
+            changed_files.append((relative_path, existed == '1'))
+        return lines[0], changed_files
+
+    def _rollbackSwap(self, changed_files):
+        '''
+        把备份目录中原有的文件移回数据目录，删除新版本新增的文件，然后删除标记和备份
+        '''
+        self._ex_cum_factor_table = None
+        self._calendar = None
+        self._metadata = None
+        self._bar_store = None
+        backup_path = os.path.join(self.data_path, self.swap_backup_dir)
+        for relative_path, existed in reversed(changed_files):
+            target = os.path.join(self.data_path, relative_path)
+            backup = os.path.join(backup_path, relative_path)
+            if existed:
+                if os.path.exists(backup):  # 备份不存在说明这个文件还没有被替换
+                    os.replace(backup, target)
+            elif os.path.exists(target):
+                os.remove(target)
+        self._finishSwap()
+
+    def _finishSwap(self):
+        marker_path = os.path.join(self.data_path, self.swap_marker_file)
+        if os.path.exists(marker_path):
+            os.remove(marker_path)
+        shutil.rmtree(os.path.join(self.data_path, self.swap_backup_dir), ignore_errors=True)
+
+    def _recoverSwap(self, locked=False):
+        '''
+        上次替换数据包文件时进程中途退出，留下了标记：新版本的时间戳已经写入时说明替换已经完成，只删除标记和备份；
+        否则恢复为替换之前的文件。其他进程正在更新时不做处理
+        :param locked: 调用者已经持有更新锁
+        :return: 进行了恢复时返回True
+        '''
+        if self._readSwapMarker() is None or (not locked and not self._acquireUpdateLock()):
+            return False
+        try:
+            marker = self._readSwapMarker()
+            if marker is None:
+                return False
+            version, changed_files = marker
+            if os.path.exists(os.path.join(self.data_path, version + '.txt')):
+                self._writeTimestamp(version)
+                self._finishSwap()
+            else:
+                print('recovering data files interrupted while updating to version {}'.format(version))
+                self._rollbackSwap(changed_files)
+            return True
+        finally:
+            if not locked:
+                self._releaseUpdateLock()
+
+    def _writeTimestamp(self, version):
+        open(os.path.join(self.data_path, version + '.txt'), 'a').close()
+        for file_name in os.listdir(self.data_path):
+            name, ext = os.path.splitext(file_name)
+            if ext == '.txt' and name.isdigit() and name != version:
+                os.remove(os.path.join(self.data_path, file_name))
+
+    def _refreshDerivedCaches(self, changed_files, old_version, version):
+        '''
+        派生缓存所依赖的文件都没有变化时，只把缓存的版本号改成新版本，不重新生成；
+        否则丢弃缓存，并立即重新生成元数据索引和行情存储，避免回测进程各自重复生成。
+        '''
+        self._ex_cum_factor_table = None
+        self._calendar = None
+        self._metadata = None
+        self._bar_store = None
+
+        unchanged = set()
+        for cache_name, source_files in self.derived_sources.items():
+            if old_version is not None and not changed_files & set(source_files):
+                unchanged.add(cache_name)
+
+        meta_path = os.path.join(self.data_path, BundleMetadata.meta_file)
+        if 'metadata' in unchanged and os.path.exists(meta_path):
+            metadata = BundleMetadata.read(meta_path)
+            metadata.version = version
+            metadata.save(meta_path)
+        store_path = os.path.join(self.data_path, self.bar_store_dir)
+        if 'bar_store' in unchanged and BarStore.isValid(store_path, old_version):
+            BarStore.restamp(store_path, version)
+        cache = AdjustedBarsCache(os.path.join(self.data_path, self.adjusted_cache_dir))
+        if 'adjusted_cache' in unchanged:
+            cache.restamp(old_version, version)
+        else:
+            cache.invalidate(version)
+
+        self.metadata(version)
+        self.barStore(version)
+
+    def _acquireUpdateLock(self):
+        lock_path = os.path.join(self.data_path, self.update_lock_file)
+        if os.path.exists(lock_path) and time.time() - os.path.getmtime(lock_path) > self.update_lock_timeout:
+            os.remove(lock_path)  # 持有锁的进程可能已经异常退出
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        return True
+
+    def _releaseUpdateLock(self):
+        lock_path = os.path.join(self.data_path, self.update_lock_file)
+        if os.path.exists(lock_path):
+            os.remove(lock_path)
+
+    def _isUpdatingElsewhere(self):
+        '''
+        其他进程正持有更新锁时返回True，这时派生缓存由它负责重新生成
+        '''
+        lock_path = os.path.join(self.data_path, self.update_lock_file)
+        try:
+            with open(lock_path) as f:
+                pid = f.read().strip()
+            stale = time.time() - os.path.getmtime(lock_path) > self.update_lock_timeout
+        except (IOError, OSError):
+            return False
+        return not stale and pid != str(os.getpid())
 
     def isLoaded(self):
         return self.loaded
 
+    def getBundleVersion(self):
+        '''
+        返回本地数据包的版本，即load()时写入的年月时间戳文件名（不含扩展名），
+        本地没有数据包，或者正在替换数据包文件（新旧版本的文件可能混杂）时返回None
+        '''
+        if not os.path.exists(self.data_path) or \
+                os.path.exists(os.path.join(self.data_path, self.swap_marker_file)):
+            return None
+        for file_name in os.listdir(self.data_path):
+            name, ext = os.path.splitext(file_name)
+            if ext == '.txt' and name.isdigit():
+                return name
+        return None
+
+    def _findLatestBundle(self, reprobe=False, record=True):
+        '''
+        从本月开始逐月向前探测，找到最新发布的数据包。结果在进程内缓存，只探测一次，
+        同时记录在数据目录下，同一天、同一CDN地址的其他进程直接使用，不再重复探测
+        :param reprobe: 忽略之前的探测结果，重新探测
+        :param record: 是否立即把探测结果写入数据目录，update()在数据包更新完成之后才写入
+        :return: (year, month, url)
+        '''
+        if reprobe:
+            self._latest_bundle = None
+        elif self._latest_bundle is None:
+            self._latest_bundle = self._readProbe()
+        if self._latest_bundle is None:
+            import requests
+            day = datetime.date.today()
+            for _ in range(self.max_probe_months):
+                url = self.CDN_URL % (day.year, day.month)
+                print(u"try {} ...".format(url))
+                r = requests.head(url, allow_redirects=True, timeout=self.probe_timeout)
+                if r.status_code == 200:
+                    print(u"succeed in {} ...".format(url))
+                    self._latest_bundle = (day.year, day.month, url)
+                    break
+                day -= dateutil.relativedelta.relativedelta(months=1)
+            else:
+                raise IOError('最近{}个月内没有找到可下载的数据包'.format(self.max_probe_months))
+            if record:
+                self._writeProbe(self._latest_bundle)
+        return self._latest_bundle
+
+    def _readProbe(self):
+        probe_path = os.path.join(self.data_path, self.probe_file)
+        if not os.path.exists(probe_path):
+            return None
+        with open(probe_path) as f:
+            fields = f.read().split()
+        if len(fields) != 5 or fields[0] != datetime.date.today().strftime('%Y%m%d') or fields[1] != self.CDN_URL:
+            return None
+        return int(fields[2]), int(fields[3]), fields[4]
+
+    def _writeProbe(self, latest_bundle):
+        if not os.path.exists(self.data_path):
+            os.makedirs(self.data_path)
+        probe_path = os.path.join(self.data_path, self.probe_file)
+        temp_path = '{}.{}.tmp'.format(probe_path, os.getpid())
+        with open(temp_path, 'w') as f:
+            f.write(' '.join([datetime.date.today().strftime('%Y%m%d'), self.CDN_URL] +
+                             [str(field) for field in latest_bundle]))
+        os.replace(temp_path, probe_path)
+
     def _getLatestTimestamp(self):
-        day = datetime.date.today()
-        while True:  # get exactly url
-            url = self.CDN_URL % (day.year, day.month)
-            r = requests.get(url, stream=True)
-            if r.status_code == 200:
-                return day.year, day.month
-            day -= dateutil.relativedelta.relativedelta(months=1)
+        year, month, _ = self._findLatestBundle()
+        return year, month
 
     def _getExactURL(self):
-        day = datetime.date.today()
-        while True:  # get exactly url
-            url = self.CDN_URL % (day.year, day.month)
-            print(u"try {} ...".format(url))
-            r = requests.get(url, stream=True)
-            if r.status_code == 200:
-                print(u"succeed in {} ...".format(url))
-                return url
-            day -= dateutil.relativedelta.relativedelta(months=1)
+        return self._findLatestBundle()[2]
 
     def allHistoryBars(self, frequency='1d', fields=None, start=None, end=None, skip_suspended=True,
                        include_now=False, adjust_type='pre', adjust_orig=None):
+        if frequency == '1m':
+            raise NotImplementedError('分钟线数据量过大，不支持一次读取全部历史，请通过minuteBarStore()按交易日读取')
         if frequency != '1d':
-            raise NotImplementedError('暂不支持调取日频以外的行情数据')
+            raise NotImplementedError('暂不支持调取日频和分钟频以外的行情数据')
         if adjust_type != 'pre' and adjust_type != 'None':
             raise NotImplementedError('暂不支持前复权以外的复权方式')
 
@@ -109,38 +470,50 @@ class Database:
         if adjust_orig is None:
             adjust_orig = datetime.datetime.now()
 
-        stocks_bars = self._allDayBars()
-        stocks_bars = self._stockFilter(skip_suspended, stocks_bars)
+        stocks_bars = self._cachedAdjustedBars(skip_suspended, adjust_type, adjust_orig)
 
-        adjusted_stocks_bars = {}
+        end_int = np.uint64(utils.convert_date_to_int(end))
+        start_int = np.uint64(utils.convert_date_to_int(start)) if start is not None else None
         for order_book_id, bars in stocks_bars.items():
             if not self._areFieldsValid(fields, bars.dtype.names):
                 raise ValueError("invalid fields: {}".format(fields))
-
-            end_int = np.uint64(utils.convert_date_to_int(end))
             right = bars['datetime'].searchsorted(end_int, side='right')
-            if start is not None:
-                start_int = np.uint64(utils.convert_date_to_int(start))
-                left = bars['datetime'].searchsorted(start_int)
-                bars = bars[left:right]
-            else:
-                bars = bars[:right]
-
-            if adjust_type == 'None':
-                return bars if fields is None else bars[fields]
-
-            if isinstance(fields, str) and fields not in FIELDS_REQUIRE_ADJUSTMENT:
-                return bars if fields is None else bars[fields]
+            left = bars['datetime'].searchsorted(start_int) if start_int is not None else 0
+            stocks_bars[order_book_id] = np.array(bars[left:right])
 
-            out_arr = self._adjustBars(bars, self._getExCumFactor(order_book_id), fields, adjust_type, adjust_orig)
-            out_arr['datetime'] = (out_arr['datetime'] / 1000000).astype(int)  # 默认的数据格式除了年月日之外还包含时分秒
+        adjusted_stocks_bars = {}
+        for order_book_id, out_arr in stocks_bars.items():
+            out_arr['datetime'] = out_arr['datetime'] // 1000000  # 默认的数据格式除了年月日之外还包含时分秒
             out_df = pd.DataFrame(out_arr, index=out_arr['datetime'])
             # out_df.index = out_df['datetime'].apply(lambda dt: datetime.datetime.strptime(str(dt), '%Y%m%d%H%M%S'))
             # 若采用datetime类型作为索引，耗时很长
 
-            adjusted_stocks_bars[order_book_id] = out_df
+            adjusted_stocks_bars[order_book_id] = out_df if fields is None else out_df[fields]
         return adjusted_stocks_bars
 
+    def _cachedAdjustedBars(self, skip_suspended, adjust_type, adjust_orig):
+        '''
+        返回筛选并复权后的全市场行情，优先读取磁盘缓存，没有缓存时计算后写入缓存。
+        缓存以数据包版本和实际生效的复权基准为键，数据包更新后自动失效。其他进程正在更新数据包时只计算不写入缓存。
+        '''
+        if adjust_type == 'None':
+            orig = 0
+        else:
+            orig = self.exCumFactorTable().effectiveOrigin(adjust_orig)
+        version = self.getBundleVersion()
+        key = AdjustedBarsCache.makeKey(version, adjust_type, orig, skip_suspended)
+        cache = AdjustedBarsCache(os.path.join(self.data_path, self.adjusted_cache_dir))
+
+        stocks_bars = cache.load(key)
+        if stocks_bars is None:
+            stocks_bars = self._allDayBars()
+            stocks_bars = self._stockFilter(skip_suspended, stocks_bars)
+            if adjust_type != 'None':
+                stocks_bars = self.exCumFactorTable().adjust(stocks_bars, adjust_orig, adjust_type)
+            if not self._isUpdatingElsewhere():
+                cache.save(key, stocks_bars)
+        return stocks_bars
+
     def _allDayBars(self):
         stocks_path = os.path.join(self.data_path, self.stock_file)
         stocks = utils.open_h5(stocks_path)
@@ -160,65 +533,38 @@ class Database:
 
         return filtered_stocks_bars
 
-    def getStockList(self):
-        stocks_path = os.path.join(self.data_path, self.stock_file)
-        stocks = utils.open_h5(stocks_path)
-        stocks_bars = {}
-        for order_book_id in stocks:
-            stocks_bars[order_book_id] = stocks[order_book_id][:]
-
-        filtered_volume0_stocks_bars = {}
-        for order_book_id, bars in stocks_bars.items():
-            bars = bars[bars['volume'] > 0]
-            if len(bars) > 0:
-                filtered_volume0_stocks_bars[order_book_id] = bars
+    def metadata(self, version=None):
+        '''
+        返回数据包的元数据索引，本地没有与当前数据包版本一致的索引时读取stocks.h5生成并保存
+        :param version: 索引应当对应的数据包版本，默认为本地时间戳的版本，update()在写入新的时间戳之前生成索引时指定
+        '''
+        if self._metadata is None:
+            meta_path = os.path.join(self.data_path, BundleMetadata.meta_file)
+            version = self.getBundleVersion() if version is None else version
+            metadata = BundleMetadata.read(meta_path)
+            # 其他进程正在更新数据包时沿用已有的索引，由它负责重新生成
+            if metadata is None or (metadata.version != version and not self._isUpdatingElsewhere()):
+                metadata = BundleMetadata.build(self.data_path, self.stock_file, self.ex_cum_factor_file,
+                                                self.calendar().trading_dates, version)
+                metadata.save(meta_path)
+            self._metadata = metadata
+        return self._metadata
 
-        ex_cum_factor_path = os.path.join(self.data_path, self.ex_cum_factor_file)
-        ex_cum_factor = utils.open_h5(ex_cum_factor_path)
-        stock_list = list(set(filtered_volume0_stocks_bars.keys()) & set(ex_cum_factor.keys()))
-        # 有一些股票（退市？）在记录了送股和转股信息的ex_cum_factor当中没有出现
+    def getStockList(self):
+        # 有一些股票（退市？）在记录了送股和转股信息的ex_cum_factor当中没有出现，不包含在内
+        return self.metadata().getStockList()
 
-        return stock_list
+    def getFirstTradingDate(self, order_book_id):
+        return self.metadata().getFirstTradingDate(order_book_id)
 
-    def _adjustBars(self, bars, ex_factors, fields, adjust_type, adjust_orig):
-        if ex_factors is None or len(bars) == 0:
-            return bars if fields is None else bars[fields]
+    def getLastTradingDate(self, order_book_id):
+        return self.metadata().getLastTradingDate(order_book_id)
 
-        dates = ex_factors['start_date']
-        ex_cum_factors = ex_factors['ex_cum_factor']
+    def getSuspendedDates(self, order_book_id):
+        return self.metadata().getSuspendedDates(order_book_id)
 
-        if adjust_type == 'pre':
-            adjust_orig_dt = np.uint64(utils.convert_date_to_int(adjust_orig))
-            base_adjust_rate = self._factor4Date(dates, ex_cum_factors, adjust_orig_dt)
-        else:
-            base_adjust_rate = 1.0
-
-        start_date = bars['datetime'][0]
-        end_date = bars['datetime'][-1]
-
-        if (self._factor4Date(dates, ex_cum_factors, start_date) == base_adjust_rate and
-                self._factor4Date(dates, ex_cum_factors, end_date) == base_adjust_rate):
-            return bars if fields is None else bars[fields]
-
-        factors = ex_cum_factors.take(dates.searchsorted(bars['datetime'], side='right') - 1)
-
-        # 复权
-        factors /= base_adjust_rate
-        if isinstance(fields, str):
-            if fields in PRICE_FIELDS:
-                return bars[fields] * factors
-            elif fields == 'volume':
-                return bars[fields] * (1 / factors)
-            # should not got here
-            return bars[fields]
-
-        result = np.copy(bars if fields is None else bars[fields])
-        for f in result.dtype.names:
-            if f in PRICE_FIELDS:
-                result[f] *= factors
-            elif f == 'volume':
-                result[f] *= (1 / factors)
-        return result
+    def isSuspended(self, order_book_id, date):
+        return self.metadata().isSuspended(order_book_id, date)
 
     @staticmethod
     def _areFieldsValid(fields, valid_fields):
@@ -231,38 +577,421 @@ class Database:
                 return False
         return True
 
-    def _getExCumFactor(self, order_book_id):
-        ex_cum_factor_path = os.path.join(self.data_path, self.ex_cum_factor_file)
-        ex_cum_factor = utils.open_h5(ex_cum_factor_path)
-        return ex_cum_factor[order_book_id][:]
+    def exCumFactorTable(self):
+        '''
+        所有股票的累计除权因子，每个进程只读取一次ex_cum_factor.h5
+        '''
+        if self._ex_cum_factor_table is None:
+            ex_cum_factor_path = os.path.join(self.data_path, self.ex_cum_factor_file)
+            self._ex_cum_factor_table = ExCumFactorTable.load(ex_cum_factor_path)
+        return self._ex_cum_factor_table
 
-    @staticmethod
-    def _factor4Date(dates, factors, d):
-        pos = bisect_right(dates, d)
-        return factors[pos-1]
+    def calendar(self):
+        '''
+        交易日历，每个进程只读取一次trading_dates.npy
+        '''
+        if self._calendar is None:
+            self._calendar = TradingCalendar.load(os.path.join(self.data_path, self.trading_dates_file))
+        return self._calendar
 
     def getStartDate(self):
-        trading_dates_path = os.path.join(self.data_path, self.trading_dates_file)
-        trading_dates = np.load(trading_dates_path)
-        return trading_dates[0]
+        return self.calendar().getStartDate()
 
     def getEndDate(self):
-        trading_dates_path = os.path.join(self.data_path, self.trading_dates_file)
-        trading_dates = np.load(trading_dates_path)
+        '''
+        数据包按月更新，返回上个月的最后一个交易日
+        '''
         now = datetime.datetime.now()
         first_day_curr_month = datetime.date(now.year, now.month, 1)
         last_day_pre_month = first_day_curr_month - datetime.timedelta(days=1)
-        last_day_pre_month = datetime.datetime.strftime(last_day_pre_month, '%Y%m%d')
-        last_day_pre_month = int(last_day_pre_month)
-        ind = trading_dates.searchsorted(last_day_pre_month, side='right')  # 返回符合要求的插入位置的最后一位的索引
-        return trading_dates[ind - 1]
+        last_day_pre_month = int(datetime.datetime.strftime(last_day_pre_month, '%Y%m%d'))
+        return self.calendar().offset(last_day_pre_month, 0)
 
     def getTradingDates(self):
-        trading_dates_path = os.path.join(self.data_path, self.trading_dates_file)
-        trading_dates = np.load(trading_dates_path)
-        end = self.getEndDate()
-        ind = trading_dates.searchsorted(end, side='right')
-        return trading_dates[:ind]
+        return self.calendar().getTradingDates(end=self.getEndDate())
+
+    def barStore(self, version=None):
+        '''
+        返回全市场日线行情的列式存储，首次调用时若本地没有与当前数据包版本一致的存储，就从stocks.h5转换生成。
+        其他进程正在更新数据包时沿用已有的存储，不重复生成
+        :param version: 存储应当对应的数据包版本，默认为本地时间戳的版本，update()在写入新的时间戳之前生成存储时指定
+        '''
+        if self._bar_store is None:
+            store_path = os.path.join(self.data_path, self.bar_store_dir)
+            version = self.getBundleVersion() if version is None else version
+            if BarStore.isValid(store_path, version) or \
+                    (BarStore.readMeta(store_path) is not None and self._isUpdatingElsewhere()):
+                self._bar_store = BarStore(store_path)
+            else:
+                print('building bar store ...')
+                stock_list = self.getStockList()
+                adjust_orig = datetime.datetime.now()
+                self._bar_store = BarStore.build(store_path, self._iterStoreBars(stock_list, adjust_orig), stock_list,
+                                                 self.getTradingDates(), version,
+                                                 utils.convert_date_to_int(adjust_orig))
+                print('successfully build bar store')
+        return self._bar_store
+
+    def _iterStoreBars(self, stock_list, adjust_orig, batch_size=500):
+        '''
+        分批读取、剔除停牌日并以adjust_orig为基准前复权，供BarStore.build使用，同一时间只有一批股票的行情在内存中
+        '''
+        stocks = utils.open_h5(os.path.join(self.data_path, self.stock_file))
+        for i in range(0, len(stock_list), batch_size):
+            stocks_bars = {}
+            for order_book_id in stock_list[i:i + batch_size]:
+                bars = stocks[order_book_id][:]
+                stocks_bars[order_book_id] = bars[bars['volume'] > 0]
+            for order_book_id, bars in self.exCumFactorTable().adjust(stocks_bars, adjust_orig).items():
+                bars['datetime'] = bars['datetime'] // 1000000
+                yield order_book_id, bars
+
+    # jqdatasdk.get_price的字段名与数据包字段名的对应关系
+    jq_fields = {'open': 'open', 'close': 'close', 'high': 'high', 'low': 'low', 'volume': 'volume',
+                 'money': 'total_turnover', 'high_limit': 'limit_up', 'low_limit': 'limit_down'}
+
+    def _storeBars(self, order_book_id, fields, start=None, end=None, count=None, skip_suspended=False,
+                   fill_suspended=True, adjust_type='pre', adjust_orig=None):
+        '''
+        从BarStore读取一只股票的日线，是get_price和historyBars的共同实现。
+        前复权且复权基准与存储一致、区间内没有停牌日时，返回的是存储的视图，不发生复制。
+        :param fields: 数据包中的字段名列表
+        :param start: YYYYMMDD格式的整数，与count二选一
+        :param end: YYYYMMDD格式的整数，None表示存储的最后一个交易日
+        :param count: 截至end的bar数量，skip_suspended为True时只计有成交的交易日
+        :param fill_suspended: 不剔除停牌日时，True表示停牌日的价格沿用前一交易日收盘价、成交量为0，False表示为NaN
+        :param adjust_type: 'pre'前复权，'post'后复权，'none'不复权
+        :return: (dates, values, traded)，values为 dates × fields 的数组
+        '''
+        bar_store = self.barStore()
+        if order_book_id not in bar_store.symbol_index:
+            raise ValueError('数据库中没有{}的行情'.format(order_book_id))
+        symbol_id = bar_store.symbol_index[order_book_id]
+        field_ids = [bar_store.field_index[field] for field in fields]
+
+        right = len(bar_store.dates) if end is None else bar_store.dates.searchsorted(end, side='right')
+        if skip_suspended:
+            positions = np.nonzero(bar_store.traded[symbol_id, :right])[0]
+            if count is not None:
+                positions = positions[-count:] if count > 0 else positions[:0]
+            elif start is not None:
+                positions = positions[bar_store.dates[positions] >= start]
+            index = positions
+        else:
+            if count is not None:
+                left = max(right - count, 0)
+            else:
+                left = 0 if start is None else bar_store.dates.searchsorted(start)
+            index = slice(left, right)
+
+        dates = bar_store.dates[index]
+        traded = bar_store.traded[symbol_id, index]
+        if field_ids == list(range(field_ids[0], field_ids[-1] + 1)):  # 连续的字段用切片，得到视图
+            values = bar_store.bars[symbol_id, index, field_ids[0]:field_ids[-1] + 1]
+        else:
+            values = bar_store.bars[symbol_id, index][:, field_ids]
+
+        factors = self._storeFactors(order_book_id, dates, adjust_type, adjust_orig)
+        if factors is not None:
+            values = np.array(values)
+            for i, field in enumerate(fields):
+                if field in PRICE_FIELDS:
+                    values[:, i] *= factors
+                elif field == 'volume':
+                    values[:, i] /= factors
+
+        if not skip_suspended and not traded.all():
+            values = np.array(values)
+            listed = np.cumsum(bar_store.traded[symbol_id, :right])[index] > 0
+            suspended = ~traded & listed
+            values[~listed] = np.nan
+            if fill_suspended:
+                # 存储中停牌日沿用的是前一交易日的整根bar，这里把开高低价改为前收盘价，成交量、成交额改为0
+                if 'close' in bar_store.field_index:
+                    close = bar_store.bars[symbol_id, index, bar_store.field_index['close']]
+                    close = close * factors if factors is not None else close
+                    for i, field in enumerate(fields):
+                        if field in ('open', 'high', 'low'):
+                            values[suspended, i] = close[suspended]
+                for i, field in enumerate(fields):
+                    if field in ('volume', 'total_turnover'):
+                        values[suspended, i] = 0
+            else:
+                values[suspended] = np.nan
+        return dates, values, traded
+
+    def _storeFactors(self, order_book_id, dates, adjust_type, adjust_orig):
+        '''
+        把BarStore中的前复权价格换算为所需复权方式的乘数，与存储一致时返回None
+        '''
+        bar_store = self.barStore()
+        table = self.exCumFactorTable()
+        code_id = table.code_index.get(order_book_id, -1)
+        store_orig = bar_store.adjust_orig
+        if store_orig is None:  # 早先生成的存储没有记录复权基准，当时以生成存储的时间为基准
+            store_orig = utils.convert_date_to_int(datetime.datetime.now())
+        if adjust_type == 'pre':
+            if adjust_orig is None:
+                return None
+            orig = utils.convert_date_to_int(adjust_orig)
+            if table.effectiveOrigin(adjust_orig) == table.effectiveOrigin(
+                    datetime.datetime.strptime(str(store_orig // 1000000), '%Y%m%d')):
+                return None
+        elif adjust_type not in ('post', 'none', None):
+            raise ValueError('无效的复权方式：{}'.format(adjust_type))
+        store_factor = table.lookup([code_id], [store_orig])[0]
+        if adjust_type == 'pre':
+            return np.full(len(dates), store_factor / table.lookup([code_id], [orig])[0])
+        if adjust_type == 'post':
+            return np.full(len(dates), store_factor)
+        day_factors = table.lookup(np.full(len(dates), code_id), np.asarray(dates, dtype=np.uint64) * 1000000)
+        return store_factor / day_factors
+
+    def historyBars(self, order_book_id, frequency='1d', fields=None, start=None, end=None, skip_suspended=True,
+                    include_now=False, adjust_type='pre', adjust_orig=None, bar_count=None):
+        '''
+        从本地的BarStore读取一只股票的日线，不需要联网，返回的DataFrame与allHistoryBars中的一项格式相同
+        :param start: datetime.datetime或形如2000-01-01的字符串，与bar_count二选一
+        :param end: 同上，默认为数据包的最后一个交易日
+        :param bar_count: 截至end的bar数量
+        :param adjust_type: 'pre'前复权，'post'后复权，'None'不复权
+        :param adjust_orig: 前复权的基准日期，默认为最新
+        '''
+        if frequency != '1d':
+            raise NotImplementedError('本地只支持日线，分钟线请通过minuteBarStore()读取')
+        bar_store = self.barStore()
+        if fields is None:
+            fields = list(bar_store.fields)
+        elif isinstance(fields, six.string_types):
+            fields = [fields]
+        if not self._areFieldsValid(fields, bar_store.fields):
+            raise ValueError("invalid fields: {}".format(fields))
+        start = utils.to_date_int(start) if start is not None else None
+        end = utils.to_date_int(end) if end is not None else None
+        adjust_type = 'none' if adjust_type == 'None' else adjust_type
+        dates, values, _ = self._storeBars(order_book_id, fields, start, end, bar_count, skip_suspended,
+                                           adjust_type=adjust_type, adjust_orig=adjust_orig)
+        out_df = pd.DataFrame(values, index=dates, columns=fields, copy=False)
+        out_df.insert(0, 'datetime', dates)
+        return out_df
+
+    def get_price(self, security, start_date=None, end_date=None, frequency='daily', fields=None,
+                  skip_paused=False, fq='pre', count=None, panel=True, fill_paused=True):
+        '''
+        用法与jqdatasdk.get_price相同。日线从本地的BarStore读取，不需要联网；其他频率仍然交给jqdatasdk。
+        security为一只股票时返回以日期为索引的DataFrame；为股票列表时，panel=False返回含time、code列的DataFrame，
+        panel=True返回{字段: 日期 × 股票的DataFrame}（代替新版pandas中已经移除的Panel）。
+        前复权以数据包中最新的除权因子为基准。
+        '''
+        if frequency not in ('daily', '1d'):
+            jqdatasdk = importlib.import_module('jqdatasdk')
+            return jqdatasdk.get_price(security, start_date=start_date, end_date=end_date, frequency=frequency,
+                                       fields=fields, skip_paused=skip_paused, fq=fq, count=count, panel=panel,
+                                       fill_paused=fill_paused)
+        if count is not None and start_date is not None:
+            raise ValueError('start_date和count不能同时指定')
+        if fields is None:
+            fields = ['open', 'close', 'high', 'low', 'volume', 'money']
+        elif isinstance(fields, six.string_types):
+            fields = [fields]
+        for field in fields:
+            if field not in self.jq_fields and field != 'paused':
+                raise ValueError('本地数据不支持字段{}'.format(field))
+        store_fields = [self.jq_fields[field] for field in fields if field != 'paused']
+        start = utils.to_date_int(start_date) if start_date is not None else None
+        end = utils.to_date_int(end_date) if end_date is not None else None
+        adjust_type = 'none' if fq is None else fq
+
+        frames = {}
+        securities = [security] if isinstance(security, six.string_types) else list(security)
+        for order_book_id in securities:
+            dates, values, traded = self._storeBars(order_book_id, store_fields or ['close'], start, end, count,
+                                                    skip_paused, fill_paused, adjust_type)
+            columns = {}
+            for field in fields:
+                if field == 'paused':
+                    columns[field] = (~traded).astype(np.float64)
+                else:
+                    columns[field] = values[:, store_fields.index(self.jq_fields[field])]
+            frames[order_book_id] = pd.DataFrame(columns, index=pd.to_datetime(dates.astype(str), format='%Y%m%d'),
+                                                 columns=fields)
+
+        if isinstance(security, six.string_types):
+            return frames[security]
+        if panel:
+            return {field: pd.DataFrame({code: frame[field] for code, frame in frames.items()}) for field in fields}
+        long_frames = []
+        for code, frame in frames.items():
+            frame = frame.rename_axis('time').reset_index()
+            frame.insert(1, 'code', code)
+            long_frames.append(frame)
+        return pd.concat(long_frames, ignore_index=True)
+
+    def minuteBarStore(self):
+        '''
+        按交易日分块存储的分钟线，数据需要先通过importMinuteBars()导入
+        '''
+        return MinuteBarStore(os.path.join(self.data_path, self.minute_store_dir))
+
+    def importMinuteBars(self, symbols, start, end, batch_size=200, overwrite=False):
+        '''
+        通过jqdatasdk逐个交易日下载未复权的分钟线，写入分钟线存储。已导入的交易日默认跳过，中断后可以重新运行继续导入。
+        :param symbols: 股票代码列表
+        :param start: 形如20200101的整数
+        :param end: 形如20200131的整数
+        '''
+        store = self.minuteBarStore()
+        jq_fields = ['open', 'close', 'high', 'low', 'volume', 'money']  # money即成交额total_turnover
+        for date in self.calendar().getTradingDates(start, end):
+            if store.hasDate(date) and not overwrite:
+                continue
+            day = datetime.datetime.strptime(str(date), '%Y%m%d')
+            frames = []
+            for i in range(0, len(symbols), batch_size):
+                frames.append(self.get_price(symbols[i:i + batch_size], start_date=day.replace(hour=9, minute=30),
+                                             end_date=day.replace(hour=15), frequency='1m', fields=jq_fields,
+                                             skip_paused=True, fq=None, panel=False))
+            frame = pd.concat(frames)
+            times = frame['time'].dt.hour.values * 100 + frame['time'].dt.minute.values
+            day_times = np.unique(times)
+            day_symbols = list(pd.unique(frame['code']))
+            symbol_ids = {symbol: i for i, symbol in enumerate(day_symbols)}
+            bars = np.full((len(day_times), len(day_symbols), len(jq_fields)), np.nan, dtype=np.float32)
+            bars[day_times.searchsorted(times), [symbol_ids[code] for code in frame['code']], :] = frame[jq_fields].values
+            store.writeDay(date, day_times, day_symbols, bars)
+            print('successfully import minute bars of {}'.format(date))
+
+    def fundamentalsStore(self):
+        '''
+        本地的时点财务数据，数据需要先通过importFundamentals()导入
+        '''
+        if self._fundamentals_store is None:
+            self._fundamentals_store = FundamentalsStore(os.path.join(self.data_path, self.fundamentals_dir))
+        return self._fundamentals_store
+
+    def importFundamentals(self, start, end, tables=('valuation', 'income'), overwrite=False):
+        '''
+        通过jqdatasdk批量导入财务数据。valuation等截面表逐个交易日下载，每个月写入一次；
+        income等报表逐个报告期下载，以公告日作为生效日期。已导入的交易日和报告期默认跳过，中断后可以重新运行继续导入，
+        最近的报告期在导入时可能还有公司没有公布，之后需要用overwrite=True重新导入。
+        :param start: 形如20200101的整数
+        :param end: 形如20201231的整数
+        '''
+        store = self.fundamentalsStore()
+        for table in tables:
+            jq_query = self.query(getattr(self, table))
+            if table in SNAPSHOT_TABLES:
+                imported = set(store.getDates(table))
+                dates = self.calendar().getTradingDates(start, end)
+                frames = []
+                for i, date in enumerate(dates):
+                    if overwrite or date not in imported:
+                        day = datetime.datetime.strptime(str(date), '%Y%m%d').date()
+                        frames.append(self.get_fundamentals(jq_query, date=day))
+                    if frames and (i == len(dates) - 1 or dates[i + 1] // 100 != date // 100):
+                        store.write(table, pd.concat(frames), 'day')
+                        frames = []
+                        print('successfully import {t} of {m}'.format(t=table, m=date // 100))
+            else:
+                imported = set(store.getStatDates(table))
+                for year in range(start // 10000, end // 10000 + 1):
+                    for quarter in range(1, 5):
+                        stat_date = '{y}q{q}'.format(y=year, q=quarter)
+                        if not start <= parse_stat_date(stat_date) <= end:
+                            continue
+                        if parse_stat_date(stat_date) in imported and not overwrite:
+                            continue
+                        store.write(table, self.get_fundamentals(jq_query, statDate=stat_date), 'pubDate', 'statDate')
+                        print('successfully import {t} of {s}'.format(t=table, s=stat_date))
+
+    def get_fundamentals(self, query_object, date=None, statDate=None):
+        '''
+        query_object由simplequant.data.fundamentals.query()构造时在本地财务数据上查询，不需要联网，
+        用法与jqdatasdk.get_fundamentals相同；其他查询仍然交给jqdatasdk。
+        date不是交易日时取之前最近的一个交易日，都不给出时取数据包的最后一个交易日
+        '''
+        if not isinstance(query_object, Query):
+            jqdatasdk = importlib.import_module('jqdatasdk')
+            return jqdatasdk.get_fundamentals(query_object, date=date, statDate=statDate)
+        if date is not None:
+            date = utils.to_date_int(date)
+        elif statDate is not None:
+            date = parse_stat_date(statDate)
+        else:
+            date = self.getEndDate()
+        date = self.calendar().offset(date, 0)
+        return self.fundamentalsStore().getFundamentals(query_object, date, statDate)
+
+    # 无风险利率在聚宽MAC_LEND_RATE表中的market_id
+    lend_rate_markets = {'HIBOR': 1, 'LIBOR': 2, 'CHIBOR': 3, 'SIBOR': 4, 'SHIBOR': 5}
+
+    def referenceSeries(self, order_book_id):
+        '''
+        返回指数或股票的收盘价序列（以YYYYMMDD格式的整数为索引的Series），用作绩效分析的基准和市场组合。
+        指数只从indexes.h5中读取这一只，股票取BarStore中有成交的交易日的前复权收盘价。
+        结果在进程内缓存，并按数据包版本保存到磁盘，数据包更新后自动重新生成
+        '''
+        if order_book_id not in self._reference_series:
+            cache = ReferenceSeriesCache(os.path.join(self.data_path, self.reference_dir))
+            version = self.getBundleVersion()
+            entry = cache.load(order_book_id)
+            if entry is not None and entry[2] == str(version):
+                dates, values, _ = entry
+            else:
+                indexes = utils.open_h5(os.path.join(self.data_path, self.indexes_file))
+                if order_book_id in indexes:
+                    index_arr = indexes[order_book_id][:]
+                    dates, values = index_arr['datetime'] // 1000000, index_arr['close']
+                else:
+                    bar_store = self.barStore()
+                    if order_book_id not in bar_store.symbol_index:
+                        raise KeyError('数据库中没有{}的行情'.format(order_book_id))
+                    symbol_id = bar_store.symbol_index[order_book_id]
+                    traded = np.asarray(bar_store.traded[symbol_id])
+                    dates = bar_store.dates[traded]
+                    values = bar_store.bars[symbol_id, traded, bar_store.field_index['close']]
+                cache.save(order_book_id, dates, values, version)
+            self._reference_series[order_book_id] = pd.Series(values, index=dates)
+        return self._reference_series[order_book_id]
+
+    def riskFreeRate(self, risk_free_rate='SHIBOR', end=None, auth=None):
+        '''
+        返回隔夜拆借利率（百分比，以YYYYMMDD格式的整数为索引的Series）。
+        第一次使用时通过jqdatasdk下载并保存到磁盘，之后只有本地的序列没有覆盖到end时才重新下载，每天最多一次；
+        下载失败时沿用本地已有的序列，因此有缓存时可以离线计算绩效。
+        :param risk_free_rate: 'HIBOR'、'LIBOR'、'CHIBOR'、'SIBOR'或'SHIBOR'
+        :param end: YYYYMMDD格式的整数，需要覆盖到的最后一个交易日
+        :param auth: (账号, 密码)，需要下载且jqdatasdk尚未登录时使用
+        '''
+        key = 'rate_' + risk_free_rate
+        cache = ReferenceSeriesCache(os.path.join(self.data_path, self.reference_dir))
+        if key not in self._risk_free_rates:
+            entry = cache.load(key)
+            if entry is not None:
+                self._risk_free_rates[key] = (pd.Series(entry[1], index=entry[0]), entry[2])
+        series, fetched = self._risk_free_rates.get(key, (None, None))
+
+        today = datetime.date.today().strftime('%Y%m%d')
+        if series is None or (end is not None and series.index[-1] < end and fetched != today):
+            try:
+                if auth is not None and not self.is_auth():
+                    self.auth(*auth)
+                macro = self.macro
+                table = macro.MAC_LEND_RATE
+                q = self.query(table).filter(table.currency_id == 1,
+                                             table.market_id == self.lend_rate_markets[risk_free_rate],
+                                             table.term_id == 20).order_by(table.day.asc())
+                df = macro.run_query(q)
+            except Exception as e:
+                if series is None:
+                    raise
+                print('failed to update {r}, use local data: {e}'.format(r=risk_free_rate, e=e))
+            else:
+                dates = np.array([int(day.replace('-', '')) for day in df['day'].astype(str)], dtype=np.int64)
+                series = pd.Series(df['interest_rate'].values.astype(np.float64), index=dates)
+                cache.save(key, dates, series.values, today)
+            self._risk_free_rates[key] = (series, today)
+        return series
 
     def allHistoryIndexes(self):
         indexes_path = os.path.join(self.data_path, self.indexes_file)
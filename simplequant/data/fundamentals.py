@@ -0,0 +1,437 @@
+import datetime
+import json
+import operator
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from simplequant import utils
+
+
+SNAPSHOT_TABLES = ('valuation',)  # 每个交易日一份截面的表，其余的表视为按公告日生效的财务报表
+
+
+class Field:
+    """
+    表中的一个字段，用法与jqdatasdk相同：比较运算得到筛选条件，asc()/desc()得到排序方式
+    """
+    def __init__(self, table, name):
+        self.table = table
+        self.name = name
+
+    def __repr__(self):
+        return '{t}.{n}'.format(t=self.table.name, n=self.name)
+
+    def __gt__(self, other):
+        return Condition(operator.gt, self, other)
+
+    def __ge__(self, other):
+        return Condition(operator.ge, self, other)
+
+    def __lt__(self, other):
+        return Condition(operator.lt, self, other)
+
+    def __le__(self, other):
+        return Condition(operator.le, self, other)
+
+    def __eq__(self, other):
+        return Condition(operator.eq, self, other)
+
+    def __ne__(self, other):
+        return Condition(operator.ne, self, other)
+
+    def __hash__(self):
+        return hash((self.table.name, self.name))
+
+    def in_(self, values):
+        return Condition(lambda column, values: np.isin(column, list(values)), self, values)
+
+    def notin_(self, values):
+        return ~self.in_(values)
+
+    def asc(self):
+        return self, True
+
+    def desc(self):
+        return self, False
+
+
+class Condition:
+    """
+    筛选条件，可以用&、|、~组合
+    """
+    def __init__(self, op, *operands):
+        self.op = op
+        self.operands = operands
+
+    def fields(self):
+        for operand in self.operands:
+            if isinstance(operand, Field):
+                yield operand
+            elif isinstance(operand, Condition):
+                for field in operand.fields():
+                    yield field
+
+    def evaluate(self, columns):
+        """
+        :param columns: {Field: 一维数组}
+        :return: 布尔数组
+        """
+        values = []
+        for operand in self.operands:
+            if isinstance(operand, Field):
+                values.append(columns[operand])
+            elif isinstance(operand, Condition):
+                values.append(operand.evaluate(columns))
+            else:
+                values.append(operand)
+        with np.errstate(invalid='ignore'):  # 与NaN比较的结果为False，相当于SQL中的NULL
+            return np.asarray(self.op(*values), dtype=np.bool_)
+
+    def __and__(self, other):
+        return Condition(np.logical_and, self, other)
+
+    def __or__(self, other):
+        return Condition(np.logical_or, self, other)
+
+    def __invert__(self):
+        return Condition(np.logical_not, self)
+
+
+class Table:
+    """
+    财务数据表，访问属性即得到同名的字段，如valuation.pe_ratio
+    """
+    def __init__(self, name):
+        self.name = name
+        self.kind = 'snapshot' if name in SNAPSHOT_TABLES else 'report'
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return Field(self, name)
+
+    def __repr__(self):
+        return self.name
+
+
+class Query:
+    """
+    本地财务数据的查询，支持filter、order_by、limit，每次调用返回新的Query，原Query不变
+    """
+    def __init__(self, entities, conditions=(), orders=(), limit_num=None):
+        self.entities = tuple(entities)
+        self.conditions = tuple(conditions)
+        self.orders = tuple(orders)
+        self.limit_num = limit_num
+
+    def filter(self, *conditions):
+        return Query(self.entities, self.conditions + conditions, self.orders, self.limit_num)
+
+    def order_by(self, *orders):
+        # 直接传入字段时按升序排列
+        orders = tuple(order if isinstance(order, tuple) else (order, True) for order in orders)
+        return Query(self.entities, self.conditions, self.orders + orders, self.limit_num)
+
+    def limit(self, limit_num):
+        return Query(self.entities, self.conditions, self.orders, limit_num)
+
+    def tables(self):
+        """
+        查询涉及的所有表，按首次出现的顺序排列
+        """
+        tables = []
+        fields = [entity for entity in self.entities if isinstance(entity, Field)]
+        for condition in self.conditions:
+            fields.extend(condition.fields())
+        fields.extend(field for field, _ in self.orders)
+        for item in [entity for entity in self.entities if isinstance(entity, Table)] + [f.table for f in fields]:
+            if item.name not in [table.name for table in tables]:
+                tables.append(item)
+        return tables
+
+
+def query(*entities):
+    return Query(entities)
+
+
+valuation = Table('valuation')
+income = Table('income')
+balance = Table('balance')
+cash_flow = Table('cash_flow')
+
+
+def parse_stat_date(stat_date):
+    """
+    把jqdatasdk的statDate（如'2019q1'、'2019'）转换为报告期最后一天，形如20190331的整数
+    """
+    stat_date = str(stat_date)
+    if 'q' in stat_date:
+        year, quarter = stat_date.split('q')
+        return int(year) * 10000 + [331, 630, 930, 1231][int(quarter) - 1]
+    return int(stat_date) * 10000 + 1231
+
+
+class FundamentalsStore:
+    """
+    本地的时点（point-in-time）财务数据，由jqdatasdk批量导入，之后可以完全离线地回测基本面策略。
+
+    每张表是store_path下的一个子目录，记录首尾相接保存为一组一维数组：code_ids.npy为股票在symbols.npy中的序号，
+    dates.npy为生效日期，每个字段一个float64数组，以memmap方式打开。
+    valuation这类截面表的生效日期是交易日，按年分区、每个分区内按(日期, 股票)排序，某个交易日的截面是连续的一段；
+    income等报表的生效日期是公告日pubDate，另有stat_dates.npy记录报告期，按(股票, 公告日)排序，
+    查询某日时每只股票取公告日不晚于该日的最后一期，不会用到当时尚未公布的报表。
+    """
+
+    symbols_file = 'symbols.npy'
+    meta_file = 'meta.json'
+    report_partition = 'all'
+    KEY_SHIFT = 10 ** 8  # 日期是YYYYMMDD格式的整数，小于10 ** 8
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        if not os.path.exists(store_path):
+            os.makedirs(store_path)
+        symbols_path = os.path.join(store_path, self.symbols_file)
+        if os.path.exists(symbols_path):
+            self.symbols = np.array([str(symbol) for symbol in np.load(symbols_path)])
+        else:
+            self.symbols = np.array([], dtype=str)
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self._partitions = {}
+
+    def _tablePath(self, table):
+        return os.path.join(self.store_path, table)
+
+    def readMeta(self, table):
+        meta_path = os.path.join(self._tablePath(table), self.meta_file)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+
+    def getFields(self, table):
+        meta = self.readMeta(table)
+        return [] if meta is None else meta['fields']
+
+    def _partitionNames(self, table):
+        table_path = self._tablePath(table)
+        if not os.path.exists(table_path):
+            return []
+        return sorted(name for name in os.listdir(table_path)
+                      if os.path.isdir(os.path.join(table_path, name)) and '.building' not in name)
+
+    def _loadPartition(self, table, name):
+        key = (table, name)
+        if key not in self._partitions:
+            partition_path = os.path.join(self._tablePath(table), name)
+            partition = {}
+            for file_name in os.listdir(partition_path):
+                column, ext = os.path.splitext(file_name)
+                if ext == '.npy':
+                    partition[column] = np.load(os.path.join(partition_path, file_name), mmap_mode='r')
+            self._partitions[key] = partition
+        return self._partitions[key]
+
+    def getDates(self, table):
+        """
+        返回截面表已导入的交易日
+        """
+        dates = [np.unique(self._loadPartition(table, name)['dates']) for name in self._partitionNames(table)]
+        return np.concatenate(dates) if dates else np.array([], dtype=np.int64)
+
+    def getStatDates(self, table):
+        """
+        返回报表已导入的报告期
+        """
+        if self.report_partition not in self._partitionNames(table):
+            return np.array([], dtype=np.int64)
+        return np.unique(self._loadPartition(table, self.report_partition)['stat_dates'])
+
+    def write(self, table, frame, date_column, stat_date_column=None):
+        """
+        把jqdatasdk.get_fundamentals返回的DataFrame写入存储，与已有记录合并，同一股票同一生效日期的记录以新的为准
+        :param date_column: 生效日期所在的列，截面表为'day'，报表为'pubDate'
+        :param stat_date_column: 报表的报告期所在的列，一般为'statDate'
+        """
+        if len(frame) == 0:
+            return
+        kind = 'snapshot' if table in SNAPSHOT_TABLES else 'report'
+        new_symbols = [symbol for symbol in pd.unique(frame['code']) if symbol not in self.symbol_index]
+        if new_symbols:
+            for i, symbol in enumerate(new_symbols):
+                self.symbol_index[symbol] = len(self.symbols) + i
+            self.symbols = np.concatenate([self.symbols, np.array(new_symbols)])
+            temp_path = os.path.join(self.store_path, 'symbols.tmp.npy')
+            np.save(temp_path, self.symbols)
+            os.replace(temp_path, os.path.join(self.store_path, self.symbols_file))
+
+        excluded = {'id', 'code', date_column, stat_date_column}
+        fields = [column for column in frame.columns
+                  if column not in excluded and pd.api.types.is_numeric_dtype(frame[column])]
+        columns = {'code_ids': frame['code'].map(self.symbol_index).values.astype(np.int64),
+                   'dates': np.array([utils.to_date_int(date) for date in frame[date_column]], dtype=np.int64)}
+        if kind == 'report':
+            columns['stat_dates'] = np.array([utils.to_date_int(date) for date in frame[stat_date_column]],
+                                             dtype=np.int64)
+        for field in fields:
+            columns[field] = frame[field].values.astype(np.float64)
+
+        if kind == 'snapshot':
+            partition_ids = columns['dates'] // 10000
+        else:
+            partition_ids = np.zeros(len(frame), dtype=np.int64)
+        for partition_id in np.unique(partition_ids):
+            name = str(partition_id) if kind == 'snapshot' else self.report_partition
+            mask = partition_ids == partition_id
+            self._writePartition(table, name, kind, {column: values[mask] for column, values in columns.items()})
+
+        all_fields = self.getFields(table)
+        all_fields += [field for field in fields if field not in all_fields]
+        with open(os.path.join(self._tablePath(table), self.meta_file), 'w') as f:
+            json.dump({'kind': kind, 'fields': all_fields}, f)
+
+    def _writePartition(self, table, name, kind, columns):
+        partition_path = os.path.join(self._tablePath(table), name)
+        if os.path.exists(partition_path):
+            old = {column: np.array(values) for column, values in self._loadPartition(table, name).items()}
+            n_old = len(old['dates'])
+            for column in set(old) | set(columns):  # 一方缺少的字段补NaN
+                old_values = old.get(column, np.full(n_old, np.nan))
+                new_values = columns.get(column, np.full(len(columns['dates']), np.nan))
+                columns[column] = np.concatenate([old_values, new_values])
+
+        if kind == 'snapshot':
+            order = np.lexsort((columns['code_ids'], columns['dates']))
+        else:
+            order = np.lexsort((columns['dates'], columns['code_ids']))
+        # 排序稳定，同一(股票, 日期)的多条记录中新写入的排在最后
+        keys = columns['code_ids'][order] * self.KEY_SHIFT + columns['dates'][order]
+        keep = np.append(keys[1:] != keys[:-1], True)
+        order = order[keep]
+
+        building_path = utils.make_building_dir(partition_path)
+        try:
+            for column, values in columns.items():
+                np.save(os.path.join(building_path, column + '.npy'), values[order])
+        except BaseException:
+            shutil.rmtree(building_path, ignore_errors=True)
+            raise
+        self._partitions.pop((table, name), None)
+        if not utils.replace_dir(building_path, partition_path):
+            raise IOError('其他进程同时写入了{t}的分区{n}，请重新导入'.format(t=table, n=name))
+
+    def _snapshot(self, table, date):
+        """
+        返回截面表在date这一交易日的(股票序号, {列名: 数组})
+        """
+        name = str(date // 10000)
+        if name not in self._partitionNames(table):
+            raise KeyError('{t}中没有{d}的数据，请先通过Database.importFundamentals()导入'.format(t=table, d=date))
+        partition = self._loadPartition(table, name)
+        start, end = partition['dates'].searchsorted([date, date + 1])
+        if start == end:
+            raise KeyError('{t}中没有{d}的数据，请先通过Database.importFundamentals()导入'.format(t=table, d=date))
+        return np.array(partition['code_ids'][start:end]), partition, slice(start, end)
+
+    def _reportRows(self, table, code_ids, date, stat_date=None):
+        """
+        返回每只股票在date当日可以看到的最后一期报表在分区中的行号，没有时为-1。
+        给出stat_date时只在该报告期的报表中查找
+        """
+        if self.report_partition not in self._partitionNames(table):
+            raise KeyError('本地没有{}的数据，请先通过Database.importFundamentals()导入'.format(table))
+        partition = self._loadPartition(table, self.report_partition)
+        row_code_ids = partition['code_ids']
+        if stat_date is not None:
+            candidates = np.nonzero(np.asarray(partition['stat_dates']) == stat_date)[0]
+        else:
+            candidates = np.arange(len(row_code_ids))
+        if len(candidates) == 0:
+            return np.full(len(code_ids), -1), partition
+        keys = row_code_ids[candidates] * self.KEY_SHIFT + partition['dates'][candidates]
+        pos = keys.searchsorted(code_ids * self.KEY_SHIFT + date, side='right') - 1
+        rows = candidates[np.maximum(pos, 0)]
+        found = (pos >= 0) & (row_code_ids[rows] == code_ids)
+        return np.where(found, rows, -1), partition
+
+    def getFundamentals(self, query_object, date=None, statDate=None):
+        """
+        在本地数据上执行query_object，用法与jqdatasdk.get_fundamentals相同，返回DataFrame
+        :param date: 查询日期，截面表必须已导入这一交易日的数据
+        :param statDate: 报告期，如'2019q1'、'2019'，截面表取报告期最后一天的数据
+        """
+        if statDate is not None:
+            stat_date = parse_stat_date(statDate)
+            date = stat_date if date is None else utils.to_date_int(date)
+        else:
+            stat_date = None
+            date = utils.to_date_int(date)
+
+        tables = query_object.tables()
+        snapshot_tables = [table for table in tables if table.kind == 'snapshot']
+        columns = {}
+        if snapshot_tables:  # 以第一张截面表当日的股票为准
+            code_ids = self._snapshot(snapshot_tables[0].name, date)[0]
+        else:  # 只查询报表时以有报表的所有股票为准
+            code_ids = np.arange(len(self.symbols))
+
+        for table in tables:
+            if table.kind == 'snapshot':
+                table_code_ids, partition, rows = self._snapshot(table.name, date)
+                positions = table_code_ids.searchsorted(code_ids)
+                positions = np.minimum(positions, len(table_code_ids) - 1)
+                valid = table_code_ids[positions] == code_ids
+                rows = np.where(valid, rows.start + positions, -1)
+            else:
+                # 指定报告期时与jqdatasdk一致，返回该期报表而不考虑公告日
+                report_date = date if stat_date is None else 99991231
+                rows, partition = self._reportRows(table.name, code_ids, report_date, stat_date)
+            valid = rows >= 0
+            columns[(table.name, 'code')] = self.symbols[code_ids]
+            for column, values in partition.items():
+                if column == 'code_ids':
+                    continue
+                values = np.where(valid, values[np.maximum(rows, 0)], np.nan)
+                if column in ('dates', 'stat_dates'):
+                    column = {'dates': 'day' if table.kind == 'snapshot' else 'pubDate', 'stat_dates': 'statDate'}[column]
+                columns[(table.name, column)] = values
+            if not snapshot_tables:  # 只查询报表时剔除没有任何一期报表的股票
+                code_ids = code_ids[valid]
+                columns = {key: values[valid] for key, values in columns.items()}
+
+        def getColumn(field):
+            if (field.table.name, field.name) not in columns:
+                raise ValueError('本地的{}中没有{}字段'.format(field.table.name, field.name))
+            return columns[(field.table.name, field.name)]
+
+        mask = np.ones(len(code_ids), dtype=np.bool_)
+        for condition in query_object.conditions:
+            mask &= condition.evaluate({field: getColumn(field) for field in condition.fields()})
+        selected = np.nonzero(mask)[0]
+        if query_object.orders:
+            # np.lexsort以最后一个键为主键；降序时对数值取负，NaN排在最后
+            sort_keys = []
+            for field, ascending in reversed(query_object.orders):
+                values = getColumn(field)[selected]
+                sort_keys.append(values if ascending else -values)
+            selected = selected[np.lexsort(sort_keys)]
+        if query_object.limit_num is not None:
+            selected = selected[:query_object.limit_num]
+
+        result = {}
+        for entity in query_object.entities:
+            if isinstance(entity, Table):
+                names = ['code'] + [column for (table, column) in columns if table == entity.name and column != 'code']
+                fields = [Field(entity, name) for name in names]
+            else:
+                fields = [entity]
+            for field in fields:
+                if field.name not in result:
+                    values = getColumn(field)[selected]
+                    if field.name in ('day', 'pubDate', 'statDate'):
+                        values = [str(datetime.datetime.strptime(str(int(d)), '%Y%m%d').date()) if d == d else None
+                                  for d in values]
+                    result[field.name] = values
+        return pd.DataFrame(result, columns=list(result.keys()))
@@ -0,0 +1,105 @@
+import os
+import numpy as np
+
+from simplequant import utils
+
+
+class BundleMetadata:
+    """
+    数据包的元数据索引，每个数据包版本只需生成一次，保存为一个很小的.npz文件。
+    包括stocks.h5中所有股票的代码、首个和最后一个有成交的交易日、
+    上市期间的停牌日（按trading_dates.npy中的交易日压缩为位图），以及在ex_cum_factor.h5中有除权因子的股票代码。
+    查询股票列表和上市日期时不再需要读取整个数据包。
+    """
+
+    meta_file = 'metadata.npz'
+
+    def __init__(self, version, codes, first_dates, last_dates, suspended, trading_dates, ex_factor_codes):
+        self.version = version
+        self.codes = codes
+        self.first_dates = first_dates  # 没有任何成交的股票记为0
+        self.last_dates = last_dates
+        self.suspended = suspended  # len(codes) × ceil(len(trading_dates) / 8)的np.packbits位图
+        self.trading_dates = trading_dates
+        self.ex_factor_codes = ex_factor_codes
+
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        self._stock_list = None
+
+    @classmethod
+    def build(cls, data_path, stock_file, ex_cum_factor_file, trading_dates, version):
+        """
+        只读取每只股票的datetime和volume两列
+        """
+        stocks = utils.open_h5(os.path.join(data_path, stock_file))
+        codes = sorted(stocks.keys())
+        first_dates = np.zeros(len(codes), dtype=np.int64)
+        last_dates = np.zeros(len(codes), dtype=np.int64)
+        suspended = np.zeros((len(codes), len(trading_dates)), dtype=np.bool_)
+        for i, code in enumerate(codes):
+            dataset = stocks[code]
+            volume = dataset['volume']
+            dates = (dataset['datetime'] // 1000000).astype(np.int64)[volume > 0]
+            if len(dates) == 0:
+                continue
+            first_dates[i] = dates[0]
+            last_dates[i] = dates[-1]
+            left = trading_dates.searchsorted(dates[0])
+            right = trading_dates.searchsorted(dates[-1], side='right')
+            suspended[i, left:right] = ~np.isin(trading_dates[left:right], dates)
+
+        ex_cum_factor = utils.open_h5(os.path.join(data_path, ex_cum_factor_file))
+        ex_factor_codes = sorted(ex_cum_factor.keys())
+
+        return cls(version, codes, first_dates, last_dates, np.packbits(suspended, axis=1), trading_dates,
+                   ex_factor_codes)
+
+    @classmethod
+    def read(cls, meta_path):
+        """
+        读取已保存的元数据，文件不存在时返回None
+        """
+        if not os.path.exists(meta_path):
+            return None
+        with np.load(meta_path) as meta:
+            return cls(str(meta['version']), [str(code) for code in meta['codes']], meta['first_dates'],
+                       meta['last_dates'], meta['suspended'], meta['trading_dates'],
+                       [str(code) for code in meta['ex_factor_codes']])
+
+    def save(self, meta_path):
+        # 每个进程各自的临时文件，np.savez会自动补全.npz扩展名
+        temp_path = '{}.{}.building.npz'.format(meta_path, os.getpid())
+        np.savez(temp_path, version=np.array(self.version), codes=np.array(self.codes),
+                 first_dates=self.first_dates, last_dates=self.last_dates, suspended=self.suspended,
+                 trading_dates=self.trading_dates, ex_factor_codes=np.array(self.ex_factor_codes))
+        os.replace(temp_path, meta_path)
+
+    def getStockList(self):
+        """
+        有过成交、并且在ex_cum_factor中有记录的股票，按代码排序
+        """
+        if self._stock_list is None:
+            ex_factor_codes = set(self.ex_factor_codes)
+            self._stock_list = [code for code, first_date in zip(self.codes, self.first_dates)
+                                if first_date > 0 and code in ex_factor_codes]
+        return list(self._stock_list)
+
+    def getFirstTradingDate(self, code):
+        return int(self.first_dates[self.code_index[code]])
+
+    def getLastTradingDate(self, code):
+        return int(self.last_dates[self.code_index[code]])
+
+    def getSuspendedDates(self, code):
+        """
+        返回上市期间停牌（没有成交）的交易日数组
+        """
+        flags = np.unpackbits(self.suspended[self.code_index[code]])[:len(self.trading_dates)]
+        return self.trading_dates[flags.astype(np.bool_)]
+
+    def isSuspended(self, code, date):
+        ind = self.trading_dates.searchsorted(date)
+        if ind >= len(self.trading_dates) or self.trading_dates[ind] != date:
+            raise ValueError('{}不是交易日'.format(date))
+        byte = self.suspended[self.code_index[code], ind // 8]
+        return bool(byte >> (7 - ind % 8) & 1)
@@ -0,0 +1,101 @@
+import os
+import numpy as np
+
+
+class MinuteBarStore:
+    """
+    按交易日分块存储的分钟线。每个交易日一个 minutes × symbols × fields 的float32数组，
+    保存为store_path/YYYY/YYYYMMDD.npy，当日的分钟时间（形如930、1500的整数）保存在YYYYMMDD_times.npy。
+    回测时一次只以memmap方式打开一个交易日，全部历史不会同时读入内存。
+
+    股票代码统一记录在symbols.npy中，新出现的股票追加在末尾，较早写入的交易日数组列数较少，
+    读取时缺少的列视为没有行情。数组中保存的是未复权的原始价格，没有成交的分钟为NaN。
+    """
+
+    symbols_file = 'symbols.npy'
+    fields = ['open', 'close', 'high', 'low', 'volume', 'total_turnover']
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        if not os.path.exists(store_path):
+            os.makedirs(store_path)
+        symbols_path = os.path.join(store_path, self.symbols_file)
+        if os.path.exists(symbols_path):
+            self.symbols = [str(symbol) for symbol in np.load(symbols_path)]
+        else:
+            self.symbols = []
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.field_index = {field: i for i, field in enumerate(self.fields)}
+        self._dates = None
+
+    def _dayPath(self, date):
+        date = int(date)
+        return os.path.join(self.store_path, str(date // 10000), '{}.npy'.format(date))
+
+    def _timesPath(self, date):
+        date = int(date)
+        return os.path.join(self.store_path, str(date // 10000), '{}_times.npy'.format(date))
+
+    def getDates(self):
+        """
+        返回已存储的交易日数组
+        """
+        if self._dates is None:
+            dates = []
+            for year in os.listdir(self.store_path):
+                year_path = os.path.join(self.store_path, year)
+                if not (year.isdigit() and os.path.isdir(year_path)):
+                    continue
+                for file_name in os.listdir(year_path):
+                    name, ext = os.path.splitext(file_name)
+                    if ext == '.npy' and name.isdigit():
+                        dates.append(int(name))
+            self._dates = np.array(sorted(dates), dtype=np.int64)
+        return self._dates
+
+    def hasDate(self, date):
+        return os.path.exists(self._dayPath(date))
+
+    def writeDay(self, date, times, symbols, bars):
+        """
+        写入一个交易日的分钟线，已存在的同一交易日会被覆盖
+        :param times: 形如930的分钟时间数组，长度为minutes
+        :param symbols: 股票代码列表，长度为symbols
+        :param bars: minutes × symbols × fields的数组，fields的顺序与MinuteBarStore.fields一致
+        """
+        new_symbols = [symbol for symbol in symbols if symbol not in self.symbol_index]
+        if new_symbols:
+            for symbol in new_symbols:
+                self.symbol_index[symbol] = len(self.symbols)
+                self.symbols.append(symbol)
+            temp_path = os.path.join(self.store_path, 'symbols.tmp.npy')
+            np.save(temp_path, np.array(self.symbols))
+            os.replace(temp_path, os.path.join(self.store_path, self.symbols_file))
+
+        day_bars = np.full((len(times), len(self.symbols), len(self.fields)), np.nan, dtype=np.float32)
+        day_bars[:, [self.symbol_index[symbol] for symbol in symbols], :] = bars
+
+        day_path = self._dayPath(date)
+        if not os.path.exists(os.path.dirname(day_path)):
+            os.makedirs(os.path.dirname(day_path))
+        np.save(self._timesPath(date), np.asarray(times, dtype=np.int64))
+        temp_path = day_path[:-len('.npy')] + '.tmp.npy'
+        np.save(temp_path, day_bars)
+        os.replace(temp_path, day_path)  # 交易日数组最后写入，存在即表示当日数据完整
+        self._dates = None
+
+    def loadDay(self, date, symbol_ids=None):
+        """
+        读取一个交易日的分钟线
+        :param symbol_ids: 需要读取的股票在self.symbols中的序号，None表示全部
+        :return: (times, bars)，bars为 minutes × symbols × fields 的float64数组，缺少的股票为NaN
+        """
+        times = np.load(self._timesPath(date))
+        day_bars = np.load(self._dayPath(date), mmap_mode='r')
+        if symbol_ids is None:
+            symbol_ids = np.arange(len(self.symbols))
+        symbol_ids = np.asarray(symbol_ids, dtype=np.int64)
+        bars = np.full((len(times), len(symbol_ids), len(self.fields)), np.nan)
+        stored = symbol_ids < day_bars.shape[1]
+        bars[:, stored, :] = day_bars[:, symbol_ids[stored], :]
+        return times, bars
@@ -0,0 +1,33 @@
+import os
+import numpy as np
+
+
+class ReferenceSeriesCache:
+    """
+    绩效分析用到的参考序列（基准指数、市场组合、无风险利率）的磁盘缓存，每条序列是cache_path下的一个很小的.npz文件，
+    保存日期、数值和一个标记：由数据包生成的序列记录数据包版本，从聚宽下载的序列记录下载日期，调用方据此判断是否过期。
+    """
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+
+    def _path(self, name):
+        return os.path.join(self.cache_path, name + '.npz')
+
+    def load(self, name):
+        """
+        :return: (dates, values, stamp)，没有缓存时返回None
+        """
+        path = self._path(name)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as f:
+            return f['dates'], f['values'], str(f['stamp'])
+
+    def save(self, name, dates, values, stamp):
+        if not os.path.exists(self.cache_path):
+            os.makedirs(self.cache_path)
+        temp_path = self._path('{}.{}.tmp'.format(name, os.getpid()))
+        np.savez(temp_path, dates=np.asarray(dates, dtype=np.int64), values=np.asarray(values, dtype=np.float64),
+                 stamp=np.array(str(stamp)))
+        os.replace(temp_path, self._path(name))
@@ -0,0 +1,127 @@
+import datetime
+import numpy as np
+
+
+class TradingCalendar:
+    """
+    交易日历，trading_dates.npy只读取一次。日期都是形如20200529的整数。
+    交易日到序号的映射保存在字典中，判断是否交易日、按交易日偏移都是O(1)；
+    非交易日的查找用二分法，O(log n)。
+    每个交易日是否为所在月、周、季度的第一个或最后一个交易日在初始化时一次性算好。
+    """
+
+    def __init__(self, trading_dates):
+        self.trading_dates = np.asarray(trading_dates)
+        self.date_index = {int(date): i for i, date in enumerate(self.trading_dates)}
+
+        years = self.trading_dates // 10000
+        months = self.trading_dates // 100 % 100
+        month_keys = years * 100 + months
+        quarter_keys = years * 10 + (months - 1) // 3
+        days = np.array([datetime.date(int(date) // 10000, int(date) // 100 % 100, int(date) % 100).toordinal()
+                         for date in self.trading_dates])
+        week_keys = (days - 1) // 7  # 0001-01-01是星期一，序号相差7以内且整除结果相同的日期属于同一周
+
+        self._month_end = self._isPeriodEnd(month_keys)
+        self._quarter_end = self._isPeriodEnd(quarter_keys)
+        self._week_end = self._isPeriodEnd(week_keys)
+        self._month_start = self._isPeriodStart(month_keys)
+        self._quarter_start = self._isPeriodStart(quarter_keys)
+        self._week_start = self._isPeriodStart(week_keys)
+
+    @classmethod
+    def load(cls, trading_dates_path):
+        return cls(np.load(trading_dates_path))
+
+    @staticmethod
+    def _isPeriodEnd(keys):
+        # 最后一个交易日之后的日期尚不可知，把它视为周期的最后一天
+        return np.append(keys[1:] != keys[:-1], True)
+
+    @staticmethod
+    def _isPeriodStart(keys):
+        return np.insert(keys[1:] != keys[:-1], 0, True)
+
+    def getStartDate(self):
+        return self.trading_dates[0]
+
+    def getLastDate(self):
+        return self.trading_dates[-1]
+
+    def getTradingDates(self, start=None, end=None):
+        """
+        返回[start, end]之间的交易日，start和end为None时不做限制
+        """
+        left = 0 if start is None else self.trading_dates.searchsorted(start)
+        right = len(self.trading_dates) if end is None else self.trading_dates.searchsorted(end, side='right')
+        return self.trading_dates[left:right]
+
+    def isTradingDate(self, date):
+        return int(date) in self.date_index
+
+    def getIndex(self, date):
+        """
+        返回交易日date的序号，date不是交易日时抛出KeyError
+        """
+        return self.date_index[int(date)]
+
+    def offset(self, date, n):
+        """
+        返回date之后第n个交易日（n为负数时为之前），date本身不是交易日时，
+        n > 0从date之前最近的交易日开始数，n < 0从date之后最近的交易日开始数，n == 0返回date之前最近的交易日。
+        超出日历范围时抛出IndexError。
+        """
+        date = int(date)
+        if date in self.date_index:
+            ind = self.date_index[date] + n
+        elif n < 0:
+            ind = self.trading_dates.searchsorted(date) + n
+        else:
+            ind = self.trading_dates.searchsorted(date, side='right') - 1 + n
+        if ind < 0 or ind >= len(self.trading_dates):
+            raise IndexError('{d}偏移{n}个交易日后超出了交易日历的范围'.format(d=date, n=n))
+        return self.trading_dates[ind]
+
+    def nextTradingDate(self, date, n=1):
+        return self.offset(date, n)
+
+    def previousTradingDate(self, date, n=1):
+        return self.offset(date, -n)
+
+    def _flag(self, flags, date):
+        return bool(flags[self.date_index[int(date)]])
+
+    def isMonthEnd(self, date):
+        return self._flag(self._month_end, date)
+
+    def isMonthStart(self, date):
+        return self._flag(self._month_start, date)
+
+    def isWeekEnd(self, date):
+        return self._flag(self._week_end, date)
+
+    def isWeekStart(self, date):
+        return self._flag(self._week_start, date)
+
+    def isQuarterEnd(self, date):
+        return self._flag(self._quarter_end, date)
+
+    def isQuarterStart(self, date):
+        return self._flag(self._quarter_start, date)
+
+    def getMonthEnds(self, start=None, end=None):
+        """
+        返回[start, end]之间每个月的最后一个交易日
+        """
+        return self._periodDates(self._month_end, start, end)
+
+    def getWeekEnds(self, start=None, end=None):
+        return self._periodDates(self._week_end, start, end)
+
+    def getQuarterEnds(self, start=None, end=None):
+        return self._periodDates(self._quarter_end, start, end)
+
+    def _periodDates(self, flags, start, end):
+        left = 0 if start is None else self.trading_dates.searchsorted(start)
+        right = len(self.trading_dates) if end is None else self.trading_dates.searchsorted(end, side='right')
+        return self.trading_dates[left:right][flags[left:right]]
@@ -1,12 +1,25 @@
 from abc import ABCMeta
-from simplequant.data.database import Database
+
+
+class LazyDatabase:
+    """
+    Database单例的描述符。第一次访问时才构造Database，
+    仅仅import simplequant的模块不会读取数据或者连带导入jqdatasdk等较重的依赖。
+    """
+
+    _instance = None
+
+    def __get__(self, instance, owner):
+        if LazyDatabase._instance is None:
+            from simplequant.data.database import Database
+            LazyDatabase._instance = Database()
+        return LazyDatabase._instance
 
 
 class Env:
 
     __metaclass__ = ABCMeta
 
-    _database = Database()
+    _database = LazyDatabase()
 
     pass
-
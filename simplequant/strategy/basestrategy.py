@@ -1,6 +1,6 @@
 from abc import ABCMeta, abstractmethod
 
-from simplequant.environment import Env
+from simplequant.environment import Env, LazyDatabase
 
 
 class BaseStrategy(Env):
@@ -13,11 +13,16 @@ class BaseStrategy(Env):
     This is designed to work both with historic and live data as
     the Strategy object is agnostic to the data source,
     since it obtains the bar tuples from a queue object.
+
+    子类可以通过类属性universe声明股票池：None表示全市场，也可以是股票代码的列表，
+    或者接收全市场股票列表、返回股票池的函数。回测只加载股票池内的行情，
+    发出股票池以外的股票的信号时再按需加载。
     """
 
     __metaclass__ = ABCMeta
 
-    api = Env._database
+    api = LazyDatabase()
+    universe = None
 
     @abstractmethod
     def handleBar(self, events_queue, event):
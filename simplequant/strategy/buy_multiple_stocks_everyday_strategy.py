@@ -8,8 +8,13 @@ class BuyMultipleStocksEverydayStrategy(BaseStrategy):
     """
     演示策略2：回测期间每日买入固定数量的所有股票
     """
+    num = 5
+
+    @classmethod
+    def universe(cls, stock_list):
+        return stock_list[:cls.num]
+
     def __init__(self, portfolio):
-        self.num = 5
         self.symbols = portfolio.symbol_list[:self.num]
         self.quantity = 100
 
@@ -8,6 +8,8 @@ class BuySingleStockEverydayStrategy(BaseStrategy):
     """
     演示策略1：回测期间每日买入固定数量的指定股票
     """
+    universe = ['000001.XSHE']
+
     def __init__(self, portfolio):
         self.symbol = '000001.XSHE'  # 平安银行
         self.quantity = 250  # 实际上只会成交200股
@@ -1,6 +1,7 @@
 import datetime
 
 from simplequant.strategy.basestrategy import BaseStrategy
+from simplequant.data.fundamentals import query, valuation, income
 from simplequant.backtest.event import SignalEvent
 from simplequant.constant import Direction, OrderTime
 
@@ -11,29 +12,24 @@ class PEStrategy(BaseStrategy):
     """
     def __init__(self, portfolio):
         self.portfolio = portfolio
+        self.calendar = self.api.calendar()
 
         self.num = 10  # 10只股票
         self.market_value = 1000  # 1000亿市值，单位是亿元
         self.operating_revenue = 20000000000  # 200亿营业总收入，单位是元
         self.quantity = 400  # 每只股票买入400股
 
-        self.api.auth('聚宽账号', '密码')
-        self.query = self.api.query
-        self.code = self.api.valuation.code
-        self.market_cap = self.api.valuation.market_cap
-        self.pe_ratio = self.api.valuation.pe_ratio
-        self.total_operating_revenue = self.api.income.total_operating_revenue
+        # 使用本地财务数据，回测前需要先通过Database.importFundamentals()导入回测区间的valuation和income
+        self.query = query
+        self.code = valuation.code
+        self.market_cap = valuation.market_cap
+        self.pe_ratio = valuation.pe_ratio
+        self.total_operating_revenue = income.total_operating_revenue
 
     def handleBar(self, events_queue, event):
-        now = event.datetime
-        trading_dates = self.portfolio.trading_dates
-        try:
-            post = trading_dates[trading_dates.searchsorted(now, side='right')]
-        except IndexError:  # 第二天已在回测区间以外
+        if event.datetime == self.portfolio.trading_dates[-1]:  # 第二天已在回测区间以外
             return
-        now = datetime.datetime.strptime(str(now), '%Y%m%d')
-        post = datetime.datetime.strptime(str(post), '%Y%m%d')
-        if now.month == post.month:  # 每月调仓一次，只有每月最后一个交易日才会运行后面的代码
+        if not self.calendar.isMonthEnd(event.datetime):  # 每月调仓一次，只有每月最后一个交易日才会运行后面的代码
             return
 
         q = self.query(self.code, self.market_cap, self.pe_ratio, self.total_operating_revenue
@@ -43,8 +39,7 @@ class PEStrategy(BaseStrategy):
         date = datetime.datetime.strptime(str(event.datetime), '%Y%m%d')
         df = self.api.get_fundamentals(q, date=date)
 
-        current_positions = list(self.portfolio.current_positions[self.portfolio.current_positions != 0].index)
-        current_positions.remove('datetime')
+        current_positions = self.portfolio.getHeldSymbols()
         net_set = set(current_positions) - set(df['code'])
         long_set = set(df['code']) - set(current_positions)
 
@@ -1,9 +1,13 @@
+import datetime
+import hashlib
 import pickle
-import h5py
 import os
+import re
+import shutil
+import subprocess
 import sys
-import requests
 import tarfile
+import tempfile
 import locale
 
 
@@ -14,6 +18,7 @@ def open_pk(pk_path):
 
 
 def open_h5(h5_path):
+    import h5py
     if sys.platform == "win32":
         lo = locale.getlocale(locale.LC_ALL)[1]
         if lo and lo.lower() == "utf-8":
@@ -22,37 +27,313 @@ def open_h5(h5_path):
     return f
 
 
-def download(url, save_path):  # 中途有可能断连，能够正常解压，但读取时会出问题，提示被截断了
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def _print_progress(done_size, total_size):
+    if not total_size:
+        return
+    done = int(50 * done_size / total_size)
+    sys.stdout.write("\r[%s%s] %d%%" % ('█' * done, ' ' * (50 - done), 100 * done_size / total_size))
+    sys.stdout.flush()
+
+
+def _network_errors():
+    """
+    可以通过重新连接恢复的网络异常
+    """
+    import requests
+    return (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+            requests.exceptions.Timeout)
+
+
+class ResumableHTTPStream:
+    """
+    以文件对象的形式顺序读取HTTP响应体，可以直接交给tarfile以流的方式解压。
+    连接中断时用HTTP Range请求从已收到的字节处继续下载，服务器不支持Range时重新请求并跳过已收到的部分。
+    读取的同时计算sha256，读完后可以用verify()检查长度和校验和，避免得到被截断的文件。
+    """
+
+    def __init__(self, url, chunk_size=DOWNLOAD_CHUNK_SIZE, max_retries=5, timeout=60, show_progress=True):
+        self.url = url
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.show_progress = show_progress
+        self.position = 0  # 已经从网络收到的字节数
+        self.total_size = None
+        self.hasher = hashlib.sha256()
+        self.retries = 0
+        self._buffer = bytearray()
+        self._finished = False
+        self._chunks = self._open()
+
+    def _open(self):
+        import requests
+        headers = {'Range': 'bytes=%d-' % self.position} if self.position > 0 else {}
+        r = requests.get(self.url, stream=True, headers=headers, timeout=self.timeout)
+        r.raise_for_status()
+        skip = 0
+        if r.status_code == 206:
+            total_size = _parse_total_size(r.headers.get('content-range'))
+            if total_size is not None:
+                self.total_size = total_size
+        else:
+            skip = self.position  # 服务器忽略了Range，从头返回了完整内容
+            if r.headers.get('content-length') is not None:
+                self.total_size = int(r.headers.get('content-length'))
+        return self._iterChunks(r, skip)
+
+    def _iterChunks(self, r, skip):
+        for chunk in r.iter_content(chunk_size=self.chunk_size):
+            if skip > 0:
+                skipped = min(skip, len(chunk))
+                chunk = chunk[skipped:]
+                skip -= skipped
+            if chunk:
+                yield chunk
+
+    def _fill(self, size):
+        while not self._finished and (size < 0 or len(self._buffer) < size):
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self._finished = True
+            except _network_errors() as e:
+                self._reconnect(e)
+            else:
+                self.position += len(chunk)
+                self.hasher.update(chunk)
+                self._buffer += chunk
+                if self.show_progress:
+                    _print_progress(self.position, self.total_size)
+
+    def _reconnect(self, error):
+        """
+        连接中断后从断点重新连接，重新连接本身失败时继续重试，中断和重连失败合计不超过max_retries次
+        """
+        while True:
+            if self.total_size is not None and self.position >= self.total_size:
+                self._finished = True  # 最后一个字节已经收到，不需要再请求
+                return
+            self.retries += 1
+            if self.retries > self.max_retries:
+                raise IOError('下载{}时连接多次中断：{}'.format(self.url, error))
+            try:
+                self._chunks = self._open()
+                return
+            except _network_errors() as e:
+                error = e
+
+    def read(self, size=-1):
+        self._fill(size)
+        if size < 0 or size >= len(self._buffer):
+            data = bytes(self._buffer)
+            self._buffer = bytearray()
+        else:
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        return data
+
+    def verify(self, checksum=None):
+        """
+        读完剩余的内容（如tar末尾的填充块），检查总长度与Content-Length一致，
+        并在给出checksum（sha256的十六进制字符串）时检查校验和。不一致时抛出IOError。
+        """
+        while not self._finished:
+            self._buffer = bytearray()
+            self._fill(self.chunk_size)
+        if self.total_size is not None and self.position != self.total_size:
+            raise IOError('{}下载不完整：收到{}字节，应为{}字节'.format(self.url, self.position, self.total_size))
+        if checksum is not None and self.hasher.hexdigest() != checksum.lower():
+            raise IOError('{}的sha256校验和不一致'.format(self.url))
+        if self.show_progress:
+            sys.stdout.write('\n')
+
+
+def download_and_extract(url, target_path, tar_type='bz2', checksum=None, chunk_size=DOWNLOAD_CHUNK_SIZE,
+                         max_retries=5):
+    """
+    边下载边解压，压缩包不落盘，也不需要再读一遍。下载中断时自动断点续传。
+    解压完成后检查下载长度和校验和，不一致时抛出IOError，调用方应丢弃target_path中的内容。
+    压缩包不完整或已损坏时解压抛出的EOFError、tarfile.TarError也转换为IOError。
+    :param checksum: 可选，压缩包的sha256
+    """
+    stream = ResumableHTTPStream(url, chunk_size=chunk_size, max_retries=max_retries)
+    try:
+        with tarfile.open(fileobj=stream, mode='r|' + tar_type, bufsize=chunk_size) as tar:
+            for member in tar:
+                _extract_member(tar, member, target_path)
+    except (EOFError, tarfile.TarError) as e:
+        raise IOError('{}不完整或已损坏：{}'.format(os.path.basename(url), e))
+    stream.verify(checksum)
+    print('successfully download and extract {}'.format(os.path.basename(url)))
+
+
+def _extract_member(tar, member, target_path):
+    if hasattr(tarfile, 'data_filter'):  # Python 3.12之后不指定filter会有警告
+        tar.extract(member, target_path, filter='data')
+    else:
+        tar.extract(member, target_path)
+
+
+def download(url, save_path, checksum=None, chunk_size=DOWNLOAD_CHUNK_SIZE, max_retries=5):
+    """
+    下载到save_path，先写入.part文件，完成并校验之后再改名。
+    .part文件已存在时（上次下载中断）用Range请求从断点继续；服务器没有给出文件长度时，以连接正常结束为下载完成。
+    """
+    import requests
     _, file_name = os.path.split(url)
     file_path = os.path.join(save_path, file_name)
-    r = requests.get(url, stream=True)
-    total_size = int(r.headers.get('content-length'))
-    temp_size = 0
-    with open(file_path, 'wb') as f:
-        for chunk in r.iter_content(chunk_size=1024):
-            if chunk:
-                f.write(chunk)
-                temp_size += len(chunk)
-                done = int(50 * temp_size / total_size)
-                sys.stdout.write("\r[%s%s] %d%%" % ('█' * done, ' ' * (50 - done), 100 * temp_size / total_size))
-                sys.stdout.flush()
-        print('\nsuccessfully download {}'.format(file_name))
+    part_path = file_path + '.part'
+    hasher = hashlib.sha256()
+    position = 0
+    if os.path.exists(part_path):
+        with open(part_path, 'rb') as f:
+            for block in iter(lambda: f.read(chunk_size), b''):
+                hasher.update(block)
+                position += len(block)
+
+    total_size = None
+    retries = 0
+    while True:
+        headers = {'Range': 'bytes=%d-' % position} if position > 0 else {}
+        try:
+            r = requests.get(url, stream=True, headers=headers, timeout=60)
+            if r.status_code == 416 and position > 0:
+                # 请求的起点已经超出文件末尾：.part的长度与文件长度一致时说明上次已经下载完整，否则从头下载
+                total_size = _parse_total_size(r.headers.get('content-range'))
+                if total_size == position:
+                    break
+                position = 0
+                hasher = hashlib.sha256()
+                os.remove(part_path)
+                continue
+            r.raise_for_status()
+            if r.status_code == 206:
+                total_size = _parse_total_size(r.headers.get('content-range'))
+                mode = 'ab'
+            else:  # 服务器不支持断点续传，从头下载
+                content_length = r.headers.get('content-length')
+                total_size = int(content_length) if content_length is not None else None
+                position = 0
+                hasher = hashlib.sha256()
+                mode = 'wb'
+            with open(part_path, mode) as f:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        position += len(chunk)
+                        _print_progress(position, total_size)
+        except _network_errors() as e:
+            retries += 1
+            if retries > max_retries:
+                raise IOError('下载{}时连接多次中断：{}'.format(url, e))
+        else:
+            if total_size is None or position >= total_size:
+                break
+            retries += 1
+            if retries > max_retries:
+                raise IOError('{}下载不完整：收到{}字节，应为{}字节'.format(url, position, total_size))
+
+    if checksum is not None and hasher.hexdigest() != checksum.lower():
+        os.remove(part_path)
+        raise IOError('{}的sha256校验和不一致'.format(url))
+    os.replace(part_path, file_path)
+    print('\nsuccessfully download {}'.format(file_name))
     return file_path
 
 
+def _parse_total_size(content_range):
+    """
+    :param content_range: 形如bytes 100-199/200或bytes */200的Content-Range
+    :return: 文件总长度，没有给出时返回None
+    """
+    total = (content_range or '').rpartition('/')[2]
+    return int(total) if total.isdigit() else None
+
+
 def extract(tar_path, target_path, tar_type):
-    type_dict = {'gz': 'r:gz', 'bz2': 'r:bz2'}
-    tar = tarfile.open(tar_path, type_dict[tar_type])
-    file_names = tar.getnames()
-    for file_name in file_names:
-        tar.extract(file_name, target_path)
-    tar.close()
+    try:
+        with tarfile.open(tar_path, 'r|' + tar_type, bufsize=DOWNLOAD_CHUNK_SIZE) as tar:
+            for member in tar:
+                _extract_member(tar, member, target_path)
+    except (EOFError, tarfile.TarError) as e:
+        raise IOError('{}不完整或已损坏：{}'.format(os.path.basename(tar_path), e))
     tar_name = os.path.basename(tar_path)
     print('successfully extract {}'.format(tar_name))
 
 
+def make_building_dir(target_path):
+    """
+    在target_path所在目录下为本进程新建一个唯一的临时目录，生成完内容后用replace_dir()整体替换target_path，
+    多个进程同时生成同一个目录时不会删掉彼此写了一半的文件
+    """
+    parent, name = os.path.split(target_path)
+    if not os.path.exists(parent):
+        os.makedirs(parent)
+    return tempfile.mkdtemp(prefix=name + '.building.', dir=parent)
+
+
+def replace_dir(building_path, target_path):
+    """
+    用building_path原子地替换target_path。原有目录先改名再删除，其他进程已经打开的memmap不受影响。
+    :return: 替换成功返回True；其他进程恰好在这期间放入了自己的目录时丢弃building_path并返回False，
+             由调用方检查已有的目录是否可用
+    """
+    parent, name = os.path.split(target_path)
+    old_path = None
+    if os.path.exists(target_path):
+        old_path = tempfile.mkdtemp(prefix=name + '.building.', dir=parent)
+        try:
+            os.rename(target_path, os.path.join(old_path, name))
+        except FileNotFoundError:  # 其他进程刚刚把它换走
+            pass
+    try:
+        os.rename(building_path, target_path)
+    except OSError:  # 目标目录已经存在且不为空
+        shutil.rmtree(building_path, ignore_errors=True)
+        return False
+    finally:
+        if old_path is not None:
+            shutil.rmtree(old_path, ignore_errors=True)
+    return True
+
+
 def convert_date_to_int(dt):
     t = dt.year * 10000 + dt.month * 100 + dt.day
     t *= 1000000
     return t
 
+
+def to_date_int(date):
+    """
+    把datetime、date、'2019-01-02'形式的字符串或者20190102转换为形如20190102的整数
+    """
+    if isinstance(date, (datetime.date, datetime.datetime)):
+        return date.year * 10000 + date.month * 100 + date.day
+    if isinstance(date, str):
+        return int(date.replace('-', '')[:8])
+    return int(date)
+
+
+def measure_import_time(module_name, top=20):
+    """
+    在新的解释器进程中用python -X importtime导入module_name，统计各模块的导入耗时
+    :param module_name: 例如'simplequant.backtest.backtest'
+    :param top: 返回累计耗时最长的前top个模块
+    :return: [(模块名, 自身耗时(秒), 累计耗时(秒)), ...]，按累计耗时从长到短排列，第一项即总耗时
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module_name],
+                            stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, universal_newlines=True)
+    pattern = re.compile(r'import time:\s*(\d+)\s*\|\s*(\d+)\s*\|\s*(.+)$')
+    timings = []
+    for line in result.stderr.splitlines():
+        match = pattern.match(line)
+        if match:
+            timings.append((match.group(3).strip(), int(match.group(1)) / 1e6, int(match.group(2)) / 1e6))
+    if result.returncode != 0:
+        raise ImportError('导入{}失败：\n{}'.format(module_name, result.stderr))
+    timings.sort(key=lambda t: t[2], reverse=True)
+    return timings[:top]
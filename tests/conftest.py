@@ -0,0 +1,149 @@
+import datetime
+import functools
+import http.server
+import os
+import tarfile
+import threading
+
+import numpy as np
+import pytest
+
+from simplequant.data.database import Database
+from simplequant.environment import LazyDatabase
+
+
+BAR_DTYPE = np.dtype([('datetime', '<u8'), ('open', '<f8'), ('close', '<f8'), ('high', '<f8'), ('low', '<f8'),
+                      ('limit_up', '<f8'), ('limit_down', '<f8'), ('volume', '<f8'), ('total_turnover', '<f8')])
+CODES = ['000001.XSHE', '000002.XSHE', '600000.XSHG']
+
+
+def make_trading_dates(n=40, start=datetime.date(2019, 1, 2)):
+    dates = []
+    day = start
+    while len(dates) < n:
+        if day.weekday() < 5:
+            dates.append(day.year * 10000 + day.month * 100 + day.day)
+        day += datetime.timedelta(days=1)
+    return np.array(dates, dtype=np.int64)
+
+
+def make_bundle(bundle_path, seed=0, n_dates=40):
+    """
+    生成一个很小的数据包：3只股票、n_dates个交易日，000002.XSHE从第5个交易日才上市，600000.XSHG在第10个交易日停牌，
+    000001.XSHE在第20个交易日除权，累计除权因子为2
+    """
+    import h5py
+    if not os.path.exists(bundle_path):
+        os.makedirs(bundle_path)
+    dates = make_trading_dates(n_dates)
+    np.save(os.path.join(bundle_path, 'trading_dates.npy'), dates)
+    rng = np.random.RandomState(seed)
+    with h5py.File(os.path.join(bundle_path, 'stocks.h5'), 'w') as stocks, \
+            h5py.File(os.path.join(bundle_path, 'ex_cum_factor.h5'), 'w') as factors:
+        for i, code in enumerate(CODES):
+            first = 5 if code == '000002.XSHE' else 0
+            bars = np.zeros(len(dates) - first, dtype=BAR_DTYPE)
+            close = 10 * (i + 1) + np.cumsum(rng.normal(0, 0.1, len(bars)))
+            bars['datetime'] = dates[first:].astype(np.uint64) * 1000000
+            bars['open'] = close - 0.05
+            bars['close'] = close
+            bars['high'] = close + 0.1
+            bars['low'] = close - 0.1
+            bars['limit_up'] = close * 1.1
+            bars['limit_down'] = close * 0.9
+            bars['volume'] = 1000.0
+            if code == '600000.XSHG':
+                bars['volume'][10] = 0
+            bars['total_turnover'] = bars['volume'] * close
+            stocks[code] = bars
+            factor = np.zeros(2, dtype=[('start_date', '<u8'), ('ex_cum_factor', '<f8')])
+            factor['start_date'] = [0, int(dates[20]) * 1000000]
+            factor['ex_cum_factor'] = [1.0, 2.0 if code == '000001.XSHE' else 1.0]
+            factors[code] = factor
+    return bundle_path
+
+
+def pack_bundle(bundle_path, tar_path):
+    with tarfile.open(tar_path, 'w:bz2') as tar:
+        for file_name in sorted(os.listdir(bundle_path)):
+            tar.add(os.path.join(bundle_path, file_name), arcname=file_name)
+    return tar_path
+
+
+def months_ago(n):
+    day = datetime.date.today().replace(day=1)
+    for _ in range(n):
+        day = (day - datetime.timedelta(days=1)).replace(day=1)
+    return day.year, day.month
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class BundleServer:
+    """
+    在本地线程中运行的HTTP服务，cdn_path下的文件即数据包
+    """
+
+    url_template = 'rqbundle_%04d%02d.tar.bz2'
+
+    def __init__(self, cdn_path, handler_class=QuietHandler):
+        self.cdn_path = cdn_path
+        handler = functools.partial(handler_class, directory=cdn_path)
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def cdn_url(self):
+        return 'http://127.0.0.1:{}/'.format(self.httpd.server_address[1]) + self.url_template
+
+    def publish(self, bundle_path, year, month):
+        return pack_bundle(bundle_path, os.path.join(self.cdn_path, self.url_template % (year, month)))
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def bundle_server(tmp_path):
+    cdn_path = tmp_path / 'cdn'
+    cdn_path.mkdir()
+    server = BundleServer(str(cdn_path))
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def database(tmp_path):
+    db = Database()
+    db.changePath(str(tmp_path / 'data'))
+    db.max_probe_months = 3
+    return db
+
+
+
+@pytest.fixture(scope='session')
+def bundle_database(tmp_path_factory):
+    """
+    已经在本地的数据包，不经过下载，元数据索引和行情存储在第一次用到时生成
+    """
+    data_path = str(tmp_path_factory.mktemp('bundle'))
+    make_bundle(data_path)
+    open(os.path.join(data_path, '20195.txt'), 'a').close()
+    db = Database()
+    db.changePath(data_path)
+    db.loaded = True
+    return db
+
+
+@pytest.fixture
+def env_database(bundle_database, monkeypatch):
+    """
+    让Env._database指向bundle_database
+    """
+    monkeypatch.setattr(LazyDatabase, '_instance', bundle_database)
+    return bundle_database
@@ -0,0 +1,58 @@
+import datetime
+
+import numpy as np
+
+from simplequant.data.adjustment import ExCumFactorTable
+
+
+def make_table():
+    # A在2019-01-10除权，累计除权因子从1变为2；B没有除权
+    return ExCumFactorTable(['A', 'B'], np.array([0, 20190110000000, 0], dtype=np.uint64),
+                            np.array([1.0, 2.0, 1.0]), [2, 1])
+
+
+def make_bars(dates, close, volume):
+    bars = np.zeros(len(dates), dtype=[('datetime', '<u8'), ('close', '<f8'), ('volume', '<f8')])
+    bars['datetime'] = np.array(dates, dtype=np.uint64) * 1000000
+    bars['close'] = close
+    bars['volume'] = volume
+    return bars
+
+
+def test_lookup():
+    table = make_table()
+    factors = table.lookup([0, 0, 0, 1, -1], [20190101000000, 20190110000000, 20190111000000, 20190111000000,
+                                              20190111000000])
+    np.testing.assert_array_equal(factors, [1.0, 2.0, 2.0, 1.0, 1.0])
+
+
+def test_effective_origin():
+    table = make_table()
+    assert table.effectiveOrigin(datetime.datetime(2019, 1, 20)) == 20190110000000
+    assert table.effectiveOrigin(datetime.datetime(2019, 1, 9)) == 0
+
+
+def test_pre_and_post_adjust():
+    table = make_table()
+    a = make_bars([20190109, 20190110, 20190111], [10.0, 5.0, 5.2], [100.0, 200.0, 200.0])
+    b = make_bars([20190109, 20190110], [3.0, 3.1], [50.0, 60.0])
+    c = make_bars([20190109], [7.0], [70.0])
+
+    pre = table.adjust({'A': a, 'B': b, 'C': c}, datetime.datetime(2019, 1, 20), 'pre')
+    np.testing.assert_allclose(pre['A']['close'], [5.0, 5.0, 5.2])
+    np.testing.assert_allclose(pre['A']['volume'], [200.0, 200.0, 200.0])
+    np.testing.assert_array_equal(pre['B'], b)
+    np.testing.assert_array_equal(pre['C'], c)  # 没有除权记录的股票保持不变
+
+    post = table.adjust({'A': a}, datetime.datetime(2019, 1, 20), 'post')
+    np.testing.assert_allclose(post['A']['close'], [10.0, 10.0, 10.4])
+    np.testing.assert_allclose(post['A']['volume'], [100.0, 100.0, 100.0])
+
+    # 以除权前的日期为基准时前复权不改变除权前的价格
+    early = table.adjust({'A': a}, datetime.datetime(2019, 1, 9), 'pre')
+    np.testing.assert_allclose(early['A']['close'], [10.0, 10.0, 10.4])
+
+    # 传入的数组不会被修改
+    np.testing.assert_array_equal(a['close'], [10.0, 5.0, 5.2])
+    np.testing.assert_array_equal(a['volume'], [100.0, 200.0, 200.0])
+    assert table.adjust({}, datetime.datetime(2019, 1, 20)) == {}
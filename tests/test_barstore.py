@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pytest
+
+from simplequant import utils
+from simplequant.data.barstore import BarStore
+from conftest import make_trading_dates
+
+
+def make_bars(dates, close):
+    bars = np.zeros(len(dates), dtype=[('datetime', '<i8'), ('close', '<f8'), ('volume', '<f8')])
+    bars['datetime'] = dates
+    bars['close'] = close
+    bars['volume'] = 100.0
+    return bars
+
+
+def test_build_fills_forward_and_zeros_before_listing(tmp_path):
+    dates = np.array([20190102, 20190103, 20190104, 20190107, 20190108])
+    symbol_bars = [('a', make_bars([20190103, 20190105, 20190107], [1.0, 9.0, 3.0])),  # 20190105不是交易日
+                   ('b', make_bars([], []))]
+    store = BarStore.build(str(tmp_path / 'store'), symbol_bars, ['b', 'a'], dates, '20195', 20190131000000)
+
+    assert store.symbols == ['b', 'a'] and store.fields == ['close', 'volume']
+    assert store.adjust_orig == 20190131000000
+    np.testing.assert_array_equal(store.bars[1, :, 0], [0, 1, 1, 3, 3])
+    np.testing.assert_array_equal(store.bars[1, :, 1], [0, 100, 100, 100, 100])
+    np.testing.assert_array_equal(store.traded[1], [False, True, False, True, False])
+    assert not store.bars[0].any() and not store.traded[0].any()
+    assert isinstance(store.bars, np.memmap)
+
+    assert store.getSymbolIndex('a') == 1
+    assert store.getDateIndex(20190107) == 3
+    with pytest.raises(KeyError):
+        store.getDateIndex(20190105)
+    assert BarStore.isValid(store.store_path, '20195') and not BarStore.isValid(store.store_path, '20196')
+
+
+def test_bundle_is_converted_to_pre_adjusted_store(bundle_database):
+    store = bundle_database.barStore()
+    stocks = utils.open_h5(os.path.join(bundle_database.data_path, bundle_database.stock_file))
+    dates = make_trading_dates()
+    np.testing.assert_array_equal(store.dates, dates)
+    close = store.field_index['close']
+
+    # 000001.XSHE在第20个交易日除权，累计除权因子为2，之前的价格前复权后减半、成交量加倍
+    raw = stocks['000001.XSHE'][:]
+    i = store.getSymbolIndex('000001.XSHE')
+    np.testing.assert_allclose(store.bars[i, :20, close], raw['close'][:20] / 2)
+    np.testing.assert_allclose(store.bars[i, 20:, close], raw['close'][20:])
+    np.testing.assert_allclose(store.bars[i, :20, store.field_index['volume']], 2000.0)
+
+    # 000002.XSHE上市之前为0
+    i = store.getSymbolIndex('000002.XSHE')
+    assert not store.bars[i, :5].any() and not store.traded[i, :5].any()
+    np.testing.assert_allclose(store.bars[i, 5:, close], stocks['000002.XSHE'][:]['close'])
+
+    # 600000.XSHG停牌日沿用前一交易日的bar
+    i = store.getSymbolIndex('600000.XSHG')
+    assert not store.traded[i, 10] and store.traded[i, 9] and store.traded[i, 11]
+    np.testing.assert_array_equal(store.bars[i, 10], store.bars[i, 9])
@@ -0,0 +1,71 @@
+import datetime
+import os
+
+import numpy as np
+import pytest
+
+from simplequant import utils
+from simplequant.data.cache import AdjustedBarsCache
+from simplequant.data.database import Database
+from conftest import make_bundle, make_trading_dates
+
+
+def make_bars(close):
+    bars = np.zeros(len(close), dtype=[('datetime', '<u8'), ('close', '<f8')])
+    bars['datetime'] = np.arange(len(close))
+    bars['close'] = close
+    return bars
+
+
+def test_save_load_and_invalidate(tmp_path):
+    cache = AdjustedBarsCache(str(tmp_path / 'cache'))
+    key = AdjustedBarsCache.makeKey('20195', 'pre', 20190110000000, True)
+    assert cache.load(key) is None
+    cache.save(key, {'A': make_bars([1.0, 2.0]), 'B': make_bars([]), 'C': make_bars([3.0])})
+
+    loaded = cache.load(key)
+    assert list(loaded) == ['A', 'B', 'C']
+    np.testing.assert_array_equal(loaded['A']['close'], [1.0, 2.0])
+    assert len(loaded['B']) == 0
+    np.testing.assert_array_equal(loaded['C']['close'], [3.0])
+
+    # 数据包版本不变时改名沿用，版本变化后旧缓存被删除
+    cache.restamp('20195', '20196')
+    assert cache.load(key) is None
+    new_key = AdjustedBarsCache.makeKey('20196', 'pre', 20190110000000, True)
+    np.testing.assert_array_equal(cache.load(new_key)['A']['close'], [1.0, 2.0])
+    cache.save(AdjustedBarsCache.makeKey('20197', 'pre', 0, True), {'A': make_bars([5.0])})
+    assert cache.load(new_key) is None
+    assert os.listdir(cache.cache_path) == ['20197_pre_0_1']
+
+
+@pytest.fixture
+def local_database(tmp_path):
+    data_path = make_bundle(str(tmp_path / 'data'))
+    open(os.path.join(data_path, '20195.txt'), 'a').close()
+    db = Database()
+    db.changePath(data_path)
+    return db
+
+
+def test_all_history_bars_hits_cache(local_database, monkeypatch):
+    dates = make_trading_dates()
+    raw = utils.open_h5(os.path.join(local_database.data_path, local_database.stock_file))['000001.XSHE'][:]
+    first = local_database.allHistoryBars(adjust_orig=datetime.datetime(2019, 3, 1))
+    np.testing.assert_allclose(first['000001.XSHE']['close'].values,
+                               np.where(np.arange(40) < 20, 0.5, 1) * raw['close'])
+    cache_path = os.path.join(local_database.data_path, local_database.adjusted_cache_dir)
+    assert os.listdir(cache_path) == ['20195_pre_{}_1'.format(dates[20] * 1000000)]
+
+    # 第20个交易日之后的任何基准日复权结果都相同，共用同一条缓存
+    with monkeypatch.context() as m:
+        m.setattr(local_database, '_allDayBars', lambda: pytest.fail('没有命中缓存'))
+        second = local_database.allHistoryBars(adjust_orig=datetime.datetime(2019, 2, 20))
+    for code in first:
+        np.testing.assert_array_equal(second[code].values, first[code].values)
+
+    # 除权日之前的基准日是另一条缓存
+    early = local_database.allHistoryBars(adjust_orig=datetime.datetime(2019, 1, 3))
+    np.testing.assert_allclose(early['000001.XSHE']['close'].values,
+                               np.where(np.arange(40) < 20, 1, 2) * raw['close'])
+    assert sorted(os.listdir(cache_path)) == ['20195_pre_0_1', '20195_pre_{}_1'.format(dates[20] * 1000000)]
@@ -0,0 +1,90 @@
+import numpy as np
+
+from simplequant.backtest.datahandler import RQBundleDataHandler
+from simplequant.backtest.eventbus import EventBus
+from simplequant.constant import OrderTime
+from conftest import make_trading_dates
+
+
+def test_subscribe_uses_spare_columns(env_database):
+    dates = make_trading_dates()
+    handler = RQBundleDataHandler(dates[0], dates[-1], ['000001.XSHE'])
+    panel = handler._panel
+    assert panel.shape[1] == 1 + RQBundleDataHandler.panel_spare_columns
+
+    store = env_database.barStore()
+    index = handler.subscribe('600000.XSHG')
+    assert index == 1
+    assert handler._panel is panel
+    np.testing.assert_array_equal(handler.symbol_data[:, 1, :], store.bars[store.getSymbolIndex('600000.XSHG')])
+    assert handler.symbol_data.shape[1] == 2
+
+
+def test_panel_grows_when_spare_columns_run_out(env_database, monkeypatch):
+    monkeypatch.setattr(RQBundleDataHandler, 'panel_spare_columns', 0)
+    dates = make_trading_dates()
+    handler = RQBundleDataHandler(dates[0], dates[-1], ['000001.XSHE'])
+    handler.subscribe('000002.XSHE')
+    handler.subscribe('600000.XSHG')
+    assert handler._panel.shape[1] == 4
+    store = env_database.barStore()
+    for symbol in ['000001.XSHE', '000002.XSHE', '600000.XSHG']:
+        np.testing.assert_array_equal(handler.symbol_data[:, handler.symbol_index[symbol], :],
+                                      store.bars[store.getSymbolIndex(symbol)])
+
+
+def test_latest_bars_start_at_listing(env_database):
+    dates = make_trading_dates()
+    handler = RQBundleDataHandler(dates[0], dates[-1], ['000001.XSHE'])
+    store = env_database.barStore()
+    for _ in range(8):
+        handler.updateBars(EventBus())
+    # 000002.XSHE从第5个交易日才上市，截至第8个交易日只有3根bar
+    bars = handler.getLatestBars('000002.XSHE', n=5, fields='close')
+    np.testing.assert_array_equal(bars, store.bars[store.getSymbolIndex('000002.XSHE'), 5:8,
+                                                   store.field_index['close']])
+    assert len(handler.getLatestBars('000001.XSHE', n=5)) == 5
+    assert list(handler._listed_index.values()) == [5, 0]
+
+
+def test_whole_market_trade_status_is_computed_on_demand(env_database):
+    dates = make_trading_dates()
+    whole = RQBundleDataHandler(dates[0], dates[-1])
+    listed = RQBundleDataHandler(dates[0], dates[-1], list(whole.symbol_list))
+    assert not whole.trade_status.any()
+
+    index = whole.symbol_index['600000.XSHG']
+    prices, tradable = whole.getSimulatedRealTimePrices([index], dates[10], OrderTime.OPEN, [True])
+    assert not tradable[0] and prices[0] == 0  # 第10个交易日停牌
+    np.testing.assert_array_equal(whole.trade_status[:, index], listed.trade_status[:, index])
+    assert not whole.trade_status[:, whole.symbol_index['000001.XSHE']].any()
+
+    prices, tradable = whole.getSimulatedRealTimePrices([0, 1, 2], dates[11], OrderTime.OPEN, [True, True, True])
+    np.testing.assert_array_equal(whole.trade_status, listed.trade_status)
+    assert tradable.all()
+
+
+def test_trade_status_flags():
+    field_index = {'open': 0, 'close': 1, 'limit_up': 2, 'limit_down': 3}
+    # 开盘涨停、收盘跌停、涨跌停价缺失（为0）、停牌
+    symbol_data = np.array([[[11.0, 10.0, 11.0, 9.0],
+                             [9.5, 9.0, 11.0, 9.0],
+                             [0.0, 0.0, 0.0, 0.0],
+                             [11.0, 9.0, 11.0, 9.0]]])
+    traded = np.array([[True, True, True, False]])
+    status = RQBundleDataHandler._tradeStatus(symbol_data, traded, field_index, 2)
+    H = RQBundleDataHandler
+    np.testing.assert_array_equal(status, [[H.TRADED | H.OPEN_LIMIT_UP, H.TRADED | H.CLOSE_LIMIT_DOWN, H.TRADED, 0]])
+
+
+def test_price_ranges_block_the_limit_side(env_database):
+    dates = make_trading_dates()
+    handler = RQBundleDataHandler(dates[0], dates[-1], ['000001.XSHE', '000002.XSHE', '600000.XSHG'])
+    H = RQBundleDataHandler
+    handler.trade_status[3] = [H.TRADED | H.OPEN_LIMIT_UP, H.TRADED | H.CLOSE_LIMIT_DOWN, H.TRADED]
+    _, _, _, can_buy, can_sell = handler.getPriceRanges([0, 1, 2], dates[3])
+    np.testing.assert_array_equal(can_buy, [False, True, True])
+    np.testing.assert_array_equal(can_sell, [True, False, True])
+
+    _, _, _, can_buy, can_sell = handler.getPriceRanges([2], dates[10])  # 停牌
+    assert not can_buy[0] and not can_sell[0]
@@ -0,0 +1,190 @@
+import functools
+import hashlib
+import http.server
+import io
+import os
+import tarfile
+import threading
+
+import numpy as np
+import pytest
+
+from simplequant import utils
+
+
+class FlakyHandler(http.server.BaseHTTPRequestHandler):
+    """
+    按server.behaviours依次决定每个GET请求的处理方式：
+    'cut'发送一部分响应体后断开连接，'drop'不返回响应直接断开连接，'ok'正常返回；用完之后都正常返回。
+    server.support_range为False时忽略Range，server.send_length为False时不发送Content-Length，以断开连接表示结束
+    """
+
+    def __init__(self, *args, data=None, **kwargs):
+        self.data = data
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.ranges.append(self.headers.get('Range'))
+        behaviour = server.behaviours.pop(0) if server.behaviours else 'ok'
+        if behaviour == 'drop':
+            self.close_connection = True
+            return
+        start = 0
+        if self.headers.get('Range') and server.support_range:
+            start = int(self.headers.get('Range').split('=')[1].rstrip('-'))
+            if start >= len(self.data):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d' % len(self.data))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(self.data) - 1, len(self.data)))
+        else:
+            self.send_response(200)
+        body = self.data[start:]
+        if server.send_length:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if behaviour == 'cut':
+            body = body[:len(body) // 3]
+        self.wfile.write(body)
+        self.wfile.flush()
+        self.close_connection = True
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """
+    内容不可压缩的bz2压缩包，返回(压缩包的字节, {文件名: 内容})
+    """
+    rng = np.random.RandomState(0)
+    files = {'a.bin': rng.bytes(200000), 'b.bin': rng.bytes(50000)}
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:bz2') as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buf.getvalue(), files
+
+
+@pytest.fixture
+def flaky_server(archive):
+    handler = functools.partial(FlakyHandler, data=archive[0])
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    httpd.behaviours = []
+    httpd.ranges = []
+    httpd.support_range = True
+    httpd.send_length = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = 'http://127.0.0.1:{}/rqbundle_201905.tar.bz2'.format(httpd.server_address[1])
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def assert_resumed(ranges, size):
+    """
+    第一次请求从头开始，第二次请求用Range从中断处继续
+    """
+    assert ranges[0] is None
+    start = int(ranges[1].split('=')[1].rstrip('-'))
+    assert 0 < start <= size // 3
+
+
+def assert_extracted(target_path, files):
+    assert sorted(os.listdir(target_path)) == sorted(files)
+    for name, content in files.items():
+        with open(os.path.join(target_path, name), 'rb') as f:
+            assert f.read() == content
+
+
+def test_download_and_extract_resumes_with_range(tmp_path, archive, flaky_server):
+    flaky_server.behaviours = ['cut']
+    utils.download_and_extract(flaky_server.url, str(tmp_path), checksum=sha256(archive[0]), chunk_size=4096)
+    assert_extracted(str(tmp_path), archive[1])
+    assert_resumed(flaky_server.ranges, len(archive[0]))
+
+
+def test_download_and_extract_without_range_support(tmp_path, archive, flaky_server):
+    flaky_server.behaviours = ['cut']
+    flaky_server.support_range = False
+    utils.download_and_extract(flaky_server.url, str(tmp_path), checksum=sha256(archive[0]), chunk_size=4096)
+    assert_extracted(str(tmp_path), archive[1])
+
+
+def test_failed_reconnects_are_retried(tmp_path, archive, flaky_server):
+    flaky_server.behaviours = ['cut', 'drop', 'drop', 'ok']
+    utils.download_and_extract(flaky_server.url, str(tmp_path), checksum=sha256(archive[0]), chunk_size=4096,
+                               max_retries=3)
+    assert_extracted(str(tmp_path), archive[1])
+
+
+def test_reconnects_are_limited_by_max_retries(tmp_path, flaky_server):
+    flaky_server.behaviours = ['cut', 'drop', 'drop', 'drop']
+    with pytest.raises(IOError):
+        utils.download_and_extract(flaky_server.url, str(tmp_path), chunk_size=4096, max_retries=2)
+
+
+@pytest.mark.parametrize('size', [0.5, 0.999])
+def test_truncated_archive_raises_io_error(tmp_path, archive, size):
+    # 服务器上的压缩包本身不完整，Content-Length与截断后的长度一致，下载本身没有出错
+    data = archive[0][:int(len(archive[0]) * size)]
+    handler = functools.partial(FlakyHandler, data=data)
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    httpd.behaviours, httpd.ranges, httpd.support_range, httpd.send_length = [], [], True, True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        url = 'http://127.0.0.1:{}/rqbundle_201905.tar.bz2'.format(httpd.server_address[1])
+        with pytest.raises(IOError):
+            utils.download_and_extract(url, str(tmp_path), chunk_size=4096)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+    tar_path = str(tmp_path / 'truncated.tar.bz2')
+    with open(tar_path, 'wb') as f:
+        f.write(data)
+    with pytest.raises(IOError):
+        utils.extract(tar_path, str(tmp_path / 'out'), 'bz2')
+
+
+def test_bad_checksum_is_rejected(tmp_path, flaky_server):
+    with pytest.raises(IOError):
+        utils.download_and_extract(flaky_server.url, str(tmp_path), checksum='0' * 64, chunk_size=4096)
+
+
+def test_download_resumes_part_file(tmp_path, archive, flaky_server):
+    flaky_server.behaviours = ['cut']
+    file_path = utils.download(flaky_server.url, str(tmp_path), checksum=sha256(archive[0]), chunk_size=4096)
+    with open(file_path, 'rb') as f:
+        assert f.read() == archive[0]
+    assert_resumed(flaky_server.ranges, len(archive[0]))
+
+
+def test_download_without_content_length(tmp_path, archive, flaky_server):
+    flaky_server.send_length = False
+    file_path = utils.download(flaky_server.url, str(tmp_path), checksum=sha256(archive[0]), chunk_size=4096)
+    with open(file_path, 'rb') as f:
+        assert f.read() == archive[0]
+
+
+def test_download_completes_when_part_file_is_already_whole(tmp_path, archive, flaky_server):
+    file_path = os.path.join(str(tmp_path), os.path.basename(flaky_server.url))
+    with open(file_path + '.part', 'wb') as f:
+        f.write(archive[0])
+    assert utils.download(flaky_server.url, str(tmp_path), checksum=sha256(archive[0])) == file_path
+    assert flaky_server.ranges == ['bytes=%d-' % len(archive[0])]
+    assert not os.path.exists(file_path + '.part')
+    with open(file_path, 'rb') as f:
+        assert f.read() == archive[0]
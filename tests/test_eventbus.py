@@ -0,0 +1,40 @@
+from simplequant.backtest.eventbus import EventBus
+
+
+class Event:
+    def __init__(self, type, priority, name):
+        self.type = type
+        self.priority = priority
+        self.name = name
+
+
+def test_priority_then_fifo():
+    bus = EventBus()
+    bus.put(Event('market', 2, 'm1'))
+    bus.put((1, Event('order', 1, 'o1')))
+    bus.put(Event('market', 2, 'm2'))
+    bus.put(Event('fill', 1, 'f1'))
+    assert len(bus) == 4
+    assert [bus.get().name for _ in range(4)] == ['o1', 'f1', 'm1', 'm2']
+    assert bus.empty() and bus.get() is None
+
+
+def test_drain_handles_events_produced_during_handling():
+    bus = EventBus()
+    handled = []
+
+    def onMarket(event):
+        handled.append(event.name)
+        bus.put(Event('signal', 2, 's' + event.name[1:]))
+        bus.put(Event('order', 1, 'o' + event.name[1:]))
+
+    bus.register('market', onMarket)
+    bus.register('order', lambda event: handled.append(event.name))
+    bus.register('signal', lambda event: handled.append(event.name))
+    bus.put(Event('market', 2, 'm1'))
+    bus.put(Event('market', 2, 'm2'))
+    bus.put(Event('unknown', 1, 'u1'))  # 没有处理函数，直接丢弃
+
+    assert bus.drain() == 7
+    assert handled == ['m1', 'o1', 'm2', 'o2', 's1', 's2']
+    assert bus.empty()
@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+
+from simplequant.backtest import backtest
+from simplequant.backtest.event import CancelEvent, MarketEvent, OrderEvent, SignalEvent
+from simplequant.backtest.execution import SimulatedExecutionHandler
+from simplequant.constant import Direction, OrderType
+from simplequant.strategy.basestrategy import BaseStrategy
+
+
+class Account:
+    """
+    只提供_settle()用到的现金和持仓
+    """
+
+    def __init__(self, cash, positions):
+        self.cash = cash
+        self.current_positions = np.asarray(positions, dtype=np.float64)
+
+    def getCurrentCash(self):
+        return self.cash
+
+
+def test_settle_allocates_cash_sells_first_then_buys_in_order():
+    # 佣金千分之一，过户费0.00002，卖出另收印花税千分之一
+    handler = SimulatedExecutionHandler(None, Account(10000., [0, 200, 0, 0, 0]), rate=0.001, slippage=0)
+    orders = [OrderEvent(20190102, 'A', Direction.LONG, 550),   # 按整手取500股
+              OrderEvent(20190102, 'B', Direction.SHORT, 300),  # 只持有200股
+              OrderEvent(20190102, 'C', Direction.LONG, 2000),  # 现金不够，只能部分成交
+              OrderEvent(20190102, 'D', Direction.LONG, 100),   # 不可交易
+              OrderEvent(20190102, 'E', Direction.LONG, 100)]   # 剩余现金足够
+    ids = np.arange(5)
+    buy = np.array([True, False, True, True, True])
+    prices = np.array([10., 20., 5., 1., 1.])
+    tradable = np.array([True, True, True, False, True])
+
+    fill_batch, quantities = handler._settle(orders, ids, buy, prices, tradable)
+
+    # 卖出所得 200 * 20 - 4000 * 0.00202 = 3991.92，可用现金 13991.92
+    # A：500 * 10 * 1.00102 = 5005.1，剩余 8986.82
+    # C：8986.82 // 5.0051 = 1795股，取整手1700股，花费 8508.67，剩余 478.15
+    # E：100股花费 100.102
+    np.testing.assert_array_equal(quantities, [500, 200, 1700, 0, 100])
+    assert fill_batch.symbols == ['B', 'A', 'C', 'E']
+    np.testing.assert_array_equal(fill_batch.quantities, [200, 500, 1700, 100])
+    np.testing.assert_allclose(fill_batch.commissions, [8.08, 5.1, 8.67, 0.102])
+    np.testing.assert_allclose(fill_batch.fill_costs, [20., 10., 5., 1.])
+    cash = 10000 + (fill_batch.fill_costs * fill_batch.quantities * np.where(fill_batch.buy, -1, 1)).sum() \
+        - fill_batch.commissions.sum()
+    assert cash == pytest.approx(378.048)
+
+
+def test_settle_never_overdraws_cash():
+    handler = SimulatedExecutionHandler(None, Account(1000., [0, 0]), rate=3/10000, slippage=0)
+    orders = [OrderEvent(20190102, 'A', Direction.LONG, 100), OrderEvent(20190102, 'B', Direction.LONG, 100)]
+    fill_batch, quantities = handler._settle(orders, np.arange(2), np.array([True, True]), np.array([9.99, 9.99]),
+                                             np.array([True, True]))
+    # 第一笔100股需要 999 * 1.00032 = 999.32，第二笔已经买不起
+    np.testing.assert_array_equal(quantities, [100, 0])
+    assert fill_batch.symbols == ['A']
+
+
+def test_cap_sells_by_position_in_submission_order():
+    ids = np.array([3, 1, 3, 3])
+    quantities = np.array([300, 100, 200, 100])
+    positions = np.array([400, 50, 400, 400])
+    capped = SimulatedExecutionHandler._capSells(ids, quantities, positions)
+    np.testing.assert_array_equal(capped, [300, 50, 100, 0])
+
+
+def test_cap_sells_without_orders():
+    capped = SimulatedExecutionHandler._capSells(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                                                 np.zeros(0))
+    assert len(capped) == 0
+
+
+class Gateway:
+    """
+    只提供matchOrders()用到的股票序号和价格区间
+    """
+
+    def __init__(self, can_buy, can_sell):
+        self.can_buy = np.asarray(can_buy)
+        self.can_sell = np.asarray(can_sell)
+
+    def getSymbolIndex(self):
+        return {'A': 0, 'B': 1}
+
+    def getPriceRanges(self, symbol_indices, datetime):
+        n = len(symbol_indices)
+        return (np.full(n, 10.), np.full(n, 11.), np.full(n, 9.), self.can_buy[symbol_indices],
+                self.can_sell[symbol_indices])
+
+
+def limit_order(symbol, direction, limit_price):
+    return OrderEvent(20190102, symbol, direction, 100, order_type=OrderType.LIMIT, limit_price=limit_price)
+
+
+def test_match_orders_skips_the_limit_side():
+    # A涨停，买单不能成交；B跌停，卖单不能成交
+    handler = SimulatedExecutionHandler(Gateway([False, True], [True, False]), Account(10000., [100, 100]),
+                                        rate=0, slippage=0)
+    handler.executeOrders([limit_order('A', Direction.LONG, 10.), limit_order('A', Direction.SHORT, 10.),
+                           limit_order('B', Direction.LONG, 10.), limit_order('B', Direction.SHORT, 10.)])
+    fill_batch = handler.matchOrders(MarketEvent(20190103, None))
+    assert fill_batch.symbols == ['A', 'B']
+    np.testing.assert_array_equal(fill_batch.buy, [False, True])
+    assert len(handler.order_book) == 2
+
+    handler.cancelOrders('A')
+    assert list(handler.order_book.getSymbolIndices()) == [1]
+
+
+class CancellingStrategy(BaseStrategy):
+    """
+    第一根bar挂一笔不会成交的限价买单，cancel_at不为None时在第cancel_at根bar撤单
+    """
+    universe = ['000001.XSHE']
+    cancel_at = None
+
+    def __init__(self, portfolio):
+        self.count = 0
+
+    def handleBar(self, events_queue, event):
+        self.count += 1
+        if self.count == 1:
+            events_queue.put(SignalEvent(event.datetime, '000001.XSHE', Direction.LONG, 100,
+                                         order_type=OrderType.LIMIT, limit_price=0.01))
+        elif self.count == self.cancel_at:
+            events_queue.put(CancelEvent(event.datetime, '000001.XSHE'))
+
+
+@pytest.mark.parametrize('cancel_at, pending', [(None, 1), (3, 0)])
+def test_strategy_cancels_limit_orders_through_events(env_database, monkeypatch, cancel_at, pending):
+    monkeypatch.setattr(backtest, 'Performance', lambda *args: None)
+    monkeypatch.setattr(CancellingStrategy, 'cancel_at', cancel_at)
+    bt = backtest.Backtest(CancellingStrategy, progress=False, silent=True)
+    bt.run()
+    assert len(bt.execution_handler.order_book) == pending
+    assert not bt.portfolio.current_positions.any()
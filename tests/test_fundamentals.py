@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from simplequant.data.fundamentals import FundamentalsStore, query, valuation, income
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = FundamentalsStore(str(tmp_path / 'fundamentals'))
+    store.write('valuation', pd.DataFrame({
+        'code': ['A', 'B', 'C', 'A', 'B', 'C'],
+        'day': ['2019-01-02'] * 3 + ['2019-01-03'] * 3,
+        'pe_ratio': [12.0, 8.0, 20.0, 13.0, 9.0, 25.0],
+        'market_cap': [100.0, 200.0, 300.0, 101.0, 201.0, 301.0]}), 'day')
+    store.write('income', pd.DataFrame({
+        'code': ['A', 'A', 'B'],
+        'pubDate': ['2019-04-20', '2019-08-20', '2019-04-25'],
+        'statDate': ['2019-03-31', '2019-06-30', '2019-03-31'],
+        'net_profit': [10.0, 20.0, 5.0]}), 'pubDate', 'statDate')
+    return store
+
+
+def test_snapshot_filter_order_limit(store):
+    q = query(valuation.code, valuation.pe_ratio).filter(valuation.pe_ratio > 10).order_by(valuation.pe_ratio.desc())
+    df = store.getFundamentals(q, date='2019-01-03')
+    assert list(df['code']) == ['C', 'A']
+    assert list(df['pe_ratio']) == [25.0, 13.0]
+
+    df = store.getFundamentals(q.limit(1), date=20190102)
+    assert list(df['code']) == ['C'] and list(df['pe_ratio']) == [20.0]
+
+    df = store.getFundamentals(query(valuation).filter(valuation.code.in_(['A', 'B'])).order_by(valuation.market_cap),
+                               date='2019-01-02')
+    assert df.columns[0] == 'code' and sorted(df.columns[1:]) == ['day', 'market_cap', 'pe_ratio']
+    assert list(df['code']) == ['A', 'B'] and list(df['day']) == ['2019-01-02'] * 2
+    with pytest.raises(KeyError):
+        store.getFundamentals(q, date='2019-01-04')
+
+
+def test_reports_are_point_in_time(store):
+    q = query(income.code, income.net_profit, income.statDate)
+    df = store.getFundamentals(q, date='2019-04-21')  # B的一季报尚未公布
+    assert list(df['code']) == ['A'] and list(df['net_profit']) == [10.0]
+
+    df = store.getFundamentals(q, date='2019-09-01')
+    assert list(df['code']) == ['A', 'B']
+    assert list(df['net_profit']) == [20.0, 5.0]
+    assert list(df['statDate']) == ['2019-06-30', '2019-03-31']
+
+    df = store.getFundamentals(q, statDate='2019q1')
+    assert list(df['net_profit']) == [10.0, 5.0]
+    df = store.getFundamentals(q, statDate='2019q2')
+    assert list(df['code']) == ['A'] and list(df['net_profit']) == [20.0]
+
+
+def test_rewrite_replaces_same_date(store):
+    store.write('valuation', pd.DataFrame({'code': ['A', 'D'], 'day': ['2019-01-03'] * 2, 'pe_ratio': [30.0, 40.0]}),
+                'day')
+    df = store.getFundamentals(query(valuation.code, valuation.pe_ratio, valuation.market_cap), date='2019-01-03')
+    assert list(df['code']) == ['A', 'B', 'C', 'D']
+    assert list(df['pe_ratio']) == [30.0, 9.0, 25.0, 40.0]
+    np.testing.assert_array_equal(df['market_cap'], [np.nan, 201.0, 301.0, np.nan])
+    np.testing.assert_array_equal(store.getDates('valuation'), [20190102, 20190103])
@@ -0,0 +1,38 @@
+from simplequant.backtest.event import FillBatch, OrderEvent
+from simplequant.backtest.journal import EventJournal
+from simplequant.constant import Direction, OrderTime
+
+
+def make_batch(n, datetime=20190102):
+    return FillBatch([datetime] * n, ['%06d.XSHE' % i for i in range(n)], list(range(n)), [Direction.LONG] * n,
+                     [10.0 + i for i in range(n)], [100] * n, [1.0] * n, [OrderTime.OPEN] * n)
+
+
+def test_limit_counts_fills_not_batches():
+    journal = EventJournal(maxlen=5)
+    journal.record(make_batch(3))
+    journal.record(make_batch(4, 20190103))
+    assert len(journal) == 5
+    fills = journal.records()
+    assert [fill.symbol for fill in fills] == ['000002.XSHE', '000000.XSHE', '000001.XSHE', '000002.XSHE',
+                                               '000003.XSHE']
+    assert [fill.datetime for fill in fills] == [20190102] + [20190103] * 4
+    assert fills[-1].fill_cost == 13.0
+
+
+def test_batch_larger_than_limit_keeps_last_fills():
+    journal = EventJournal(maxlen=2)
+    journal.record(make_batch(10))
+    assert [fill.symbol for fill in journal.records()] == ['000008.XSHE', '000009.XSHE']
+
+
+def test_records_are_snapshots():
+    journal = EventJournal(maxlen=10)
+    order = OrderEvent(20190102, '000001.XSHE', Direction.LONG, 300)
+    journal.record(order)
+    order.quantity = 100  # 部分成交后修改剩余数量
+    journal.record(make_batch(1))
+    events = journal.records(2)
+    assert events[0].quantity == 300
+    assert events[1].symbol == '000000.XSHE'
+    assert journal.records(0) == []
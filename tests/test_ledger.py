@@ -0,0 +1,68 @@
+import numpy as np
+
+from simplequant.backtest import backtest
+from simplequant.backtest.event import SignalEvent
+from simplequant.backtest.ledger import DenseLedger, SparseLedger
+from simplequant.constant import Direction, OrderTime
+from simplequant.strategy.basestrategy import BaseStrategy
+
+
+def test_sparse_ledger_matches_dense_ledger():
+    rng = np.random.RandomState(0)
+    dense, sparse = DenseLedger(30, 4), SparseLedger(30, 4)
+    rows = []
+    for row in range(30):
+        if row == 10:  # 中途增加股票
+            dense.grow(12)
+            sparse.grow(12)
+        n = 4 if row < 10 else 12
+        values = rng.randint(-3, 4, n) * (rng.rand(n) < 0.3) * 100.0
+        dense.record(row, values)
+        sparse.record(row, values)
+        rows.append(np.append(values, np.zeros(12 - n)))
+
+    expected = np.array(rows)
+    np.testing.assert_array_equal(dense.toDense(30, 12), expected)
+    np.testing.assert_array_equal(sparse.toDense(30, 12), expected)
+    np.testing.assert_array_equal(sparse.toDense(7, 4), expected[:7, :4])
+    for index in range(12):
+        np.testing.assert_array_equal(sparse.getColumn(index, 25), expected[:25, index])
+        np.testing.assert_array_equal(dense.getColumn(index, 25), expected[:25, index])
+
+
+class AlternatingStrategy(BaseStrategy):
+    """
+    奇数日买入、偶数日卖出，其中600000.XSHG在第10个交易日停牌
+    """
+    universe = ['000001.XSHE', '600000.XSHG']
+
+    def __init__(self, portfolio):
+        self.count = 0
+
+    def handleBar(self, events_queue, event):
+        self.count += 1
+        direction = Direction.LONG if self.count % 2 else Direction.SHORT
+        for symbol in self.universe:
+            events_queue.put(SignalEvent(event.datetime, symbol, direction, 300 if self.count % 2 else 100,
+                                         OrderTime.OPEN))
+
+
+def run(sparse, monkeypatch):
+    monkeypatch.setattr(backtest, 'Performance', lambda *args: None)
+    bt = backtest.Backtest(AlternatingStrategy, sparse=sparse, progress=False, silent=True)
+    bt.run()
+    return bt.portfolio
+
+
+def test_sparse_backtest_matches_dense_backtest(env_database, monkeypatch):
+    dense, sparse = run(False, monkeypatch), run(True, monkeypatch)
+    # 信号次日开盘成交，每两天净买入200股；600000.XSHG停牌当天的卖单没有成交
+    np.testing.assert_array_equal(dense.all_positions['000001.XSHE'].values[:12],
+                                  [0, 300, 200, 500, 400, 700, 600, 900, 800, 1100, 1000, 1300])
+    np.testing.assert_array_equal(dense.all_positions['600000.XSHG'].values[:12],
+                                  [0, 300, 200, 500, 400, 700, 600, 900, 800, 1100, 1100, 1400])
+    assert dense.all_positions.equals(sparse.all_positions)
+    assert dense.all_holdings.equals(sparse.all_holdings)
+    for symbol in AlternatingStrategy.universe:
+        np.testing.assert_array_equal(dense.getPositionSeries(symbol), sparse.getPositionSeries(symbol))
+        np.testing.assert_array_equal(dense.getHoldingSeries(symbol), sparse.getHoldingSeries(symbol))
@@ -0,0 +1,52 @@
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+from simplequant.data.metadata import BundleMetadata
+from conftest import BAR_DTYPE, CODES, make_bundle, make_trading_dates
+
+
+@pytest.fixture
+def metadata(tmp_path):
+    data_path = make_bundle(str(tmp_path / 'bundle'))
+    dates = make_trading_dates()
+    with h5py.File(os.path.join(data_path, 'stocks.h5'), 'a') as stocks:
+        bars = np.zeros(3, dtype=BAR_DTYPE)
+        bars['datetime'] = dates[:3].astype(np.uint64) * 1000000
+        bars['volume'] = 100.0
+        stocks['000003.XSHE'] = bars  # ex_cum_factor中没有记录
+        bars['volume'] = 0
+        stocks['000004.XSHE'] = bars  # 没有任何成交
+    return BundleMetadata.build(data_path, 'stocks.h5', 'ex_cum_factor.h5', dates, '20195')
+
+
+def test_lookups(metadata):
+    dates = make_trading_dates()
+    assert metadata.getStockList() == CODES
+    assert metadata.getFirstTradingDate('000002.XSHE') == dates[5]
+    assert metadata.getLastTradingDate('000002.XSHE') == dates[-1]
+    assert metadata.getFirstTradingDate('000003.XSHE') == dates[0]
+    assert metadata.getLastTradingDate('000003.XSHE') == dates[2]
+    assert metadata.getFirstTradingDate('000004.XSHE') == 0
+
+    np.testing.assert_array_equal(metadata.getSuspendedDates('600000.XSHG'), [dates[10]])
+    assert len(metadata.getSuspendedDates('000002.XSHE')) == 0  # 上市之前不算停牌
+    assert metadata.isSuspended('600000.XSHG', dates[10])
+    assert not metadata.isSuspended('600000.XSHG', dates[9])
+    assert not metadata.isSuspended('000002.XSHE', dates[0])
+    with pytest.raises(ValueError):
+        metadata.isSuspended('600000.XSHG', 20190105)
+
+
+def test_save_and_read(metadata, tmp_path):
+    meta_path = str(tmp_path / BundleMetadata.meta_file)
+    metadata.save(meta_path)
+    assert [name for name in os.listdir(str(tmp_path)) if '.building' in name] == []
+    loaded = BundleMetadata.read(meta_path)
+    assert loaded.version == '20195'
+    assert loaded.getStockList() == metadata.getStockList()
+    np.testing.assert_array_equal(loaded.first_dates, metadata.first_dates)
+    np.testing.assert_array_equal(loaded.getSuspendedDates('600000.XSHG'), metadata.getSuspendedDates('600000.XSHG'))
+    assert BundleMetadata.read(str(tmp_path / 'missing.npz')) is None
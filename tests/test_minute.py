@@ -0,0 +1,152 @@
+import os
+
+import numpy as np
+import pytest
+
+from simplequant import utils
+from simplequant.backtest.datahandler import RQMinuteDataHandler
+from simplequant.backtest.eventbus import EventBus
+from simplequant.backtest.exception import NotTradable
+from simplequant.constant import OrderTime
+from simplequant.data.database import Database
+from simplequant.data.minutestore import MinuteBarStore
+from simplequant.environment import LazyDatabase
+from conftest import make_bundle, make_trading_dates
+
+
+DATES = make_trading_dates()
+D0, D1, D2 = DATES[19], DATES[20], DATES[21]  # 000001.XSHE在D1除权，累计除权因子为2
+TIMES = [931, 932, 933]
+S1, S2, S3 = '000001.XSHE', '600000.XSHG', '000002.XSHE'
+
+
+def make_day(closes, volumes=None):
+    """
+    :param closes: minutes × symbols的收盘价，NaN表示没有成交
+    :return: minutes × symbols × fields，字段顺序与MinuteBarStore.fields一致
+    """
+    closes = np.array(closes, dtype=np.float64)
+    volumes = np.full(closes.shape, 100.0) if volumes is None else np.array(volumes, dtype=np.float64)
+    volumes = np.where(np.isnan(closes), np.nan, volumes)
+    return np.stack([closes, closes, closes + 0.5, closes - 0.5, volumes, volumes * closes], axis=-1)
+
+
+@pytest.fixture
+def minute_database(tmp_path, monkeypatch):
+    data_path = make_bundle(str(tmp_path / 'data'))
+    open(os.path.join(data_path, '20195.txt'), 'a').close()
+    db = Database()
+    db.changePath(data_path)
+    db.loaded = True
+    monkeypatch.setattr(LazyDatabase, '_instance', db)
+
+    store = db.minuteBarStore()
+    nan = np.nan
+    store.writeDay(D0, TIMES, [S1, S2], make_day([[10, nan], [12, nan], [nan, 5]]))
+    store.writeDay(D1, TIMES, [S1, S2], make_day([[nan, 6], [7, 6], [8, 6]], [[0, 100], [100, 0], [100, 100]]))
+    store.writeDay(D2, TIMES, [S2, S1, S3], make_day([[6, 9, 3], [6, 9, 3], [6, 9, 3]]))
+    return db
+
+
+def test_write_and_load_day(minute_database):
+    store = MinuteBarStore(os.path.join(minute_database.data_path, minute_database.minute_store_dir))
+    assert store.symbols == [S1, S2, S3]
+    np.testing.assert_array_equal(store.getDates(), [D0, D1, D2])
+    assert store.hasDate(D1) and not store.hasDate(DATES[22])
+
+    times, bars = store.loadDay(D2, [2, 0])
+    np.testing.assert_array_equal(times, TIMES)
+    np.testing.assert_array_equal(bars[:, 0, store.field_index['close']], [3, 3, 3])
+    np.testing.assert_array_equal(bars[:, 1, store.field_index['high']], [9.5, 9.5, 9.5])
+
+    # 写入D0时还没有000002.XSHE，读取时为NaN
+    times, bars = store.loadDay(D0, [2, 0])
+    assert np.isnan(bars[:, 0]).all()
+    np.testing.assert_array_equal(bars[:, 1, store.field_index['close']], [10, 12, np.nan])
+    assert bars.dtype == np.float64 and bars.shape == (3, 2, len(MinuteBarStore.fields))
+
+
+def test_minute_prices_are_adjusted_like_daily_prices(minute_database):
+    handler = RQMinuteDataHandler(D0, D2, [S1, S2])
+    bar_store = minute_database.barStore()
+    assert handler.adjust_orig == bar_store.adjust_orig
+    close = handler.field_index['close']
+    for _ in range(3):
+        handler.updateBars(EventBus())
+    np.testing.assert_array_equal(handler.symbol_data[:, 0, close], [5, 6, 6])
+    np.testing.assert_array_equal(handler.symbol_data[:, 0, handler.field_index['volume']], [200, 200, 200])
+    # 日线和分钟线的000001.XSHE在除权日之前都是原始价格的一半
+    raw = utils.open_h5(os.path.join(minute_database.data_path, minute_database.stock_file))[S1][:]
+    daily = bar_store.bars[bar_store.getSymbolIndex(S1), :, bar_store.field_index['close']]
+    assert daily[19] / raw['close'][19] == pytest.approx(handler.symbol_data[0, 0, close] / 10)
+    assert daily[20] / raw['close'][20] == pytest.approx(1.0)
+
+    # 早先生成的存储没有记录基准时以最后一个除权日为基准，重复运行的结果相同
+    legacy = type('LegacyStore', (), {'adjust_orig': None})()
+    assert RQMinuteDataHandler._storeAdjustOrig(legacy, minute_database.exCumFactorTable()) == int(D1) * 1000000
+
+    again = RQMinuteDataHandler(D0, D2, [S1, S2])
+    again.updateBars(EventBus())
+    np.testing.assert_array_equal(again.symbol_data, handler.symbol_data)
+
+
+def test_forward_fill_and_carry_over(minute_database):
+    handler = RQMinuteDataHandler(D0, D2, [S1, S2])
+    close, volume = handler.field_index['close'], handler.field_index['volume']
+    events = EventBus()
+    handler.updateBars(events)
+    event = events.get()
+    assert event.datetime == int(D0) * 10000 + 931 and not event.record
+
+    # 600000.XSHG在D0开盘后两分钟没有成交，此前没有行情，填0
+    np.testing.assert_array_equal(handler.symbol_data[:, 1, close], [0, 0, 5])
+    np.testing.assert_array_equal(handler.tradable, [[True, False], [True, False], [False, True]])
+
+    for _ in range(3):
+        handler.updateBars(events)
+    assert handler.date == D1 and handler.minute_index == 0
+    # D1第一分钟000001.XSHE没有行情，沿用D0最后一分钟的行情；600000.XSHG有价格但成交量为0，不可交易
+    np.testing.assert_array_equal(handler.symbol_data[:, 0, close], [6, 7, 8])
+    np.testing.assert_array_equal(handler.symbol_data[:, 1, close], [6, 6, 6])
+    np.testing.assert_array_equal(handler.symbol_data[:, 1, volume], [100, 0, 100])
+    np.testing.assert_array_equal(handler.tradable, [[False, True], [True, False], [True, True]])
+
+    records = []
+    while True:
+        try:
+            handler.updateBars(events)
+        except StopIteration:
+            break
+        records.append(events.get().record)
+    assert records == [False, True, False, False, True]
+
+
+def test_locate_current_and_next_day(minute_database):
+    handler = RQMinuteDataHandler(D0, D2, [S1, S2])
+    handler.updateBars(EventBus())
+    close = handler.field_index['close']
+
+    (times, symbol_data, tradable), minute_index = handler._locate(int(D0) * 10000 + 933)
+    assert minute_index == 2 and symbol_data is handler.symbol_data
+    (times, symbol_data, tradable), minute_index = handler._locate(int(D1) * 10000 + 932)
+    assert minute_index == 1 and symbol_data[1, 0, close] == 7
+    assert symbol_data[0, 0, close] == 6  # 预读的下一个交易日同样沿用当日最后一分钟的行情
+    with pytest.raises(NotTradable):
+        handler._locate(int(D0) * 10000 + 1000)
+    with pytest.raises(NotTradable):
+        handler._locate(int(D2) * 10000 + 931)
+
+    assert handler.nextTradingDate(int(D0) * 10000 + 931) == int(D0) * 10000 + 932
+    assert handler.nextTradingDate(int(D0) * 10000 + 933) == int(D1) * 10000 + 931
+    prices, tradable = handler.getSimulatedRealTimePrices([0, 1], int(D1) * 10000 + 931, OrderTime.OPEN, [True, True])
+    np.testing.assert_array_equal(prices, [0, 6])
+    np.testing.assert_array_equal(tradable, [False, True])
+    prices, tradable = handler.getSimulatedRealTimePrices([0], int(D2) * 10000 + 931, OrderTime.OPEN, [True])
+    assert not tradable[0] and prices[0] == 0
+
+    # 预读的下一个交易日在进入该日时直接使用
+    next_day = handler._peekNextDay()
+    handler.updateBars(EventBus())
+    handler.updateBars(EventBus())
+    handler.updateBars(EventBus())
+    assert handler.symbol_data is next_day[2]
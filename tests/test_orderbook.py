@@ -0,0 +1,61 @@
+from simplequant.backtest.orderbook import OrderBook
+
+
+class Order:
+    def __init__(self, name, limit_price, quantity=100):
+        self.name = name
+        self.limit_price = limit_price
+        self.quantity = quantity
+
+
+def make_book():
+    book = OrderBook()
+    book.add(3, Order('b1', 10.0), True)
+    book.add(3, Order('b2', 11.0), True)
+    book.add(3, Order('b3', 10.0), True)
+    book.add(3, Order('a1', 12.0), False)
+    book.add(3, Order('a2', 11.5), False)
+    book.add(1, Order('a3', 5.0), False)
+    return book
+
+
+def names(orders):
+    return [order.name for order in orders]
+
+
+def test_match_returns_prefix_in_priority_order():
+    book = make_book()
+    assert len(book) == 6
+    assert list(book.getSymbolIndices()) == [1, 3]
+
+    bids, asks = book.match(3, 10.5, 11.8)
+    assert names(bids) == ['b2'] and names(asks) == ['a2']
+    bids, asks = book.match(3, 10.0, 12.0)
+    assert names(bids) == ['b2', 'b1', 'b3'] and names(asks) == ['a2', 'a1']
+    bids, asks = book.match(3, 11.1, 11.4)
+    assert bids == [] and asks == []
+    assert book.match(2, 0, 100) == ([], [])
+
+
+def test_remove_filled_keeps_partial_fills_in_place():
+    book = make_book()
+    bids, _ = book.match(3, 10.0, 10.0)
+    bids[0].quantity = 0
+    bids[1].quantity = 50
+    book.removeFilled(3, True, len(bids))
+    bids, _ = book.match(3, 10.0, 10.0)
+    assert names(bids) == ['b1', 'b3'] and bids[0].quantity == 50
+
+    for order in bids:
+        order.quantity = 0
+    book.removeFilled(3, True, len(bids))
+    assert book.match(3, 0, 0)[0] == []
+    assert len(book) == 3
+
+
+def test_cancel():
+    book = make_book()
+    book.cancel(3)
+    assert list(book.getSymbolIndices()) == [1]
+    book.cancel()
+    assert len(book) == 0
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from simplequant.backtest.datahandler import RQBundleDataHandler
+from simplequant.backtest.event import FillBatch, FillEvent, SignalEvent
+from simplequant.backtest.eventbus import EventBus
+from simplequant.backtest.portfolio import Portfolio
+from simplequant.constant import Direction, OrderTime
+from conftest import make_trading_dates
+
+
+def make_portfolio(universe=('000001.XSHE',), sparse=False):
+    dates = make_trading_dates()
+    data_handler = RQBundleDataHandler(dates[0], dates[-1], list(universe))
+    return Portfolio(data_handler, 100000, sparse)
+
+
+def test_zero_quantity_order_is_released(env_database):
+    portfolio = make_portfolio()
+    events_queue = EventBus()
+    dates = make_trading_dates()
+    portfolio.updateSignal(events_queue, SignalEvent(dates[0], '000001.XSHE', Direction.LONG, 50))
+    assert events_queue.empty()
+    assert len(portfolio.order_pool._free) == 1
+
+    portfolio.updateSignal(events_queue, SignalEvent(dates[0], '000001.XSHE', Direction.LONG, 250))
+    order_event = events_queue.get()
+    assert order_event.quantity == 200 and order_event.datetime == dates[1]
+    assert len(portfolio.order_pool._free) == 0
+
+
+def test_mark_to_market_dot_product(env_database):
+    portfolio = make_portfolio(('000001.XSHE', '000002.XSHE', '600000.XSHG'))
+    portfolio._positions[:3] = [100, 0, -200]
+    closes = np.array([10., 20., 5.])
+    assert portfolio.markToMarket(closes) == pytest.approx(100 * 10 - 200 * 5)
+    np.testing.assert_allclose(portfolio.current_holdings, [1000, 0, -1000])
+
+
+def test_mark_to_market_held_only_matches_full_universe(env_database):
+    portfolio = make_portfolio(('000001.XSHE', '000002.XSHE', '600000.XSHG'))
+    portfolio._positions[:3] = [300, 0, 100]
+    closes = np.array([10., np.nan, 5.])  # 未持仓的股票即使没有价格也不参与估值
+    held = np.array([0, 2])
+    assert portfolio.markToMarket(closes, held) == pytest.approx(3500)
+    np.testing.assert_allclose(portfolio.current_holdings, [3000, 0, 500])
+
+    closes[1] = 20.
+    assert portfolio.markToMarket(closes) == portfolio.markToMarket(closes, held)
+
+
+FILLS = [('000001.XSHE', Direction.LONG, 10., 500, 1.5),
+         ('600000.XSHG', Direction.LONG, 5., 1000, 1.),
+         ('000001.XSHE', Direction.SHORT, 11., 200, 2.),
+         ('000002.XSHE', Direction.LONG, 20., 100, 0.5),
+         ('000001.XSHE', Direction.LONG, 10.5, 100, 0.3),
+         ('000002.XSHE', Direction.NET, 21., 100, 0.6)]
+
+
+def test_incremental_holdings_match_full_revalue(env_database):
+    universe = ('000001.XSHE', '000002.XSHE', '600000.XSHG')
+    incremental, batched = make_portfolio(universe), make_portfolio(universe)
+    for symbol, direction, fill_cost, quantity, commission in FILLS:
+        incremental.updateFromFill(FillEvent(20190102, symbol, direction, fill_cost, quantity, commission,
+                                             OrderTime.OPEN))
+    symbols, directions, fill_costs, quantities, commissions = zip(*FILLS)
+    batched.updateFromFills(FillBatch([20190102] * len(FILLS), list(symbols),
+                                      [batched.symbol_index[symbol] for symbol in symbols], list(directions),
+                                      fill_costs, quantities, commissions, [OrderTime.OPEN] * len(FILLS)))
+
+    # 成交股票按各自最后一笔成交价估值
+    cash = 100000 - 5000 - 5000 + 2200 - 2000 - 1050 + 2100 - 5.9
+    for portfolio in (incremental, batched):
+        np.testing.assert_array_equal(portfolio.current_positions, [400, 0, 1000])
+        assert portfolio.cash == pytest.approx(cash)
+        assert portfolio.market_value == pytest.approx(400 * 10.5 + 1000 * 5)
+        assert portfolio.total == pytest.approx(portfolio.cash + portfolio.market_value)
+
+        # 以成交价作为收盘价重新估值，结果与增量累加一致
+        market_value, total = portfolio.market_value, portfolio.total
+        portfolio.revalue(np.array([10.5, 21., 5.]))
+        assert portfolio.market_value == pytest.approx(market_value)
+        assert portfolio.total == pytest.approx(total)
+        np.testing.assert_allclose(portfolio.current_holdings, [4200, 0, 5000])
+    assert batched.commission == pytest.approx(incremental.commission)
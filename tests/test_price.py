@@ -0,0 +1,103 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from simplequant import utils
+from conftest import make_trading_dates
+
+
+DATES = make_trading_dates()
+
+
+def day(i):
+    return str(pd.Timestamp(str(DATES[i])).date())
+
+
+@pytest.fixture
+def raw(bundle_database):
+    stocks = utils.open_h5(os.path.join(bundle_database.data_path, bundle_database.stock_file))
+    return {code: stocks[code][:] for code in stocks}
+
+
+def test_count_and_end_date(bundle_database, raw):
+    df = bundle_database.get_price('600000.XSHG', end_date=day(22), count=5, fields=['close', 'open'], fq=None)
+    assert list(df.columns) == ['close', 'open']
+    assert list(df.index) == list(pd.to_datetime(DATES[18:23].astype(str)))
+    np.testing.assert_allclose(df['close'], raw['600000.XSHG']['close'][18:23])
+    np.testing.assert_allclose(df['open'], raw['600000.XSHG']['open'][18:23])
+
+    df = bundle_database.get_price('600000.XSHG', start_date=day(3), end_date=day(6), fields='close', fq=None)
+    np.testing.assert_allclose(df['close'], raw['600000.XSHG']['close'][3:7])
+
+
+def test_adjust_types_across_ex_date(bundle_database, raw):
+    # 000001.XSHE在第20个交易日除权，累计除权因子从1变为2
+    close = raw['000001.XSHE']['close'][17:23]
+    volume = raw['000001.XSHE']['volume'][17:23]
+    before = np.arange(17, 23) < 20
+    kwargs = dict(start_date=day(17), end_date=day(22), fields=['close', 'volume'])
+
+    df = bundle_database.get_price('000001.XSHE', fq=None, **kwargs)
+    np.testing.assert_allclose(df['close'], close)
+    np.testing.assert_allclose(df['volume'], volume)
+    df = bundle_database.get_price('000001.XSHE', fq='pre', **kwargs)
+    np.testing.assert_allclose(df['close'], np.where(before, close / 2, close))
+    np.testing.assert_allclose(df['volume'], np.where(before, volume * 2, volume))
+    df = bundle_database.get_price('000001.XSHE', fq='post', **kwargs)
+    np.testing.assert_allclose(df['close'], np.where(before, close, close * 2))
+
+    df = bundle_database.historyBars('000001.XSHE', fields='close', end=day(22), bar_count=6, adjust_type='None')
+    np.testing.assert_allclose(df['close'], close)
+    np.testing.assert_array_equal(df['datetime'], DATES[17:23])
+    with pytest.raises(ValueError):
+        bundle_database.get_price('000001.XSHE', fq='both', **kwargs)
+
+
+def test_suspended_days(bundle_database, raw):
+    # 600000.XSHG在第10个交易日停牌，数据包中这一天的成交量为0
+    bars = raw['600000.XSHG']
+    fields = ['open', 'close', 'high', 'volume', 'money', 'paused']
+    df = bundle_database.get_price('600000.XSHG', end_date=day(12), count=5, fields=fields, skip_paused=True, fq=None)
+    assert list(df.index) == list(pd.to_datetime(DATES[[7, 8, 9, 11, 12]].astype(str)))
+    assert not df['paused'].any()
+
+    df = bundle_database.get_price('600000.XSHG', start_date=day(9), end_date=day(11), fields=fields, fq=None)
+    np.testing.assert_array_equal(df['paused'], [0, 1, 0])
+    np.testing.assert_allclose(df.iloc[1][['open', 'close', 'high']], [bars['close'][9]] * 3)
+    assert df.iloc[1]['volume'] == 0 and df.iloc[1]['money'] == 0
+    np.testing.assert_allclose(df['close'].values[[0, 2]], bars['close'][[9, 11]])
+
+    df = bundle_database.get_price('600000.XSHG', start_date=day(9), end_date=day(11), fields=fields, fq=None,
+                                   fill_paused=False)
+    assert df.iloc[1][['open', 'close', 'volume']].isna().all()
+    assert df.iloc[1]['paused'] == 1
+
+    df = bundle_database.historyBars('600000.XSHG', fields=['close'], start=day(8), end=day(11), adjust_type='None')
+    np.testing.assert_array_equal(df['datetime'], DATES[[8, 9, 11]])
+
+
+def test_nan_before_listing(bundle_database, raw):
+    # 000002.XSHE从第5个交易日才上市
+    df = bundle_database.get_price('000002.XSHE', start_date=day(2), end_date=day(6), fields=['close', 'paused'],
+                                   fq=None)
+    assert df['close'].iloc[:3].isna().all()
+    np.testing.assert_allclose(df['close'].iloc[3:], raw['000002.XSHE']['close'][:2])
+    df = bundle_database.get_price('000002.XSHE', end_date=day(6), count=5, fields='close', skip_paused=True, fq=None)
+    np.testing.assert_allclose(df['close'], raw['000002.XSHE']['close'][:2])
+
+
+def test_multiple_securities(bundle_database, raw):
+    codes = ['000001.XSHE', '600000.XSHG']
+    long_df = bundle_database.get_price(codes, end_date=day(30), count=3, fields=['close', 'volume'], fq=None,
+                                        panel=False)
+    assert long_df.shape == (6, 4)
+    assert list(long_df.columns) == ['time', 'code', 'close', 'volume']
+    assert list(long_df['code']) == [codes[0]] * 3 + [codes[1]] * 3
+    np.testing.assert_allclose(long_df['close'], np.concatenate([raw[code]['close'][28:31] for code in codes]))
+
+    panel = bundle_database.get_price(codes, end_date=day(30), count=3, fields=['close', 'volume'], fq=None)
+    assert sorted(panel) == ['close', 'volume']
+    assert panel['close'].shape == (3, 2) and list(panel['close'].columns) == codes
+    np.testing.assert_allclose(panel['close'][codes[1]], raw[codes[1]]['close'][28:31])
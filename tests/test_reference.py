@@ -0,0 +1,121 @@
+import datetime
+import os
+from unittest import mock
+
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+
+from simplequant import utils
+from simplequant.data.database import Database
+from simplequant.data.reference import ReferenceSeriesCache
+from conftest import make_bundle, make_trading_dates
+
+
+DATES = make_trading_dates()
+
+
+@pytest.fixture
+def local_database(tmp_path):
+    data_path = make_bundle(str(tmp_path / 'data'))
+    index = np.zeros(3, dtype=[('datetime', '<u8'), ('close', '<f8')])
+    index['datetime'] = DATES[:3].astype(np.uint64) * 1000000
+    index['close'] = [3000.0, 3010.0, 2990.0]
+    with h5py.File(os.path.join(data_path, 'indexes.h5'), 'w') as indexes:
+        indexes['000300.XSHG'] = index
+    open(os.path.join(data_path, '20195.txt'), 'a').close()
+    db = Database()
+    db.changePath(data_path)
+    return db
+
+
+def test_cache_round_trip(tmp_path):
+    cache = ReferenceSeriesCache(str(tmp_path / 'reference'))
+    assert cache.load('000300.XSHG') is None
+    cache.save('000300.XSHG', [20190102, 20190103], [1.5, 2.5], '20195')
+    dates, values, stamp = cache.load('000300.XSHG')
+    np.testing.assert_array_equal(dates, [20190102, 20190103])
+    np.testing.assert_array_equal(values, [1.5, 2.5])
+    assert stamp == '20195'
+
+
+def test_reference_series_is_cached_per_bundle_version(local_database, monkeypatch):
+    series = local_database.referenceSeries('000300.XSHG')
+    np.testing.assert_array_equal(series.index, DATES[:3])
+    np.testing.assert_array_equal(series.values, [3000.0, 3010.0, 2990.0])
+
+    # 股票取有成交的交易日的前复权收盘价，600000.XSHG第10个交易日停牌
+    stock = local_database.referenceSeries('600000.XSHG')
+    assert len(stock) == len(DATES) - 1 and DATES[10] not in stock.index
+    bar_store = local_database.barStore()
+    assert stock[DATES[11]] == bar_store.bars[bar_store.getSymbolIndex('600000.XSHG'), 11,
+                                              bar_store.field_index['close']]
+
+    # 新的进程直接读取磁盘缓存
+    reloaded = Database()
+    reloaded.changePath(local_database.data_path)
+    with monkeypatch.context() as m:
+        m.setattr(utils, 'open_h5', lambda path: pytest.fail('没有命中缓存'))
+        np.testing.assert_array_equal(reloaded.referenceSeries('000300.XSHG').values, series.values)
+        assert reloaded.referenceSeries('000300.XSHG') is reloaded.referenceSeries('000300.XSHG')
+
+    # 数据包版本变化后重新生成
+    os.rename(os.path.join(local_database.data_path, '20195.txt'), os.path.join(local_database.data_path, '20196.txt'))
+    reloaded.changePath(local_database.data_path)
+    reloaded.referenceSeries('000300.XSHG')
+    cache = ReferenceSeriesCache(os.path.join(local_database.data_path, local_database.reference_dir))
+    assert cache.load('000300.XSHG')[2] == '20196'
+
+
+def mock_jqdata(database, days, rates):
+    """
+    代替jqdatasdk的macro.run_query，返回run_query的mock
+    """
+    macro = mock.MagicMock()
+    if isinstance(rates, Exception):
+        macro.run_query.side_effect = rates
+    else:
+        macro.run_query.return_value = pd.DataFrame({'day': days, 'interest_rate': rates})
+    database.macro = macro
+    database.query = mock.MagicMock()
+    database.is_auth = lambda: True
+    return macro.run_query
+
+
+def test_risk_free_rate_is_downloaded_once(local_database):
+    run_query = mock_jqdata(local_database, ['2019-01-02', '2019-01-03'], [2.5, 2.4])
+    rates = local_database.riskFreeRate(end=20190103)
+    np.testing.assert_array_equal(rates.index, [20190102, 20190103])
+    np.testing.assert_array_equal(rates.values, [2.5, 2.4])
+    assert local_database.riskFreeRate(end=20190103) is rates
+    # 当天已经下载过，本地序列没有覆盖到end也不再重复下载
+    local_database.riskFreeRate(end=20190110)
+    assert run_query.call_count == 1
+
+    reloaded = Database()
+    reloaded.changePath(local_database.data_path)
+    run_query = mock_jqdata(reloaded, [], [])
+    np.testing.assert_array_equal(reloaded.riskFreeRate(end=20190103).values, [2.5, 2.4])
+    assert run_query.call_count == 0
+
+
+def test_stale_risk_free_rate_is_refreshed_or_kept_offline(local_database):
+    cache = ReferenceSeriesCache(os.path.join(local_database.data_path, local_database.reference_dir))
+    cache.save('rate_SHIBOR', [20190102], [2.5], '20000101')
+
+    run_query = mock_jqdata(local_database, [], IOError('offline'))
+    np.testing.assert_array_equal(local_database.riskFreeRate(end=20190103).values, [2.5])
+    assert run_query.call_count == 1
+
+    local_database.changePath(local_database.data_path)
+    run_query = mock_jqdata(local_database, ['2019-01-02', '2019-01-03'], [2.5, 2.4])
+    np.testing.assert_array_equal(local_database.riskFreeRate(end=20190103).values, [2.5, 2.4])
+    assert run_query.call_count == 1
+    assert cache.load('rate_SHIBOR')[2] == datetime.date.today().strftime('%Y%m%d')
+
+    fresh = Database()
+    fresh.changePath(str(os.path.join(local_database.data_path, 'empty')))
+    mock_jqdata(fresh, [], IOError('offline'))
+    with pytest.raises(IOError):
+        fresh.riskFreeRate(end=20190103)
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from simplequant.data.tradingcalendar import TradingCalendar
+
+
+@pytest.fixture
+def calendar():
+    # 2019-01-31为周四，2019-02-01为周五，之后春节休市到2019-02-11
+    return TradingCalendar(np.array([20190128, 20190129, 20190130, 20190131, 20190201, 20190211, 20190212,
+                                     20190329, 20190401]))
+
+
+def test_offset(calendar):
+    assert calendar.offset(20190131, 1) == 20190201
+    assert calendar.offset(20190131, -3) == 20190128
+    assert calendar.offset(20190205, 1) == 20190211  # 非交易日从之前最近的交易日开始数
+    assert calendar.offset(20190205, -1) == 20190201  # 向前从之后最近的交易日开始数
+    assert calendar.offset(20190205, 0) == 20190201
+    assert calendar.nextTradingDate(20190201) == 20190211
+    assert calendar.previousTradingDate(20190211, 2) == 20190131
+    with pytest.raises(IndexError):
+        calendar.offset(20190401, 1)
+    with pytest.raises(IndexError):
+        calendar.offset(20190128, -1)
+
+
+def test_period_flags(calendar):
+    assert calendar.isMonthEnd(20190131) and not calendar.isMonthEnd(20190130)
+    assert calendar.isMonthStart(20190201) and calendar.isMonthStart(20190128)
+    assert calendar.isWeekEnd(20190201) and calendar.isWeekStart(20190211)
+    assert not calendar.isWeekEnd(20190131)
+    assert calendar.isQuarterEnd(20190329) and calendar.isQuarterStart(20190401)
+    assert calendar.isWeekEnd(20190401)  # 最后一个交易日视为周期的最后一天
+    np.testing.assert_array_equal(calendar.getMonthEnds(), [20190131, 20190212, 20190329, 20190401])
+    np.testing.assert_array_equal(calendar.getWeekEnds(20190130, 20190212), [20190201, 20190212])
+    np.testing.assert_array_equal(calendar.getQuarterEnds(end=20190331), [20190329])
+
+
+def test_trading_dates(calendar):
+    np.testing.assert_array_equal(calendar.getTradingDates(20190202, 20190212), [20190211, 20190212])
+    np.testing.assert_array_equal(calendar.getTradingDates(end=20190129), [20190128, 20190129])
+    assert calendar.isTradingDate(20190211) and not calendar.isTradingDate(20190204)
+    assert calendar.getIndex(20190211) == 5
+    with pytest.raises(KeyError):
+        calendar.getIndex(20190204)
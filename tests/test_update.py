@@ -0,0 +1,237 @@
+import os
+
+import numpy as np
+import pytest
+
+from simplequant import utils
+from simplequant.data.barstore import BarStore
+from conftest import make_bundle, months_ago
+
+
+def test_update_twice_reports_unchanged_files(tmp_path, bundle_server, database, capsys):
+    year, month = months_ago(1)
+    bundle_server.publish(make_bundle(str(tmp_path / 'v1')), year, month)
+    database.changeCDN(bundle_server.cdn_url)
+
+    assert database.update()
+    version = str(year) + str(month)
+    assert database.getBundleVersion() == version
+    assert BarStore.isValid(os.path.join(database.data_path, database.bar_store_dir), version)
+    stocks_path = os.path.join(database.data_path, database.stock_file)
+    inode = os.stat(stocks_path).st_ino
+    capsys.readouterr()
+
+    assert database.update(force=True)
+    assert 'changed files: []' in capsys.readouterr().out
+    assert os.stat(stocks_path).st_ino == inode
+    assert not os.path.exists(os.path.join(database.data_path, database.update_lock_file))
+
+
+def test_update_skips_probe_for_current_month(tmp_path, bundle_server, database, capsys):
+    year, month = months_ago(0)
+    bundle_server.publish(make_bundle(str(tmp_path / 'v1')), year, month)
+    database.changeCDN(bundle_server.cdn_url)
+    assert database.update()
+    capsys.readouterr()
+
+    database.changeCDN('http://127.0.0.1:1/unreachable_%04d%02d.tar.bz2')
+    assert database.update()
+    assert 'try' not in capsys.readouterr().out
+
+
+def test_probe_is_recorded_for_the_day(tmp_path, bundle_server, database, capsys):
+    year, month = months_ago(1)
+    bundle_server.publish(make_bundle(str(tmp_path / 'v1')), year, month)
+    database.changeCDN(bundle_server.cdn_url)
+    assert database.update()
+    capsys.readouterr()
+
+    database.changeCDN(bundle_server.cdn_url)  # 清空进程内的探测结果
+    assert database.update()
+    assert 'try' not in capsys.readouterr().out
+
+
+BUNDLE_FILES = ('stocks.h5', 'ex_cum_factor.h5', 'trading_dates.npy')
+
+
+def read_files(path):
+    contents = {}
+    for file_name in BUNDLE_FILES:
+        with open(os.path.join(path, file_name), 'rb') as f:
+            contents[file_name] = f.read()
+    return contents
+
+
+def fail_second_swap(monkeypatch):
+    """
+    让第二个暂存文件的替换出错，返回已经替换的文件列表
+    """
+    real_replace = os.replace
+    swapped = []
+
+    def failing_replace(src, dst):
+        if '.staging' in src:
+            if swapped:
+                raise OSError('disk full')
+            swapped.append(dst)
+        return real_replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', failing_replace)
+    return swapped
+
+
+def test_failed_swap_restores_old_files(tmp_path, bundle_server, database, monkeypatch):
+    old_year, old_month = months_ago(1)
+    bundle_server.publish(make_bundle(str(tmp_path / 'v1')), old_year, old_month)
+    database.changeCDN(bundle_server.cdn_url)
+    assert database.update()
+    old_version = database.getBundleVersion()
+    old_files = read_files(str(tmp_path / 'v1'))
+    old_close = database.barStore().bars[0, -1, database.barStore().field_index['close']]
+
+    # 新版本的stocks.h5和trading_dates.npy不同，替换完第一个之后出错
+    year, month = months_ago(0)
+    bundle_server.publish(make_bundle(str(tmp_path / 'v2'), seed=1, n_dates=41), year, month)
+    new_files = read_files(str(tmp_path / 'v2'))
+    assert new_files['stocks.h5'] != old_files['stocks.h5']
+    assert new_files['trading_dates.npy'] != old_files['trading_dates.npy']
+    with monkeypatch.context() as m:
+        swapped = fail_second_swap(m)
+        with pytest.raises(OSError):
+            database.update(force=True)
+    assert len(swapped) == 1
+
+    # 已经替换的文件恢复为原有的文件，数据目录中只有旧版本的文件
+    assert read_files(database.data_path) == old_files
+    assert database.getBundleVersion() == old_version
+    assert database._readProbe()[:2] == (old_year, old_month)
+    for name in (database.update_lock_file, database.swap_marker_file, database.swap_backup_dir):
+        assert not os.path.exists(os.path.join(database.data_path, name))
+    database.changePath(database.data_path)
+    store = database.barStore()
+    assert store.meta['version'] == old_version
+    assert store.bars[0, -1, store.field_index['close']] == old_close
+
+    assert database.update(force=True)
+    assert read_files(database.data_path) == new_files
+    assert database.getBundleVersion() == str(year) + str(month)
+    assert database.barStore().meta['version'] == str(year) + str(month)
+    assert database.barStore().bars[0, -1, database.barStore().field_index['close']] != old_close
+    assert not os.path.exists(os.path.join(database.data_path, database.swap_backup_dir))
+
+
+def test_swap_interrupted_by_exit_is_recovered_on_load(tmp_path, bundle_server, database, monkeypatch):
+    old_year, old_month = months_ago(1)
+    bundle_server.publish(make_bundle(str(tmp_path / 'v1')), old_year, old_month)
+    database.changeCDN(bundle_server.cdn_url)
+    assert database.update()
+    old_version = database.getBundleVersion()
+    old_files = read_files(str(tmp_path / 'v1'))
+
+    # 进程在替换的中途退出：不会执行恢复，也不会释放更新锁
+    year, month = months_ago(0)
+    bundle_server.publish(make_bundle(str(tmp_path / 'v2'), seed=1, n_dates=41), year, month)
+    with monkeypatch.context() as m:
+        fail_second_swap(m)
+        m.setattr(database, '_rollbackSwap', lambda changed_files: None)
+        m.setattr(database, '_recoverSwap', lambda locked=False: False)
+        m.setattr(database, '_releaseUpdateLock', lambda: None)
+        with pytest.raises(OSError):
+            database.update(force=True)
+    # 新旧版本的文件混杂，数据包视为不完整
+    assert os.path.exists(os.path.join(database.data_path, database.swap_marker_file))
+    assert database.getBundleVersion() is None
+    assert not database._hasLocalBundle()
+
+    lock_path = os.path.join(database.data_path, database.update_lock_file)
+    os.utime(lock_path, (0, 0))  # 退出的进程留下的锁已经过期
+    database.changePath(database.data_path)
+    database.changeCDN('http://127.0.0.1:1/unreachable_%04d%02d.tar.bz2')
+    database.load()
+    assert read_files(database.data_path) == old_files
+    assert database.getBundleVersion() == old_version
+    assert not os.path.exists(os.path.join(database.data_path, database.swap_marker_file))
+    assert database.barStore().meta['version'] == old_version
+
+
+def test_swap_marker_after_timestamp_keeps_new_files(tmp_path, bundle_server, database, monkeypatch):
+    year, month = months_ago(1)
+    bundle_server.publish(make_bundle(str(tmp_path / 'v1')), year, month)
+    database.changeCDN(bundle_server.cdn_url)
+    with monkeypatch.context() as m:
+        m.setattr(database, '_finishSwap', lambda: None)  # 写入时间戳之后退出
+        assert database.update()
+    assert database.getBundleVersion() is None
+
+    database.changeCDN(bundle_server.cdn_url)
+    assert database._recoverSwap()
+    assert database.getBundleVersion() == str(year) + str(month)
+    assert read_files(database.data_path) == read_files(str(tmp_path / 'v1'))
+    assert not os.path.exists(os.path.join(database.data_path, database.swap_backup_dir))
+
+
+def test_update_returns_false_while_another_process_holds_lock(tmp_path, bundle_server, database):
+    year, month = months_ago(1)
+    bundle_server.publish(make_bundle(str(tmp_path / 'v1')), year, month)
+    database.changeCDN(bundle_server.cdn_url)
+    os.makedirs(database.data_path)
+    lock_path = os.path.join(database.data_path, database.update_lock_file)
+    with open(lock_path, 'w') as f:
+        f.write('1')
+
+    assert database.update() is False
+    assert database.getBundleVersion() is None
+    assert os.path.exists(lock_path)
+
+
+def test_bar_store_build_keeps_existing_store_of_same_version(tmp_path):
+    store_path = str(tmp_path / 'bar_store')
+    dates = [20190102, 20190103]
+    bars = np.zeros(2, dtype=[('datetime', '<i8'), ('close', '<f8')])
+    bars['datetime'] = dates
+    bars['close'] = [1.0, 2.0]
+    first = BarStore.build(store_path, [('a', bars)], ['a'], np.array(dates), '20195')
+    bars['close'] = [3.0, 4.0]
+    second = BarStore.build(store_path, [('a', bars)], ['a'], np.array(dates), '20195')
+    assert second.bars[0, 1, 0] == first.bars[0, 1, 0] == 2.0
+    assert [name for name in os.listdir(str(tmp_path)) if '.building' in name] == []
+
+
+def test_bar_store_is_not_rebuilt_while_another_process_updates(tmp_path, bundle_server, database, capsys):
+    year, month = months_ago(1)
+    bundle_server.publish(make_bundle(str(tmp_path / 'v1')), year, month)
+    database.changeCDN(bundle_server.cdn_url)
+    assert database.update()
+    store_path = os.path.join(database.data_path, database.bar_store_dir)
+    BarStore.restamp(store_path, '20001')  # 更新进程已经生成了新版本的存储，但还没有写入时间戳
+    with open(os.path.join(database.data_path, database.update_lock_file), 'w') as f:
+        f.write('1')
+    capsys.readouterr()
+
+    database.changePath(database.data_path)
+    assert database.barStore().meta['version'] == '20001'
+    assert 'building bar store' not in capsys.readouterr().out
+
+
+def test_load_keeps_local_bundle_when_new_archive_is_truncated(tmp_path, bundle_server, database, capsys):
+    old_year, old_month = months_ago(1)
+    bundle_server.publish(make_bundle(str(tmp_path / 'v1')), old_year, old_month)
+    database.changeCDN(bundle_server.cdn_url)
+    assert database.update()
+    old_files = read_files(database.data_path)
+
+    year, month = months_ago(0)
+    tar_path = bundle_server.publish(make_bundle(str(tmp_path / 'v2'), seed=1, n_dates=41), year, month)
+    with open(tar_path, 'rb') as f:
+        data = f.read()
+    with open(tar_path, 'wb') as f:
+        f.write(data[:len(data) // 2])
+
+    os.remove(os.path.join(database.data_path, database.probe_file))  # 第二天重新探测
+    database.changeCDN(bundle_server.cdn_url)
+    capsys.readouterr()
+    database.load()
+    assert 'failed to update data' in capsys.readouterr().out
+    assert database.isLoaded()
+    assert database.getBundleVersion() == str(old_year) + str(old_month)
+    assert read_files(database.data_path) == old_files